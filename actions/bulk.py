@@ -0,0 +1,56 @@
+# pylint: disable=no-member
+
+from easydict import EasyDict
+from lib.bulk_loader import BulkLoader
+from lib.client_pool import DEFAULT_POOL_MAXSIZE
+from lib.esbase_action import ESBaseAction
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+class BulkRunner(ESBaseAction):
+
+    def run(self, action=None, log_level='WARNING', operation_timeout=600, **kwargs):
+        kwargs.update({
+            'timeout': int(operation_timeout),
+            'log_level': log_level
+        })
+
+        config = EasyDict(self.config)
+        self.config = EasyDict(kwargs)
+
+        self.apply_pack_config(config)
+        # Keep a pooled connection for every concurrent bulk request
+        self.config.pool_maxsize = max(int(self.config.get('pool_maxsize') or
+                                           DEFAULT_POOL_MAXSIZE),
+                                       int(self.config.get('concurrency') or 1))
+
+        self.set_up_logging()
+        return self.exit_on_client_error(self.bulk_index)
+
+    def bulk_index(self):
+        """Stream JSON lines documents from a file or stdin into the _bulk API.
+        """
+        o = self.config
+        loader = BulkLoader(self.client, index=o.index, doc_type=o.get('doc_type') or 'doc',
+                            op_type=o.get('op_type') or 'index', id_field=o.get('id_field'),
+                            pipeline=o.get('pipeline'),
+                            batch_size=o.get('batch_size') or 1000,
+                            batch_bytes=o.get('batch_bytes') or 5 * 1024 * 1024,
+                            concurrency=o.get('concurrency') or 1,
+                            max_retries=o.get('max_retries', 3),
+                            initial_backoff=o.get('initial_backoff', 1))
+
+        input_file = o.get('input_file') or '-'
+        if input_file == '-':
+            summary = loader.load(sys.stdin.buffer)
+        else:
+            with open(input_file, 'rb') as fh:
+                summary = loader.load(fh)
+
+        if o.get('refresh') and summary['indexed']:
+            self.client.indices.refresh(index=o.index)
+
+        return summary['failed'] == 0, self.with_metrics(summary)
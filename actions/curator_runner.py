@@ -12,6 +12,14 @@ class CuratorRunner(CuratorAction):
     def run(self, action=None, log_level='WARNING', dry_run=False, operation_timeout=600, **kwargs):
         """Curator based action entry point
         """
+        forwarded, outcome = self.run_in_worker('curator', dict(
+            kwargs, action=action, log_level=log_level, dry_run=dry_run,
+            operation_timeout=operation_timeout))
+        if forwarded:
+            if outcome is not None and isinstance(outcome[1], dict):
+                self.track(outcome[1])
+            return outcome
+
         self._action = action
         kwargs.update({
             'timeout': int(operation_timeout),
@@ -22,10 +30,7 @@ class CuratorRunner(CuratorAction):
         config = EasyDict(self.config)
         self.config = EasyDict(kwargs)
 
-        if config.get('host') is not None:
-            self.config.update({'host': config.get('host')})
-        if config.get('port') is not None:
-            self.config.update({'port': config.get('port')})
+        self.apply_pack_config(config)
 
         self.set_up_logging()
-        self.do_command()
+        return self.exit_on_client_error(self.do_command)
@@ -0,0 +1,57 @@
+# pylint: disable=no-member
+
+from easydict import EasyDict
+from lib.esbase_action import ESBaseAction
+import copy
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner(ESBaseAction):
+
+    def run(self, action=None, log_level='WARNING', operation_timeout=600, **kwargs):
+        kwargs.update({
+            'timeout': int(operation_timeout),
+            'log_level': log_level
+        })
+
+        config = EasyDict(self.config)
+        self.config = EasyDict(kwargs)
+
+        self.apply_pack_config(config)
+
+        self.set_up_logging()
+        return self.exit_on_client_error(self.run_job)
+
+    def run_job(self):
+        """Run the actions of a curator action file, sharing one fetch of the index metadata.
+        """
+        from lib.admission import admission_controller
+        from lib.catalog import get_catalog
+        from lib.curator_job import CuratorJob, load_job
+
+        o = self.config
+        if o.get('job'):
+            text = o.job
+        elif o.get('job_file'):
+            with open(os.path.expanduser(o.job_file)) as fh:
+                text = fh.read()
+        else:
+            raise ValueError('Give the action file as job_file or its content as job')
+
+        job = CuratorJob(self.client, load_job(text),
+                         catalog=get_catalog(self.client, o, chunker=self.chunker),
+                         dry_run=o.get('dry_run', False), client_for=self.client_for,
+                         admission=admission_controller(self.client, o))
+        result = job.run()
+        return result['success'], self.with_metrics(result)
+
+    def client_for(self, timeout):
+        """Return a client of the same cluster with another request timeout.
+        """
+        runner = copy.copy(self)
+        runner._client = None
+        runner.config = EasyDict(dict(self.config, timeout=timeout))
+        return runner.client
@@ -0,0 +1,189 @@
+# pylint: disable=no-member
+
+from chunking import chunk_index_list
+from curator.cli import CLASS_MAP
+from curator.exceptions import ActionTimeout, FailedExecution
+from curator.utils import ensure_list
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Throttle of a reindex started without one, in documents per second
+INITIAL_REQUESTS_PER_SECOND = 1000
+# Highest throttle without a maximum, as a multiple of the initial one
+MAX_RATE_FACTOR = 20
+# Thread pool indexing bulk requests, called bulk before 6.3
+WRITE_POOLS = ('write', 'bulk')
+
+
+def plan_slices(client, sources, max_slices=20):
+    """
+    Return the number of slices to reindex `sources` with.
+
+    Slicing beyond the number of primary shards doesn't make a reindex
+    faster, so the smallest primary shard count of the sources is used.
+    """
+    shards = []
+    for chunk in chunk_index_list(ensure_list(sources)):
+        settings = client.indices.get_settings(index=','.join(chunk),
+                                               name='index.number_of_shards')
+        shards.extend(int(s['settings']['index']['number_of_shards'])
+                      for s in settings.values())
+    if not shards:
+        return 1
+    return max(1, min(min(shards), int(max_slices)))
+
+
+def write_pool_stats(client):
+    """
+    Return the rejected count summed over the nodes and the longest queue of the write pools.
+    """
+    rejected = queue = 0
+    for node in client.nodes.stats(metric='thread_pool')['nodes'].values():
+        pools = node.get('thread_pool', {})
+        pool = next((pools[name] for name in WRITE_POOLS if name in pools), {})
+        rejected += pool.get('rejected', 0)
+        queue = max(queue, pool.get('queue', 0))
+    return rejected, queue
+
+
+class ThrottleController(object):
+    """
+    Pick the requests_per_second of a reindex from what the cluster reports.
+
+    The throttle is multiplied by `increase` while nothing is rejected and
+    the write queues stay under `queue_limit`, held while they're longer,
+    and multiplied by `decrease` as soon as bulk requests get rejected.
+    It never goes over `maximum`, `MAX_RATE_FACTOR` times `initial` when 0,
+    so that it comes back down in a few steps once rejections start.
+    """
+
+    def __init__(self, initial, minimum=10, maximum=0, increase=1.5, decrease=0.5,
+                 queue_limit=50):
+        self.rate = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum or self.rate * MAX_RATE_FACTOR)
+        self.increase = increase
+        self.decrease = decrease
+        self.queue_limit = queue_limit
+
+    def update(self, rejected, queue):
+        """
+        Return the new throttle and the reason for it, or None when it's unchanged.
+        """
+        if rejected > 0:
+            rate, reason = max(self.minimum, self.rate * self.decrease), 'rejections'
+        elif queue > self.queue_limit:
+            return None, 'queue'
+        else:
+            rate, reason = min(self.rate * self.increase, self.maximum), 'headroom'
+        if rate == self.rate:
+            return None, reason
+        self.rate = rate
+        return rate, reason
+
+
+class AdaptiveReindex(object):
+    """
+    Reindex the selected indices with planned slices and a throttle following the cluster load.
+
+    Every `interval` seconds the reindex task status and the write thread
+    pools of the nodes are read, new rejections or retried bulk requests
+    slow the reindex down through the rethrottle API, and idle write queues
+    speed it up. A task still running after `max_wait` seconds is cancelled.
+    """
+
+    def __init__(self, client, ilo, kwargs, interval=10, max_slices=20, min_rate=10,
+                 max_rate=0, queue_limit=50):
+        self.client = client
+        self.action = CLASS_MAP['reindex'](ilo, **dict(kwargs, wait_for_completion=False))
+        self.interval = float(interval)
+        self.max_slices = max_slices
+        self.max_wait = int(kwargs.get('max_wait') or -1)
+        rate = kwargs.get('requests_per_second')
+        if rate in (None, -1, '-1', 'unlimited'):
+            rate = INITIAL_REQUESTS_PER_SECOND
+        self.controller = ThrottleController(rate, minimum=min_rate, maximum=max_rate,
+                                             queue_limit=queue_limit)
+
+    def run(self):
+        results = [self.reindex(source, dest) for source, dest in self.action.sources()]
+        return {'success': all(r['success'] for r in results), 'reindexed': results}
+
+    def cancel(self, task_id):
+        """
+        Cancel the reindex task `task_id`, logging rather than raising when it can't be.
+        """
+        try:
+            self.client.tasks.cancel(task_id=task_id)
+            logger.warning("Cancelled reindex task %s", task_id)
+        except Exception as e:  # noqa
+            logger.error("Failed to cancel reindex task %s, it's still running: %s", task_id, e)
+
+    def reindex(self, source, dest):
+        action = self.action
+        # Remote reindexing can't be sliced
+        action.slices = 1 if action.remote else plan_slices(self.client, source,
+                                                            self.max_slices)
+        action.requests_per_second = self.controller.rate
+        task_id = self.client.reindex(**action._get_reindex_args(source, dest))['task']
+        logger.info("Reindexing %s into %s with %d slices at %s requests per second, task %s",
+                    source, dest, action.slices, self.controller.rate, task_id)
+
+        started = time.time()
+        adjustments = []
+        rejected, _ = write_pool_stats(self.client)
+        retries = 0
+        while True:
+            time.sleep(self.interval)
+            task = self.client.tasks.get(task_id=task_id)
+            status = task.get('task', {}).get('status') or {}
+            if task.get('completed'):
+                break
+            if self.max_wait > 0 and time.time() - started > self.max_wait:
+                self.cancel(task_id)
+                raise ActionTimeout('Reindex task {0} still running after {1} seconds'.format(
+                    task_id, self.max_wait))
+
+            now_rejected, queue = write_pool_stats(self.client)
+            now_retries = status.get('retries', {}).get('bulk', 0)
+            # Counters start over when a node restarts, a drop isn't a rejection
+            new_rejections = max(0, now_rejected - rejected) + max(0, now_retries - retries)
+            rejected, retries = now_rejected, now_retries
+            rate, reason = self.controller.update(new_rejections, queue)
+            if rate is not None:
+                self.client.reindex_rethrottle(task_id=task_id, requests_per_second=rate)
+                adjustments.append({'elapsed': round(time.time() - started, 1),
+                                    'requests_per_second': rate, 'reason': reason,
+                                    'rejections': new_rejections, 'queue': queue})
+                logger.info("Rethrottled task %s to %s requests per second (%s)", task_id,
+                            rate, reason)
+
+        response = task.get('response') or {}
+        failures = response.get('failures') or []
+        error = task.get('error')
+        if not error and not failures:
+            try:
+                action._post_run_quick_check(dest)
+            except FailedExecution as e:
+                error = str(e)
+        if error or failures:
+            logger.error("Reindex of %s into %s failed: %s", source, dest,
+                         error or failures[:10])
+        took = time.time() - started
+        docs = sum(response.get(k, 0) for k in ('created', 'updated', 'deleted'))
+        return {
+            'source': source,
+            'dest': dest,
+            'task': task_id,
+            'success': not error and not failures,
+            'slices': action.slices,
+            'docs': docs,
+            'took': round(took, 3),
+            'docs_per_second': round(docs / took, 1) if took else None,
+            'requests_per_second': self.controller.rate,
+            'adjustments': adjustments,
+            'error': error,
+            'failures': failures[:10]
+        }
@@ -0,0 +1,142 @@
+# pylint: disable=no-member
+
+from adaptive_reindex import WRITE_POOLS
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Policies when the cluster is over a limit, none turns admission control off
+POLICIES = ('none', 'wait', 'reduce', 'refuse')
+HEALTH = ('green', 'yellow', 'red')
+# Limits a lower concurrency doesn't help with, the reduce policy refuses over them
+HARD_CHECKS = ('health', 'disk')
+
+
+def admission_controller(client, opts, policy=None):
+    """
+    Return the AdmissionController of `policy`, admission_policy of `opts`
+    by default, with the admission limits of `opts`, or None when the
+    policy is none.
+    """
+    policy = policy or opts.get('admission_policy') or 'none'
+    if policy == 'none':
+        return None
+    return AdmissionController(
+        client, policy=policy, max_status=opts.get('admission_max_status') or 'yellow',
+        max_pending_tasks=opts.get('admission_max_pending_tasks', 50),
+        max_write_queue=opts.get('admission_max_write_queue', 100),
+        max_search_queue=opts.get('admission_max_search_queue', 500),
+        max_disk_percent=opts.get('admission_max_disk_percent', 85),
+        timeout=600 if opts.get('admission_timeout') is None else opts['admission_timeout'])
+
+
+def cluster_load(client):
+    """
+    Return the health, pending tasks, longest write and search queues and
+    fullest disk of the cluster, read with two requests.
+    """
+    health = client.cluster.health()
+    load = {
+        'status': health['status'],
+        'pending_tasks': health.get('number_of_pending_tasks', 0),
+        'write_queue': 0,
+        'search_queue': 0,
+        'disk_used_percent': 0.0
+    }
+    for node in client.nodes.stats(metric='thread_pool,fs')['nodes'].values():
+        pools = node.get('thread_pool', {})
+        write = next((pools[name] for name in WRITE_POOLS if name in pools), {})
+        load['write_queue'] = max(load['write_queue'], write.get('queue', 0))
+        load['search_queue'] = max(load['search_queue'], pools.get('search', {}).get('queue', 0))
+        disk = node.get('fs', {}).get('total', {})
+        if disk.get('total_in_bytes'):
+            # Disk watermarks are checked against the space left to Elasticsearch
+            used = 100.0 - 100.0 * disk.get('available_in_bytes', 0) / disk['total_in_bytes']
+            load['disk_used_percent'] = round(max(load['disk_used_percent'], used), 1)
+    return load
+
+
+class AdmissionController(object):
+    """
+    Decide whether a heavy operation may start, from the load of the cluster.
+
+    The cluster is over its limits when its health is worse than
+    `max_status`, or when its pending tasks, the longest write or search
+    queue of a node or the fullest disk go over their limit. A limit of
+    None isn't checked. Over a limit, the `wait` policy checks again with
+    a backoff doubling from `interval` to `max_interval` seconds and
+    refuses once `timeout` seconds have passed, `reduce` admits the
+    operation at a lower concurrency unless the health or disk limit is
+    crossed, and `refuse` refuses it.
+    """
+
+    def __init__(self, client, policy='wait', max_status='yellow', max_pending_tasks=50,
+                 max_write_queue=100, max_search_queue=500, max_disk_percent=85,
+                 timeout=600, interval=10, max_interval=120):
+        if policy not in POLICIES:
+            raise ValueError('Unknown admission policy {0}, use one of {1}'.format(
+                policy, ', '.join(POLICIES)))
+        if max_status not in HEALTH:
+            raise ValueError('Unknown cluster health {0}'.format(max_status))
+        self.client = client
+        self.policy = policy
+        self.max_status = max_status
+        self.limits = (('pending_tasks', 'pending_tasks', max_pending_tasks),
+                       ('write_queue', 'write_queue', max_write_queue),
+                       ('search_queue', 'search_queue', max_search_queue),
+                       ('disk', 'disk_used_percent', max_disk_percent))
+        self.timeout = float(timeout)
+        self.interval = float(interval)
+        self.max_interval = float(max_interval)
+
+    def violations(self, load):
+        """
+        Return the limits `load` is over.
+        """
+        found = []
+        if HEALTH.index(load['status']) > HEALTH.index(self.max_status):
+            found.append({'check': 'health', 'value': load['status'], 'limit': self.max_status})
+        for check, key, limit in self.limits:
+            if limit is not None and load[key] > limit:
+                found.append({'check': check, 'value': load[key], 'limit': limit})
+        return found
+
+    def admit(self):
+        """
+        Return the decision, `admitted`, `reduced` or `refused`, with the
+        load and the violated limits it was made on.
+        """
+        started = time.time()
+        delay = self.interval
+        checks = 0
+        while True:
+            load = cluster_load(self.client)
+            checks += 1
+            violations = self.violations(load)
+            if not violations:
+                decision = 'admitted'
+                break
+            if self.policy == 'reduce' and not any(v['check'] in HARD_CHECKS
+                                                   for v in violations):
+                decision = 'reduced'
+                break
+            if self.policy != 'wait' or time.time() - started + delay > self.timeout:
+                decision = 'refused'
+                break
+            logger.info("Cluster over its admission limits (%s), checking again in %ss",
+                        ', '.join(v['check'] for v in violations), delay)
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_interval)
+
+        log = logger.warning if decision == 'refused' else logger.info
+        log("Operation %s by the %s admission policy: %s", decision, self.policy,
+            violations or 'within limits')
+        return {
+            'decision': decision,
+            'policy': self.policy,
+            'checks': checks,
+            'waited': round(time.time() - started, 1),
+            'load': load,
+            'violations': violations
+        }
@@ -0,0 +1,151 @@
+# pylint: disable=no-member
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Single value metrics accepted in the `metrics` spec
+METRICS = ('avg', 'min', 'max', 'sum', 'value_count', 'cardinality')
+# First version with composite aggregations
+COMPOSITE_VERSION = (6, 1, 0)
+
+
+def parse_metrics(specs):
+    """
+    Turn `type:field` metric specs into {name: aggregation} pairs.
+
+    The metric of `avg:http.bytes` is named `avg_http_bytes`.
+    """
+    metrics = []
+    for spec in specs or []:
+        kind, _, field = spec.partition(':')
+        if kind not in METRICS or not field:
+            raise ValueError('Invalid metric {0}, expected one of {1} followed by :field'.format(
+                spec, ', '.join(METRICS)))
+        name = '{0}_{1}'.format(kind, field.replace('.', '_'))
+        metrics.append((name, {kind: {'field': field}}))
+    return metrics
+
+
+def group_by(date_field=None, interval=None, time_zone=None, terms=None):
+    """
+    Return the (name, source) pairs grouping the buckets, time first then terms.
+    """
+    sources = []
+    if interval:
+        histogram = {'field': date_field or '@timestamp', 'interval': interval}
+        if time_zone:
+            histogram['time_zone'] = time_zone
+        sources.append((date_field or '@timestamp', {'date_histogram': histogram}))
+    for field in terms or []:
+        sources.append((field, {'terms': {'field': field}}))
+    if not sources:
+        raise ValueError('Give an interval, terms fields or both to group buckets by')
+    return sources
+
+
+class Aggregation(object):
+    """
+    Run a grouped aggregation with `size: 0` and return its buckets as a flat table.
+
+    Every row holds the key of each grouping source, the `doc_count` and
+    the value of each metric. Clusters supporting composite aggregations
+    are paged through `page_size` buckets at a time, older ones get nested
+    date_histogram and terms aggregations in a single request. At most
+    `max_buckets` rows are returned, `after_key` then tells where to resume.
+    """
+
+    def __init__(self, client, index='_all', query=None, sources=None, metrics=None,
+                 page_size=1000, max_buckets=10000, after=None, composite=True):
+        self.client = client
+        self.index = index
+        self.query = query or {'match_all': {}}
+        self.sources = sources or []
+        self.metrics = metrics or []
+        self.page_size = int(page_size)
+        self.max_buckets = int(max_buckets)
+        self.after = after
+        self.composite = composite
+        self.columns = [name for name, _ in self.sources] + ['doc_count'] + \
+            [name for name, _ in self.metrics]
+
+    def _row(self, keys, bucket):
+        row = dict(keys)
+        row['doc_count'] = bucket['doc_count']
+        for name, _ in self.metrics:
+            row[name] = bucket[name]['value']
+        return row
+
+    def run(self):
+        if self.composite:
+            return self._composite()
+        return self._nested()
+
+    def _composite(self):
+        rows = []
+        pages = total = 0
+        after = self.after
+        truncated = False
+        while True:
+            size = min(self.page_size, self.max_buckets - len(rows))
+            composite = {'size': size,
+                         'sources': [{name: source} for name, source in self.sources]}
+            if after:
+                composite['after'] = after
+            body = {'size': 0, 'query': self.query,
+                    'aggs': {'groups': {'composite': composite,
+                                        'aggs': dict(self.metrics)}}}
+            response = self.client.search(index=self.index, body=body)
+            pages += 1
+            total = response['hits']['total']
+            groups = response['aggregations']['groups']
+            buckets = groups['buckets']
+            for bucket in buckets:
+                rows.append(self._row(bucket['key'].items(), bucket))
+            if len(buckets) < size:
+                after = None
+                break
+            # after_key is only returned from 6.3, the last key is the same position
+            after = groups.get('after_key') or buckets[-1]['key']
+            if len(rows) >= self.max_buckets:
+                truncated = True
+                break
+        logger.info("Aggregated %d buckets in %d pages", len(rows), pages)
+        return {'total': total, 'columns': self.columns, 'rows': rows, 'pages': pages,
+                'truncated': truncated, 'after_key': after}
+
+    def _nested(self):
+        aggs = dict(self.metrics)
+        for name, source in reversed(self.sources):
+            source = dict((kind, dict(spec)) for kind, spec in source.items())
+            if 'terms' in source:
+                source['terms']['size'] = self.max_buckets
+            else:
+                # Composite aggregations skip empty buckets, do the same
+                source['date_histogram']['min_doc_count'] = 1
+            source['aggs'] = aggs
+            aggs = {name: source}
+        response = self.client.search(index=self.index, body={
+            'size': 0, 'query': self.query, 'aggs': aggs})
+
+        rows = []
+        state = {'truncated': False}
+
+        def walk(level, aggregations, keys):
+            name = self.sources[level][0]
+            result = aggregations[name]
+            if result.get('sum_other_doc_count'):
+                state['truncated'] = True
+            for bucket in result['buckets']:
+                bucket_keys = keys + [(name, bucket['key'])]
+                if level + 1 < len(self.sources):
+                    walk(level + 1, bucket, bucket_keys)
+                else:
+                    rows.append(self._row(bucket_keys, bucket))
+
+        walk(0, response['aggregations'], [])
+        truncated = state['truncated'] or len(rows) > self.max_buckets
+        logger.info("Aggregated %d buckets", len(rows))
+        return {'total': response['hits']['total'], 'columns': self.columns,
+                'rows': rows[:self.max_buckets], 'pages': 1, 'truncated': truncated,
+                'after_key': None}
@@ -0,0 +1,193 @@
+# pylint: disable=no-member
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from elasticsearch import TransportError
+from instrumentation import with_context
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BATCH_BYTES = 5 * 1024 * 1024
+# Item error type returned when a node's bulk queue is full
+REJECTED_ERROR = 'es_rejected_execution_exception'
+
+
+def is_rejected(item):
+    """
+    Return True when a bulk response item was rejected and is worth retrying.
+    """
+    if item.get('status') == 429:
+        return True
+    error = item.get('error')
+    return isinstance(error, dict) and error.get('type') == REJECTED_ERROR
+
+
+class BulkLoader(object):
+    """
+    Send JSON lines documents to the _bulk API.
+
+    Documents are read one line at a time and grouped into batches of at
+    most `batch_size` documents and `batch_bytes` bytes, of which at most
+    `concurrency` are in flight. Only the items rejected because the
+    cluster is overloaded are sent again, up to `max_retries` times with
+    an exponential backoff starting at `initial_backoff` seconds.
+    """
+
+    def __init__(self, client, index, doc_type='doc', op_type='index', id_field=None,
+                 pipeline=None, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=DEFAULT_BATCH_BYTES,
+                 concurrency=1, max_retries=3, initial_backoff=1, max_errors=10):
+        self.client = client
+        self.index = index
+        self.doc_type = doc_type
+        self.op_type = op_type
+        self.id_field = id_field
+        self.params = {'pipeline': pipeline} if pipeline else {}
+        self.batch_size = max(int(batch_size), 1)
+        self.batch_bytes = max(int(batch_bytes), 1)
+        self.concurrency = max(int(concurrency), 1)
+        self.max_retries = int(max_retries)
+        self.initial_backoff = float(initial_backoff)
+        self.max_errors = int(max_errors)
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        self.errors = Counter()
+        self.error_samples = []
+
+    def _meta(self, source):
+        meta = {'_index': self.index, '_type': self.doc_type}
+        if self.id_field:
+            doc_id = json.loads(source.decode('utf-8')).get(self.id_field)
+            if doc_id is not None:
+                meta['_id'] = doc_id
+        return (json.dumps({self.op_type: meta}) + '\n').encode('utf-8')
+
+    def batches(self, lines):
+        """
+        Yield lists of (line number, action line, source line) tuples from `lines`.
+        """
+        batch = []
+        size = 0
+        for lineno, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            with self._lock:
+                self.stats['docs'] += 1
+            try:
+                item = (lineno, self._meta(line), line + b'\n')
+            except (ValueError, AttributeError) as e:
+                self._record_error(lineno, 'parse_exception', str(e))
+                continue
+            length = len(item[1]) + len(item[2])
+            if batch and (len(batch) >= self.batch_size or size + length > self.batch_bytes):
+                yield batch
+                batch = []
+                size = 0
+            batch.append(item)
+            size += length
+        if batch:
+            yield batch
+
+    def _record_error(self, lineno, error_type, reason):
+        with self._lock:
+            self.stats['failed'] += 1
+            self.errors[error_type] += 1
+            if len(self.error_samples) < self.max_errors:
+                self.error_samples.append({'line': lineno, 'type': error_type,
+                                           'reason': reason})
+
+    def send(self, batch):
+        """
+        Send one batch, retrying the rejected items. Returns the number of documents indexed.
+        """
+        indexed = 0
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.initial_backoff * 2 ** (attempt - 1))
+            body = b''.join(meta + source for _, meta, source in batch)
+            with self._lock:
+                self.stats['requests'] += 1
+                self.stats['bytes'] += len(body)
+            try:
+                response = self.client.bulk(body=body, **self.params)
+            except TransportError as e:
+                if e.status_code != 429:
+                    raise
+                logger.warning("Bulk request of %d documents rejected", len(batch))
+                with self._lock:
+                    self.stats['retried'] += len(batch)
+                continue
+
+            rejected = []
+            for item, result in zip(batch, response['items']):
+                result = result[self.op_type]
+                if result.get('status', 500) < 300:
+                    indexed += 1
+                elif is_rejected(result):
+                    rejected.append(item)
+                else:
+                    error = result.get('error') or {}
+                    self._record_error(item[0], error.get('type', 'unknown'),
+                                       error.get('reason'))
+            if not rejected:
+                return indexed
+            logger.debug("%d bulk items rejected, retrying", len(rejected))
+            with self._lock:
+                self.stats['retried'] += len(rejected)
+            batch = rejected
+
+        for item in batch:
+            self._record_error(item[0], REJECTED_ERROR, 'retries exhausted')
+        return indexed
+
+    def load(self, lines):
+        """
+        Index every document of `lines` and return a summary of the run.
+        """
+        started = time.time()
+        # Bound the batches held in memory to those sent or about to be sent
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+
+        def run(batch):
+            try:
+                indexed = self.send(batch)
+                with self._lock:
+                    self.stats['indexed'] += indexed
+            except Exception as e:  # noqa
+                logger.error("Bulk request failed: %s", e)
+                for item in batch:
+                    self._record_error(item[0], type(e).__name__, str(e))
+            finally:
+                slots.release()
+
+        run = with_context(run)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for batch in self.batches(lines):
+                slots.acquire()
+                with self._lock:
+                    self.stats['batches'] += 1
+                executor.submit(run, batch)
+
+        elapsed = max(time.time() - started, 0.001)
+        summary = {
+            'docs': self.stats['docs'],
+            'indexed': self.stats['indexed'],
+            'failed': self.stats['failed'],
+            'retried': self.stats['retried'],
+            'batches': self.stats['batches'],
+            'requests': self.stats['requests'],
+            'bytes': self.stats['bytes'],
+            'elapsed': round(elapsed, 3),
+            'docs_per_second': round(self.stats['indexed'] / elapsed, 1),
+            'mb_per_second': round(self.stats['bytes'] / elapsed / 1024 / 1024, 3),
+            'errors': dict(self.errors),
+            'error_samples': self.error_samples
+        }
+        logger.info("Indexed %d documents in %.1fs, %d failed", summary['indexed'],
+                    elapsed, summary['failed'])
+        return summary
@@ -0,0 +1,229 @@
+# pylint: disable=no-member
+
+from chunking import IndexChunker
+from curator.utils import fix_epoch
+import copy
+import curator
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds the document counts and store sizes of indices are trusted for
+DEFAULT_STATS_TTL = 60
+# Seconds the snapshot list of a repository is trusted for
+DEFAULT_SNAPSHOT_TTL = 300
+# Seconds after which the whole catalog is rebuilt regardless of the state version
+DEFAULT_MAX_AGE = 3600
+
+
+class CachedIndexList(curator.IndexList):
+    """
+    An IndexList populated from the catalog instead of the cluster.
+    """
+
+    def __init__(self, client, index_info):
+        # Deliberately skip IndexList.__init__ which pulls everything from the cluster
+        self.loggit = logging.getLogger('curator.indexlist')
+        self.client = client
+        self.index_info = copy.deepcopy(index_info)
+        self.all_indices = sorted(index_info)
+        self.indices = self.all_indices[:]
+
+
+class CachedSnapshotList(curator.SnapshotList):
+    """
+    A SnapshotList populated from the catalog instead of the cluster.
+    """
+
+    def __init__(self, client, repository, snapshots):
+        # Deliberately skip SnapshotList.__init__ which pulls everything from the cluster
+        self.loggit = logging.getLogger('curator.snapshotlist')
+        self.client = client
+        self.repository = repository
+        self.all_snapshots = copy.deepcopy(snapshots)
+        self.snapshot_info = {}
+        self.snapshots = []
+        for item in self.all_snapshots:
+            if 'snapshot' in item:
+                self.snapshots.append(item['snapshot'])
+                self.snapshot_info[item['snapshot']] = item
+        self.empty_list_check()
+
+
+class IndexCatalog(object):
+    """
+    Local file cache of the index and snapshot metadata curator works from.
+
+    Index metadata is keyed on the cluster state version: while it doesn't
+    change, lists are served from the cache. When it does, the settings of
+    every index, allocation routing included, are looked up again in the
+    cluster state, chunked to fit the request URL. States, shard and
+    replica counts, doc counts and sizes of all indices come from a single
+    _cat/indices call, which is also repeated once the stats are older
+    than `stats_ttl`. Doc counts are those of the primaries.
+    Snapshots are cached per repository for `snapshot_ttl` seconds.
+    """
+
+    def __init__(self, client, path, chunker=None, stats_ttl=DEFAULT_STATS_TTL,
+                 snapshot_ttl=DEFAULT_SNAPSHOT_TTL, max_age=DEFAULT_MAX_AGE):
+        self.client = client
+        self.path = path
+        self.chunker = chunker or IndexChunker()
+        self.stats_ttl = stats_ttl
+        self.snapshot_ttl = snapshot_ttl
+        self.max_age = max_age
+        self.data = self._load()
+        self.counters = self.data.setdefault('counters', {'hits': 0, 'misses': 0,
+                                                          'partial': 0})
+
+    def _load(self):
+        try:
+            with open(self.path) as fh:
+                return json.load(fh)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save(self):
+        """
+        Atomically write the catalog back to its file.
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory or None, prefix='.catalog')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(self.data, fh)
+        os.rename(tmp, self.path)
+
+    def _state_version(self):
+        state = self.client.cluster.state(metric='version')
+        return [state.get('state_uuid'), state.get('version')]
+
+    def index_info(self):
+        """
+        Return the index_info dict of all indices, refreshing what's stale.
+        """
+        now = time.time()
+        cache = self.data.get('indices')
+        version = self._state_version()
+
+        if not cache or now - cache['built'] > self.max_age:
+            self.counters['misses'] += 1
+            cache = {'built': now, 'info': {}}
+            self._refresh(cache, version, now)
+        elif cache['version'] != version or now - cache['stats_at'] > self.stats_ttl:
+            self.counters['partial'] += 1
+            self._refresh(cache, version, now)
+        else:
+            self.counters['hits'] += 1
+            logger.debug("Index catalog is fresh at state version %s", version)
+
+        self.data['indices'] = cache
+        self.save()
+        return cache['info']
+
+    def _refresh(self, cache, version, now):
+        info = cache['info']
+        rows = self.client.cat.indices(
+            h='index,uuid,status,pri,rep,docs.count,store.size', bytes='b', format='json')
+        current = {}
+        for row in rows:
+            current[row['index']] = row
+
+        for index in set(info) - set(current):
+            del info[index]
+
+        if cache.get('version') != version:
+            # Settings of any index, such as its allocation routing, may have changed
+            stale = list(current)
+        else:
+            # Indices deleted and created again under the same name get a new uuid
+            stale = [index for index, row in current.items()
+                     if index not in info or info[index].get('uuid') != row.get('uuid')]
+        if stale:
+            logger.debug("Fetching metadata of %d indices", len(stale))
+            self._fetch_metadata(info, stale)
+
+        for index, row in current.items():
+            if index not in info:
+                continue
+            i = info[index]
+            i['uuid'] = row.get('uuid')
+            i['state'] = 'close' if row.get('status') == 'close' else 'open'
+            i['number_of_shards'] = row.get('pri') or i['number_of_shards']
+            i['number_of_replicas'] = row.get('rep') or i['number_of_replicas']
+            i['docs'] = int(row.get('docs.count') or 0)
+            i['size_in_bytes'] = int(row.get('store.size') or 0)
+
+        cache['version'] = version
+        cache['stats_at'] = now
+
+    def _fetch_metadata(self, info, indices):
+        for chunk in self.chunker.csv_chunks(indices):
+            metadata = self.client.cluster.state(
+                index=chunk, metric='metadata')['metadata']['indices']
+            for index, meta in metadata.items():
+                settings = meta['settings']['index']
+                if 'creation_date' not in settings:
+                    # Same as curator, indices predating ES 1.4 aren't actionable
+                    continue
+                info[index] = {
+                    'age': {'creation_date': fix_epoch(settings['creation_date'])},
+                    'number_of_replicas': settings['number_of_replicas'],
+                    'number_of_shards': settings['number_of_shards'],
+                    'segments': 0, 'size_in_bytes': 0, 'docs': 0,
+                    'state': meta['state'],
+                }
+                if 'routing' in settings:
+                    info[index]['routing'] = settings['routing']
+
+    def index_list(self):
+        """
+        Return a curator IndexList of all indices, served from the catalog.
+        """
+        return CachedIndexList(self.client, self.index_info())
+
+    def snapshot_list(self, repository):
+        """
+        Return a curator SnapshotList of `repository`, served from the catalog.
+        """
+        now = time.time()
+        snapshots = self.data.setdefault('snapshots', {})
+        cache = snapshots.get(repository)
+        if cache and now - cache['fetched'] <= self.snapshot_ttl:
+            self.counters['hits'] += 1
+        else:
+            self.counters['misses'] += 1
+            cache = {'fetched': now, 'snapshots': curator.utils.get_snapshot_data(
+                self.client, repository)}
+            snapshots[repository] = cache
+            self.save()
+        return CachedSnapshotList(self.client, repository, cache['snapshots'])
+
+    def invalidate_snapshots(self, repository):
+        """
+        Drop the cached snapshot list of `repository`.
+        """
+        if self.data.get('snapshots', {}).pop(repository, None) is not None:
+            self.save()
+
+
+def get_catalog(client, opts, chunker=None):
+    """
+    Return the IndexCatalog configured in `opts`, or None when `catalog_dir` isn't set.
+    """
+    if not opts.get('catalog_dir'):
+        return None
+    key = hashlib.sha1(json.dumps(
+        [opts.get('host'), opts.get('port'), opts.get('url_prefix')]).encode('utf-8'))
+    path = os.path.join(os.path.expanduser(opts.get('catalog_dir')),
+                        'catalog-{0}.json'.format(key.hexdigest()[:16]))
+    return IndexCatalog(client, path, chunker=chunker,
+                        stats_ttl=int(opts.get('catalog_stats_ttl') or DEFAULT_STATS_TTL),
+                        snapshot_ttl=int(opts.get('catalog_snapshot_ttl') or
+                                         DEFAULT_SNAPSHOT_TTL))
@@ -0,0 +1,71 @@
+from urllib.parse import quote_plus
+
+# Elasticsearch rejects request lines longer than http.max_initial_line_length (4kb)
+DEFAULT_MAX_URL_LENGTH = 4096
+# Room kept for the method, the API path, the query string and the protocol
+URL_RESERVE = 512
+
+
+def encoded_length(index):
+    """
+    Length of an index name once escaped into a URL path by the client.
+    """
+    return len(quote_plus(index, ',*'))
+
+
+def chunk_index_list(indices, max_length=DEFAULT_MAX_URL_LENGTH - URL_RESERVE, max_count=None):
+    """
+    Split a list of indices into lists whose comma-separated, URL encoded
+    form fits in `max_length` characters and which hold at most `max_count`
+    indices. Works in a single pass over the index name lengths.
+
+    :arg indices: A list of indices to act on.
+    :arg max_length: Maximum length of the index part of a request URL.
+    :arg max_count: Maximum number of indices per chunk, unlimited if None.
+    """
+    chunks = []
+    chunk = []
+    size = 0
+    for index in indices:
+        length = encoded_length(index)
+        if chunk and (size + 1 + length > max_length or
+                      (max_count and len(chunk) >= max_count)):
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+        size += length + (1 if chunk else 0)
+        chunk.append(index)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class IndexChunker(object):
+    """
+    Chunk index lists to fit the URL budget of a given connection.
+
+    The budget is what's left of `max_url_length` once the scheme, host,
+    port and url_prefix as well as a reserve for the API path and query
+    string are accounted for, so requests stay valid through proxies which
+    see absolute URLs.
+    """
+
+    def __init__(self, host=None, port=None, url_prefix=None, use_ssl=False,
+                 max_url_length=None, max_indices=None):
+        max_url_length = int(max_url_length or DEFAULT_MAX_URL_LENGTH)
+        base = '{0}://{1}:{2}/{3}'.format('https' if use_ssl else 'http', host or '',
+                                          port or '', (url_prefix or '').strip('/'))
+        self.max_length = max(max_url_length - len(base) - URL_RESERVE, 1)
+        self.max_count = int(max_indices) if max_indices else None
+
+    def chunks(self, indices):
+        """
+        Return `indices` split into chunks fitting a single request.
+        """
+        return chunk_index_list(indices, max_length=self.max_length, max_count=self.max_count)
+
+    def csv_chunks(self, indices):
+        """
+        Return `indices` as comma-separated strings fitting a single request.
+        """
+        return [','.join(chunk) for chunk in self.chunks(indices)]
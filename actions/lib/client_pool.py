@@ -0,0 +1,124 @@
+# pylint: disable=no-member
+
+from instrumentation import InstrumentedConnection, InstrumentedTransport
+import elasticsearch
+import logging
+import threading
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Default number of pooled HTTP connections kept per host
+DEFAULT_POOL_MAXSIZE = 10
+# Seconds a client may stay unused before it is closed and evicted
+DEFAULT_IDLE_TTL = 300
+# Seconds the version and master checks are trusted before being re-run
+DEFAULT_CHECK_TTL = 300
+
+
+class ClientRegistry(object):
+    """
+    Process-wide registry of pooled Elasticsearch clients.
+
+    Clients are keyed on host, port, http_auth, use_ssl, url_prefix and
+    timeout so that every entry point talking to the same cluster with the
+    same timeout shares one client and its connection pool, and callers
+    with another timeout never change it under them. Results of the
+    version and master checks are cached per client for `check_ttl`
+    seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+
+    @staticmethod
+    def make_key(host, port=9200, url_prefix=None, http_auth=None, use_ssl=False,
+                 timeout=None):
+        return (host, int(port) if port else None, url_prefix or None,
+                http_auth or None, bool(use_ssl), timeout)
+
+    def get(self, key, factory, idle_ttl=DEFAULT_IDLE_TTL):
+        """
+        Return the client registered under `key`, creating it with `factory`
+        if it's missing.
+        """
+        with self._lock:
+            now = time.time()
+            self.evict_idle(idle_ttl, now=now)
+            entry = self._entries.get(key)
+            if entry is None:
+                logger.debug("Creating pooled ES client for %s", key[:2])
+                entry = {'client': factory(), 'checks': {}}
+                self._entries[key] = entry
+            else:
+                logger.debug("Reusing pooled ES client for %s", key[:2])
+            entry['last_used'] = now
+            return entry['client']
+
+    def check(self, key, name, check_fn, check_ttl=DEFAULT_CHECK_TTL):
+        """
+        Run `check_fn` unless a check called `name` succeeded for `key`
+        less than `check_ttl` seconds ago.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            checked_at = entry['checks'].get(name) if entry else None
+            if checked_at is not None and time.time() - checked_at < check_ttl:
+                logger.debug("Skipping %s check, cached result is fresh", name)
+                return
+        check_fn()
+        with self._lock:
+            if key in self._entries:
+                self._entries[key]['checks'][name] = time.time()
+
+    def evict_idle(self, idle_ttl=DEFAULT_IDLE_TTL, now=None):
+        """
+        Drop clients which haven't been used for `idle_ttl` seconds.
+
+        Another thread may still hold a dropped client, its connections are
+        closed once the last reference to it is gone.
+        """
+        now = now or time.time()
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if now - entry['last_used'] > idle_ttl:
+                    logger.debug("Evicting idle ES client for %s", key[:2])
+                    client = self._entries.pop(key)['client']
+                    weakref.finalize(client, self._close_transport, client.transport)
+
+    def clear(self):
+        """
+        Close and drop all the registered clients.
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                self._close(entry['client'])
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _close(client):
+        ClientRegistry._close_transport(client.transport)
+
+    @staticmethod
+    def _close_transport(transport):
+        try:
+            transport.close()
+        except Exception as e:  # noqa
+            logger.debug("Failed to close ES client: %s", e)
+
+
+registry = ClientRegistry()
+
+
+def new_client(hosts, pool_maxsize=DEFAULT_POOL_MAXSIZE, **kwargs):
+    """
+    Construct an instrumented Elasticsearch client with a connection pool of `pool_maxsize`.
+    """
+    return elasticsearch.Elasticsearch(hosts, maxsize=int(pool_maxsize),
+                                       transport_class=InstrumentedTransport,
+                                       connection_class=InstrumentedConnection, **kwargs)
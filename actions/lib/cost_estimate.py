@@ -0,0 +1,88 @@
+# pylint: disable=no-member
+
+from chunking import chunk_index_list
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns of _cat/indices the estimate is made from, docs.count is that of the primaries
+CAT_COLUMNS = 'index,status,pri,rep,docs.count,store.size,pri.store.size,segments.count'
+# What the estimated bytes of a command are, and the store size they're taken from
+ESTIMATES = {
+    'forcemerge': ('merged', 'store_bytes'),
+    'reindex': ('copied', 'primary_store_bytes'),
+    'shrink': ('relocated', 'primary_store_bytes'),
+    'snapshot': ('copied', 'primary_store_bytes'),
+}
+# Counters summed over the indices into the totals
+TOTALS = ('primary_shards', 'shards', 'docs', 'store_bytes', 'primary_store_bytes', 'segments',
+          'estimated_bytes')
+
+
+def _count(value):
+    # Closed indices have no stats
+    return int(value) if value not in (None, '') else 0
+
+
+def index_costs(client, indices, chunker=None):
+    """
+    Return the shard, document, segment and store counts of `indices` by
+    index and the number of requests made, one _cat/indices call per chunk.
+
+    Names of `indices` may be patterns, they're expanded by the cluster.
+    """
+    chunks = chunker.chunks(indices) if chunker else chunk_index_list(indices)
+    costs = {}
+    for chunk in chunks:
+        rows = client.cat.indices(index=','.join(chunk), h=CAT_COLUMNS, bytes='b',
+                                  format='json')
+        for row in rows:
+            primaries = _count(row.get('pri'))
+            costs[row['index']] = {
+                'state': row.get('status'),
+                'primary_shards': primaries,
+                'shards': primaries * (1 + _count(row.get('rep'))),
+                'docs': _count(row.get('docs.count')),
+                'store_bytes': _count(row.get('store.size')),
+                'primary_store_bytes': _count(row.get('pri.store.size')),
+                'segments': _count(row.get('segments.count')),
+            }
+    return costs, len(chunks)
+
+
+def estimate_cost(client, command, indices, kwargs, chunker=None):
+    """
+    Return what `command` would act on and the bytes it would move, without running it.
+
+    The result holds the counters of every index and their totals. Their
+    `estimated_bytes` is what the command would write: the store of every
+    copy of the indices a forcemerge would merge, those with more segments
+    than `max_num_segments` per shard, and the primary store of the indices
+    to reindex, to gather on the shrink node or to snapshot. Snapshots are
+    incremental, their estimate is an upper bound.
+    """
+    estimate, store = ESTIMATES.get(command, (None, None))
+    costs, requests = index_costs(client, indices, chunker)
+    max_segments = int(kwargs.get('max_num_segments') or 1)
+    totals = dict.fromkeys(TOTALS, 0)
+    for cost in costs.values():
+        if command == 'forcemerge':
+            # Closed and already merged indices are left alone
+            merged = cost['state'] == 'open' and cost['segments'] > max_segments * cost['shards']
+            cost['estimated_bytes'] = cost['store_bytes'] if merged else 0
+        else:
+            cost['estimated_bytes'] = cost[store] if store else 0
+        for key in TOTALS:
+            totals[key] += cost[key]
+    totals['indices'] = len(costs)
+    logger.info("%s would act on %d indices and %s %d bytes", command, len(costs),
+                estimate or 'move', totals['estimated_bytes'])
+    return {
+        'success': True,
+        'dry_run': True,
+        'command': command,
+        'estimate': estimate,
+        'requests': requests,
+        'total': totals,
+        'indices': costs
+    }
@@ -3,6 +3,7 @@ from __future__ import print_function
 
 from curator_invoke import CuratorInvoke
 from esbase_action import ESBaseAction
+from task_tracker import TaskStore
 import logging
 import sys
 
@@ -81,6 +82,27 @@ class CuratorAction(ESBaseAction):
             logger.warn("Job did not complete successfully.")
         sys.exit(0) if success else sys.exit(1)
 
+    @staticmethod
+    def result_msg(result):
+        """
+        Log whether the job completed successfully and return the
+        (success, result) tuple of the action.
+        """
+        if result['success']:
+            logger.info("Job completed successfully.")
+        else:
+            logger.warn("Job did not complete successfully.")
+        return result['success'], result
+
+    def track(self, result):
+        """
+        Save the task record of an operation submitted without waiting, if any.
+
+        tasks.status and the task sensor follow it from the datastore.
+        """
+        if 'task' in result and self.action_service is not None:
+            TaskStore(self.action_service).save(result['task'])
+
     def do_command(self):
         """
         Do the command.
@@ -88,11 +110,31 @@ class CuratorAction(ESBaseAction):
         # Show and exit
         self.command == "show" and self.do_show()
 
+        if self.config.get('estimate_cost'):
+            # Dry run returning the size of the selected indices and the bytes to move
+            return self.result_msg(self.with_metrics(
+                self.api.invoke(command=self.command, act_on=self.act_on)))
+
         if self.config.dry_run:
             self.show_dry_run()
         else:
             logger.info("Job starting: %s %s", self.command, self.act_on)
             logger.debug("Params: %s", self.config)
 
+            admission = self.api.admit(self.command)
+            if admission and admission['decision'] == 'refused':
+                return self.result_msg(self.with_metrics({'success': False,
+                                                          'admission': admission}))
+
             success = self.api.invoke(command=self.command, act_on=self.act_on)
+            if admission is not None:
+                # Hand the decision over with the outcome
+                success = dict(success, admission=admission) if isinstance(success, dict) \
+                    else {'success': success, 'admission': admission}
+            if isinstance(success, dict):
+                self.track(success)
+                # Structured outcome, hand it over as the action result
+                return self.result_msg(self.with_metrics(success))
+            if self.config.get('include_metrics'):
+                return self.result_msg(self.with_metrics({'success': success}))
             self.exit_msg(success)
@@ -1,10 +1,22 @@
 # pylint: disable=no-member
 
 from utils import compact_dict, get_client
+from chunking import IndexChunker
+from client_pool import DEFAULT_POOL_MAXSIZE
+from parallel_runner import ParallelRunner, PARALLEL_COMMANDS
+from catalog import get_catalog
+from instrumentation import metrics
+from task_tracker import ASYNC_COMMANDS, submit
+from adaptive_reindex import AdaptiveReindex
+from snapshot_orchestrator import Checkpoint, SnapshotOrchestrator
+from cost_estimate import estimate_cost
+from admission import admission_controller
 from easydict import EasyDict
 from collections import defaultdict
 from curator.validators import options
-from curator.cli import process_action
+from curator.cli import process_action, CLASS_MAP
+from curator.utils import ensure_list
+import copy
 import curator
 import json
 import logging
@@ -12,12 +24,17 @@ import os.path
 
 logger = logging.getLogger(__name__)
 
+# Commands which build their own index or snapshot lists in process_action
+CUSTOM_LIST_COMMANDS = ('alias', 'cluster_routing', 'create_index', 'rollover',
+                        'delete_snapshots', 'restore')
+
 
 class CuratorInvoke(object):
 
     def __init__(self, **opts):
         self.opts = EasyDict(opts)
         self._client = None
+        self._catalog = False
 
     @property
     def client(self):
@@ -26,21 +43,46 @@ class CuratorInvoke(object):
             self._client = get_client(**({
                 'host': o.host, 'port': o.port, 'url_prefix': o.url_prefix,
                 'http_auth': o.http_auth, 'use_ssl': o.use_ssl,
-                'master_only': o.master_only, 'timeout': o.timeout
+                'master_only': o.master_only, 'timeout': o.timeout,
+                'pool_maxsize': max(int(o.get('pool_maxsize') or DEFAULT_POOL_MAXSIZE),
+                                    int(o.get('concurrency') or 1)),
+                'client_idle_ttl': o.get('client_idle_ttl'),
+                'check_ttl': o.get('check_ttl')
             }))
         return self._client
 
-    def fetch(self, act_on, on_nofilters_showall=False):
+    @property
+    def chunker(self):
+        o = self.opts
+        return IndexChunker(host=o.host, port=o.port, url_prefix=o.url_prefix,
+                            use_ssl=o.use_ssl, max_url_length=o.get('max_url_length'),
+                            max_indices=o.get('max_indices_per_request'))
+
+    @property
+    def catalog(self):
+        """
+        The index metadata catalog, or None when it isn't enabled.
+        """
+        if self._catalog is False:
+            self._catalog = get_catalog(self.client, self.opts, chunker=self.chunker)
+        return self._catalog
+
+    def fetch(self, act_on, on_nofilters_showall=False, repository=None):
         """
         Forwarder method to indices/snapshots selector.
         """
+        repository = repository or self.opts.get('repository')
         if act_on not in ['indices', 'snapshots', 'cluster']:
             raise ValueError('invalid argument: ' + act_on)
 
         if act_on == 'indices':
+            if self.catalog:
+                return self.catalog.index_list()
             return curator.IndexList(self.client)
         elif act_on == 'snapshots':
-            return curator.SnapshotList(self.client)
+            if self.catalog:
+                return self.catalog.snapshot_list(repository)
+            return curator.SnapshotList(self.client, repository=repository)
         else:
             return []
 
@@ -84,10 +126,214 @@ class CuratorInvoke(object):
 
         config['options'] = kwargs
 
-        process_action(self.client, config, **kwargs)
+        if self.opts.get('estimate_cost'):
+            return self.estimate_cost(command, config, kwargs)
+
+        if command == 'reindex' and self.opts.get('adaptive'):
+            if self.opts.get('submit_only'):
+                raise ValueError('An adaptive reindex is throttled while it runs, it can\'t be '
+                                 'submitted only')
+            return self.run_adaptive_reindex(config, kwargs)
+
+        if command in ('delete_snapshots', 'snapshot') and \
+                bool(self.opts.get('repository')) == bool(self.opts.get('repositories')):
+            raise ValueError('Give either a repository or a list of repositories')
+
+        if self.opts.get('submit_only') and command in ASYNC_COMMANDS:
+            if self.opts.get('repositories'):
+                raise ValueError('Snapshots of several repositories can\'t be submitted only')
+            return self.submit(act_on, command, config, kwargs)
+
+        if command in ('delete_snapshots', 'snapshot') and (
+                self.opts.get('repositories') or self.opts.get('checkpoint_file')):
+            return self.orchestrate_snapshots(command, config, kwargs)
+
+        if int(self.opts.get('concurrency') or 1) > 1 and command in PARALLEL_COMMANDS:
+            return self.run_parallel(command, config, kwargs)
+
+        if command not in CUSTOM_LIST_COMMANDS:
+            # Same as process_action, with each step timed and the index list
+            # served from the catalog when it's enabled
+            with metrics.phase('index_list'):
+                ilo = self.fetch(act_on='indices')
+            with metrics.phase('filters'):
+                ilo.iterate_filters(config)
+            action_kwargs = compact_dict(kwargs)
+            if command == 'delete_indices':
+                action_kwargs.setdefault('master_timeout', 30)
+            with metrics.phase('action'):
+                CLASS_MAP[command](ilo, **action_kwargs).do_action()
+            if self.catalog:
+                logger.info("Index catalog counters: %s", self.catalog.counters)
+            return True
+
+        with metrics.phase('action'):
+            process_action(self.client, config, **kwargs)
+
+        if self.catalog and command in ('delete_snapshots', 'snapshot'):
+            self.catalog.invalidate_snapshots(self.opts.repository)
 
         return True
 
+    def admit(self, command):
+        """Check the load of the cluster before running command, following admission_policy.
+
+        Returns the decision, or None when admission control is off. A
+        reduced decision lowers the concurrency of the operation. Commands
+        without a concurrency to lower wait instead of being reduced.
+        """
+        o = self.opts
+        policy = o.get('admission_policy') or 'none'
+        if policy == 'reduce' and not self.reducible(command):
+            policy = 'wait'
+        controller = admission_controller(self.client, o, policy=policy)
+        if controller is None:
+            return None
+        with metrics.phase('admission'):
+            decision = controller.admit()
+        if policy != o.admission_policy:
+            decision['requested_policy'] = o.admission_policy
+        if decision['decision'] == 'reduced':
+            if command == 'reindex':
+                self.opts.slices = 1
+                self.opts.max_slices = 1
+            else:
+                self.opts.concurrency = 1
+                self.opts.per_node_concurrency = 1
+            decision['concurrency'] = 1
+        return decision
+
+    def reducible(self, command):
+        """Whether command runs with a concurrency the reduce admission policy can lower.
+        """
+        o = self.opts
+        if command == 'reindex':
+            return bool(o.get('adaptive')) or str(o.get('slices') or 1) != '1'
+        return command in PARALLEL_COMMANDS and int(o.get('concurrency') or 1) > 1
+
+    def estimate_cost(self, command, config, kwargs):
+        """Report the size of the selected indices and the bytes command would move.
+
+        Nothing is changed, it's a dry run with a structured result.
+        """
+        source = kwargs['request_body'].get('source', {}) if command == 'reindex' else {}
+        if source.get('remote'):
+            raise ValueError('The cost of a reindex from a remote cluster can\'t be estimated')
+        if source and source.get('index') != 'REINDEX_SELECTION':
+            # Explicit sources aren't filtered by curator either
+            indices = ensure_list(source['index'])
+        else:
+            with metrics.phase('index_list'):
+                ilo = self.fetch(act_on='indices')
+            with metrics.phase('filters'):
+                ilo.iterate_filters(config)
+            indices = ilo.indices
+        with metrics.phase('estimate'):
+            return estimate_cost(self.client, command, indices, compact_dict(kwargs),
+                                 chunker=self.chunker)
+
+    def submit(self, act_on, command, config, kwargs):
+        """Start command on the selected indices or snapshots without waiting for it.
+
+        The result holds the `task` record to track the operation with.
+        """
+        with metrics.phase('index_list'):
+            items = self.fetch(act_on=act_on)
+        with metrics.phase('filters'):
+            items.iterate_filters(config)
+        with metrics.phase('action'):
+            record = submit(self.client, command, items, compact_dict(kwargs))
+        o = self.opts
+        record['connection'] = {'host': o.host, 'port': o.port, 'url_prefix': o.url_prefix,
+                                'use_ssl': o.use_ssl}
+        if self.catalog and command == 'snapshot':
+            self.catalog.invalidate_snapshots(self.opts.repository)
+        return {'success': True, 'task': record}
+
+    def run_adaptive_reindex(self, config, kwargs):
+        """Reindex the selected indices with planned slices and a throttle following the load.
+        """
+        o = self.opts
+        with metrics.phase('index_list'):
+            ilo = self.fetch(act_on='indices')
+        with metrics.phase('filters'):
+            ilo.iterate_filters(config)
+        reindex = AdaptiveReindex(
+            self.client, ilo, compact_dict(kwargs),
+            interval=10 if o.get('adjust_interval') is None else o.adjust_interval,
+            max_slices=o.get('max_slices') or 20,
+            min_rate=o.get('min_requests_per_second') or 10,
+            max_rate=o.get('max_requests_per_second') or 0,
+            queue_limit=50 if o.get('write_queue_limit') is None else o.write_queue_limit)
+        with metrics.phase('action'):
+            return reindex.run()
+
+    def orchestrate_snapshots(self, command, config, kwargs):
+        """Delete or create snapshots in each repository, with a checkpoint to resume from.
+        """
+        o = self.opts
+        repositories = o.get('repositories') or [o.repository]
+        orchestrator = SnapshotOrchestrator(
+            self.client, delay=o.get('delete_delay'),
+            retry_interval=kwargs.get('retry_interval', 120),
+            retry_count=kwargs.get('retry_count', 3),
+            checkpoint=Checkpoint(o.get('checkpoint_file')))
+        plan = {}
+        if command == 'delete_snapshots':
+            with metrics.phase('snapshot_list'):
+                for repository in repositories:
+                    slo = self.fetch(act_on='snapshots', repository=repository)
+                    # Filters are consumed as they're applied
+                    slo.iterate_filters(copy.deepcopy(config))
+                    plan[repository] = slo.snapshots
+            with metrics.phase('action'):
+                result = orchestrator.delete(plan)
+        else:
+            with metrics.phase('index_list'):
+                ilo = self.fetch(act_on='indices')
+            with metrics.phase('filters'):
+                ilo.iterate_filters(config)
+            action_kwargs = dict(compact_dict(kwargs), wait_for_completion=True)
+            for repository in repositories:
+                action_kwargs['repository'] = repository
+                plan[repository] = CLASS_MAP['snapshot'](ilo, **action_kwargs)
+            with metrics.phase('action'):
+                result = orchestrator.create(plan)
+        if self.catalog:
+            for repository in repositories:
+                self.catalog.invalidate_snapshots(repository)
+        return result
+
+    def run_parallel(self, command, config, kwargs):
+        """Split the selected indices into groups and run command on them concurrently.
+        """
+        with metrics.phase('index_list'):
+            ilo = self.fetch(act_on='indices')
+        with metrics.phase('filters'):
+            ilo.iterate_filters(config)
+        ilo.empty_list_check()
+
+        action_kwargs = compact_dict(kwargs)
+        if command == 'delete_indices':
+            action_kwargs.setdefault('master_timeout', 30)
+
+        runner = ParallelRunner(self.client, chunker=self.chunker,
+                                concurrency=self.opts.concurrency,
+                                per_node_concurrency=self.opts.get('per_node_concurrency'),
+                                chunk_size=self.opts.get('chunk_size'))
+        with metrics.phase('action'):
+            results = runner.run(ilo, CLASS_MAP[command], action_kwargs)
+        failed = sorted(i for i, r in results.items() if not r['success'])
+        result = {
+            'success': not failed,
+            'succeeded': len(results) - len(failed),
+            'failed': failed,
+            'indices': results
+        }
+        if self.catalog:
+            result['catalog'] = self.catalog.counters
+        return result
+
     def _get_filters_from_json(self, fn):
         """Read JSON-formatted filters from the specified file
         """
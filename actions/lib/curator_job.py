@@ -0,0 +1,233 @@
+# pylint: disable=no-member
+
+from catalog import CachedIndexList
+from curator.cli import CLASS_MAP
+from curator.exceptions import NoIndices, NoSnapshots
+from curator.utils import prune_nones, validate_actions
+from instrumentation import metrics
+import copy
+import curator
+import logging
+import time
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# Commands creating indices or changing their settings, the index metadata is fetched again
+REFETCH_COMMANDS = ('create_index', 'index_settings', 'reindex', 'restore', 'rollover',
+                    'shrink')
+# Commands run without an index or snapshot list
+CLIENT_COMMANDS = ('cluster_routing', 'create_index', 'rollover')
+# Commands acting on snapshots
+SNAPSHOT_COMMANDS = ('delete_snapshots', 'restore')
+# Commands changing the snapshots of their repository
+REPOSITORY_COMMANDS = ('delete_snapshots', 'snapshot')
+
+
+def load_job(text):
+    """
+    Parse and validate a curator action file, given as YAML or JSON.
+
+    Returns the validated actions by id.
+    """
+    data = yaml.safe_load(text)
+    if not isinstance(data, dict):
+        raise ValueError('A job holds an `actions` dictionary')
+    return validate_actions(data)['actions']
+
+
+class IndexSnapshot(object):
+    """
+    Index metadata shared by the steps of a job.
+
+    It's fetched once, from the catalog when there is one, and every step
+    filters its own copy. Steps deleting, closing or opening indices, or
+    changing their replica count, are applied to it in place. Steps
+    creating indices or changing their settings make the next step fetch
+    it again, which the catalog limits to the new indices, and so do steps
+    failing after they may have acted on some indices.
+    """
+
+    def __init__(self, client, catalog=None):
+        self.client = client
+        self.catalog = catalog
+        self.fetches = 0
+        self._info = None
+
+    def index_list(self, client=None):
+        if self._info is None:
+            # The catalog keeps its own copy, the job's changes aren't known to the cluster yet
+            self._info = copy.deepcopy(self.catalog.index_info()) if self.catalog else \
+                curator.IndexList(self.client).index_info
+            self.fetches += 1
+        return CachedIndexList(client or self.client, self._info)
+
+    def invalidate(self):
+        """
+        Make the next step fetch the index metadata again, and return what was done to the snapshot.
+        """
+        if self._info is None:
+            return None
+        self._info = None
+        return 'refetch'
+
+    def update(self, command, indices, kwargs):
+        """
+        Account for `command` having run on `indices`, and return what was done to the snapshot.
+        """
+        if self._info is None:
+            return None
+        if command in REFETCH_COMMANDS:
+            return self.invalidate()
+        if command == 'delete_indices':
+            for index in indices:
+                self._info.pop(index, None)
+            return 'removed'
+        if command in ('close', 'open'):
+            for index in indices:
+                self._info[index]['state'] = command
+            return 'state'
+        if command == 'replicas':
+            for index in indices:
+                self._info[index]['number_of_replicas'] = kwargs['count']
+            return 'replicas'
+        return None
+
+
+class CuratorJob(object):
+    """
+    Run the actions of a curator action file in order, like the curator CLI.
+
+    Index lists come from a single IndexSnapshot instead of being fetched
+    from the cluster by every action. Disabled actions are skipped, empty
+    lists are skipped when `ignore_empty_list` is set, and failed actions
+    stop the job unless `continue_if_exception` is set. `client_for` returns
+    the client of an action with a `timeout_override`. With an `admission`
+    controller, the cluster load is checked before every action and a
+    refused action stops the job.
+    """
+
+    def __init__(self, client, actions, catalog=None, dry_run=False, client_for=None,
+                 admission=None):
+        self.client = client
+        self.actions = actions
+        self.catalog = catalog
+        self.dry_run = dry_run
+        self.client_for = client_for or (lambda timeout: client)
+        self.admission = admission
+        self.snapshot = IndexSnapshot(client, catalog)
+
+    def run(self):
+        started = time.time()
+        steps = []
+        success = True
+        for action_id in sorted(self.actions):
+            config = self.actions[action_id]
+            step = {'id': action_id, 'action': config['action'],
+                    'description': config['description']}
+            steps.append(step)
+            if not success:
+                step['status'] = 'not_run'
+                continue
+            options = config['options']
+            if options.pop('disable_action'):
+                step['status'] = 'disabled'
+                continue
+            continue_if_exception = options.pop('continue_if_exception')
+            ignore_empty_list = options.pop('ignore_empty_list')
+            timeout = options.pop('timeout_override')
+            client = self.client_for(timeout) if isinstance(timeout, int) else self.client
+
+            if self.admission and not self.dry_run:
+                with metrics.phase('admission'):
+                    step['admission'] = self.admission.admit()
+                if step['admission']['decision'] == 'refused':
+                    step['status'] = 'refused'
+                    success = False
+                    continue
+
+            step_started = time.time()
+            try:
+                self.run_step(client, config, step)
+                step['status'] = 'done'
+            except (NoIndices, NoSnapshots) as e:
+                step['status'] = 'skipped' if ignore_empty_list else 'failed'
+                step['error'] = 'Empty list: {0}'.format(type(e).__name__)
+                success = success and ignore_empty_list
+            except Exception as e:  # noqa
+                logger.error("Action %s %s failed: %s", action_id, config['action'], e)
+                step['status'] = 'failed'
+                step['error'] = '{0}: {1}'.format(type(e).__name__, e)
+                success = success and continue_if_exception
+                if not self.dry_run:
+                    # The action may have changed some indices or snapshots before failing
+                    step['refresh'] = self.snapshot.invalidate()
+                    if self.catalog and config['action'] in REPOSITORY_COMMANDS:
+                        self.catalog.invalidate_snapshots(config['options']['repository'])
+            step['took'] = round(time.time() - step_started, 3)
+            logger.info("Action %s %s %s in %.3fs", action_id, config['action'],
+                        step['status'], step['took'])
+
+        result = {
+            # Like the curator CLI, actions failing with continue_if_exception don't fail the job
+            'success': success,
+            'failed': [s['id'] for s in steps if s['status'] in ('failed', 'refused')],
+            'took': round(time.time() - started, 3),
+            'index_fetches': self.snapshot.fetches,
+            'steps': steps
+        }
+        if self.catalog:
+            result['catalog'] = self.catalog.counters
+        return result
+
+    def run_step(self, client, config, step):
+        """
+        Run one action of the job, filling its `items`, `timings` and `refresh` in `step`.
+        """
+        command = config['action']
+        kwargs = prune_nones(config['options'])
+        if command == 'delete_indices':
+            kwargs.setdefault('master_timeout', 30)
+        timings = step['timings'] = {}
+
+        def timed(name, fn):
+            phase_started = time.time()
+            with metrics.phase(name):
+                value = fn()
+            timings[name] = round(timings.get(name, 0) + time.time() - phase_started, 4)
+            return value
+
+        items = []
+        if command == 'alias':
+            action = CLASS_MAP['alias'](**kwargs)
+            for part in ('add', 'remove'):
+                if part not in config:
+                    continue
+                ilo = timed('index_list', lambda: self.snapshot.index_list(client))
+                timed('filters', lambda: ilo.iterate_filters(config[part]))
+                getattr(action, part)(ilo, warn_if_no_indices=kwargs['warn_if_no_indices'])
+                items.extend(ilo.indices)
+        elif command in CLIENT_COMMANDS:
+            action = CLASS_MAP[command](client, **kwargs)
+        elif command in SNAPSHOT_COMMANDS:
+            repository = kwargs.pop('repository')
+            slo = timed('snapshot_list', lambda: self.catalog.snapshot_list(repository)
+                        if self.catalog else curator.SnapshotList(client, repository=repository))
+            timed('filters', lambda: slo.iterate_filters(config))
+            action = CLASS_MAP[command](slo, **kwargs)
+            items = slo.snapshots
+        else:
+            ilo = timed('index_list', lambda: self.snapshot.index_list(client))
+            timed('filters', lambda: ilo.iterate_filters(config))
+            action = CLASS_MAP[command](ilo, **kwargs)
+            items = ilo.indices
+
+        if self.dry_run:
+            timed('action', action.do_dry_run)
+            step['items'] = list(items)
+            return
+        timed('action', action.do_action)
+        step['items'] = list(items)
+        step['refresh'] = self.snapshot.update(command, items, kwargs)
+        if self.catalog and command in REPOSITORY_COMMANDS:
+            self.catalog.invalidate_snapshots(config['options']['repository'])
@@ -1,15 +1,34 @@
 # pylint: disable=no-member
+from __future__ import print_function
 
-from utils import get_client
+from utils import ClientError, get_client
+from chunking import IndexChunker
+from instrumentation import metrics
 from st2common.runners.base_action import Action
 import logging
+import sys
+import worker
+
+logger = logging.getLogger(__name__)
 
 
 class ESBaseAction(Action):
 
+    # Pack config options applied on top of the action parameters
+    pack_config_keys = ('host', 'port', 'pool_maxsize', 'client_idle_ttl', 'check_ttl',
+                        'max_url_length', 'max_indices_per_request', 'catalog_dir',
+                        'catalog_stats_ttl', 'catalog_snapshot_ttl', 'admission_max_status',
+                        'admission_max_pending_tasks', 'admission_max_write_queue',
+                        'admission_max_search_queue', 'admission_max_disk_percent',
+                        'admission_timeout')
+
     def __init__(self, config=None):
         super(ESBaseAction, self).__init__(config=config)
         self._client = None
+        self.pack_config = {}
+        # The metrics of this request when a worker runs several at once
+        self._metrics = metrics.scope()
+        self._metrics_since = self._metrics.snapshot()
 
     @property
     def client(self):
@@ -18,10 +37,77 @@ class ESBaseAction(Action):
             self._client = get_client(**({
                 'host': o.host, 'port': o.port, 'url_prefix': o.url_prefix,
                 'http_auth': o.http_auth, 'use_ssl': o.use_ssl,
-                'master_only': o.master_only, 'timeout': o.timeout
+                'master_only': o.master_only, 'timeout': o.timeout,
+                'pool_maxsize': o.get('pool_maxsize'),
+                'client_idle_ttl': o.get('client_idle_ttl'),
+                'check_ttl': o.get('check_ttl')
             }))
         return self._client
 
+    @property
+    def chunker(self):
+        o = self.config
+        return IndexChunker(host=o.host, port=o.port, url_prefix=o.url_prefix,
+                            use_ssl=o.use_ssl, max_url_length=o.get('max_url_length'),
+                            max_indices=o.get('max_indices_per_request'))
+
+    def apply_pack_config(self, pack_config):
+        """
+        Override action parameters with the values set in the pack config.
+        """
+        self.pack_config = pack_config
+        for key in self.pack_config_keys:
+            if pack_config.get(key) is not None:
+                self.config.update({key: pack_config.get(key)})
+
+    def with_metrics(self, result):
+        """
+        Add the Elasticsearch requests made by the action to `result` when
+        `include_metrics` is set.
+        """
+        report = self._metrics.report(since=self._metrics_since)
+        logger.info("Made %d Elasticsearch requests taking %.3fs", report['count'],
+                    report['time'])
+        if self.config.get('include_metrics'):
+            result['metrics'] = report
+        return result
+
+    @staticmethod
+    def exit_on_client_error(fn):
+        """
+        Return what `fn` returns, or print why the cluster can't be used and
+        exit with the status of the failure.
+        """
+        try:
+            return fn()
+        except ClientError as e:
+            print("ERROR: {0}".format(e))
+            sys.exit(e.exit_code)
+
+    def run_in_worker(self, runner, params):
+        """
+        Run the action in the pack worker when `worker_socket` is set in the pack config.
+
+        Returns whether the worker ran it and what the runner returned there.
+        What the runner printed is printed here and its exit code is exited
+        with. When no worker listens on the socket, the action has to run in
+        this process.
+        """
+        path = self.config.get('worker_socket')
+        if not path:
+            return False, None
+        try:
+            response = worker.call(path, runner, dict(self.config), params)
+        except worker.WorkerUnavailable as e:
+            logger.info("%s, running the action in process", e)
+            return False, None
+        sys.stdout.write(response['stdout'])
+        sys.stderr.write(response['stderr'])
+        if response['exit_code'] is not None:
+            sys.exit(response['exit_code'])
+        outcome = response['outcome']
+        return True, tuple(outcome) if outcome is not None else None
+
     def set_up_logging(self):
         """
         Set log_level. Default is to display warnings.
@@ -30,4 +116,6 @@ class ESBaseAction(Action):
         numeric_log_level = getattr(logging, log_level.upper(), None)
         if not isinstance(numeric_log_level, int):
             raise ValueError('Invalid log level: {0}'.format(log_level))
-        logging.basicConfig(level=numeric_log_level)
+        # Inside the worker only the request being run takes this level
+        if not worker.set_request_log_level(numeric_log_level):
+            logging.basicConfig(level=numeric_log_level)
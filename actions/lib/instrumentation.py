@@ -0,0 +1,334 @@
+# pylint: disable=no-member
+
+from elasticsearch import Transport, TransportError
+from elasticsearch.connection import Urllib3HttpConnection
+from contextlib import contextmanager
+import contextvars
+import copy
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the request latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+PROMETHEUS_PREFIX = 'elasticsearch_pack'
+# Metrics of the enclosing collecting() blocks, requests are recorded in them too
+_collectors = contextvars.ContextVar('metrics_collectors', default=())
+
+
+def endpoint_name(method, url):
+    """
+    Return `method` and the API path of `url`, with index names and ids replaced by *.
+
+    A segment is part of the API path when it starts with an underscore, or
+    is a plain word following one, as in /_cluster/state or /_cat/indices.
+    """
+    parts = url.split('?', 1)[0].strip('/').split('/')
+    path = []
+    for i, part in enumerate(parts):
+        if part.startswith('_') or not part or (
+                i and parts[i - 1].startswith('_') and re.match('^[a-z_]+$', part)):
+            path.append(part)
+        else:
+            path.append('*')
+    return '{0} /{1}'.format(method, '/'.join(path))
+
+
+class Metrics(object):
+    """
+    Thread-safe record of the Elasticsearch requests made by this process.
+
+    Requests are aggregated per endpoint into call, error and retry counts,
+    bytes sent and received, and a latency histogram. Named phases, such as
+    building the client or populating an index list, are timed separately.
+    What the process-wide record gets is also recorded by the collectors
+    of the current context, see collecting().
+    """
+
+    def __init__(self, shared=False):
+        self._lock = threading.Lock()
+        self.shared = shared
+        self.endpoints = {}
+        self.phases = {}
+
+    def _targets(self):
+        return (self,) + _collectors.get() if self.shared else (self,)
+
+    @contextmanager
+    def collecting(self):
+        """
+        Record the requests and phases of the enclosed block, and of the
+        threads it starts with with_context(), in a Metrics of their own.
+        """
+        collector = Metrics()
+        token = _collectors.set(_collectors.get() + (collector,))
+        try:
+            yield collector
+        finally:
+            _collectors.reset(token)
+
+    def scope(self):
+        """
+        Return the Metrics of the innermost collecting() block, or this one outside of any.
+        """
+        collectors = _collectors.get()
+        return collectors[-1] if self.shared and collectors else self
+
+    def _endpoint(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = {
+                'count': 0, 'errors': 0, 'retries': 0, 'bytes_out': 0, 'bytes_in': 0,
+                'time': 0.0, 'max': 0.0, 'buckets': [0] * len(BUCKETS)}
+        return stats
+
+    def record(self, endpoint, elapsed, bytes_out=0, bytes_in=0, error=False):
+        for target in self._targets():
+            target._record(endpoint, elapsed, bytes_out, bytes_in, error)
+
+    def _record(self, endpoint, elapsed, bytes_out, bytes_in, error):
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats['count'] += 1
+            stats['errors'] += 1 if error else 0
+            stats['bytes_out'] += bytes_out
+            stats['bytes_in'] += bytes_in
+            stats['time'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            for i, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    stats['buckets'][i] += 1
+                    break
+
+    def record_retries(self, endpoint, retries):
+        for target in self._targets():
+            with target._lock:
+                target._endpoint(endpoint)['retries'] += retries
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the enclosed block as an occurrence of the phase called `name`.
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            for target in self._targets():
+                with target._lock:
+                    phase = target.phases.setdefault(name, {'count': 0, 'time': 0.0})
+                    phase['count'] += 1
+                    phase['time'] += elapsed
+
+    def snapshot(self):
+        with self._lock:
+            return copy.deepcopy({'endpoints': self.endpoints, 'phases': self.phases})
+
+    def report(self, since=None):
+        """
+        Return the metrics recorded so far, or since the `since` snapshot was taken.
+
+        Histograms are cumulative, keyed on the bucket upper bound as in Prometheus.
+        The `max` latency of an endpoint always covers the whole process lifetime.
+        """
+        current = self.snapshot()
+        before = since or {'endpoints': {}, 'phases': {}}
+        endpoints = {}
+        for name, stats in current['endpoints'].items():
+            prior = before['endpoints'].get(name)
+            if prior:
+                for key in ('count', 'errors', 'retries', 'bytes_out', 'bytes_in', 'time'):
+                    stats[key] -= prior[key]
+                stats['buckets'] = [a - b for a, b in zip(stats['buckets'], prior['buckets'])]
+            if not stats['count'] and not stats['retries']:
+                continue
+            cumulative = 0
+            histogram = {}
+            for bound, count in zip(BUCKETS, stats.pop('buckets')):
+                cumulative += count
+                histogram['+Inf' if bound == float('inf') else str(bound)] = cumulative
+            stats['histogram'] = histogram
+            stats['time'] = round(stats['time'], 6)
+            stats['max'] = round(stats['max'], 6)
+            endpoints[name] = stats
+        phases = {}
+        for name, phase in current['phases'].items():
+            prior = before['phases'].get(name, {'count': 0, 'time': 0.0})
+            if phase['count'] > prior['count']:
+                phases[name] = {'count': phase['count'] - prior['count'],
+                                'time': round(phase['time'] - prior['time'], 6)}
+        totals = dict((k, sum(e[k] for e in endpoints.values()))
+                      for k in ('count', 'errors', 'retries', 'bytes_out', 'bytes_in'))
+        totals['time'] = round(sum(e['time'] for e in endpoints.values()), 6)
+        totals['endpoints'] = endpoints
+        totals['phases'] = phases
+        return totals
+
+    def statsd_lines(self, since=None, prefix='elasticsearch'):
+        """
+        Return statsd lines for the requests made since the `since` snapshot.
+        """
+        lines = []
+        for name, stats in sorted(self.report(since)['endpoints'].items()):
+            key = '{0}.{1}'.format(prefix, ''.join(
+                c if c.isalnum() else '_' for c in name).strip('_'))
+            for counter in ('count', 'errors', 'retries', 'bytes_out', 'bytes_in'):
+                lines.append('{0}.{1}:{2}|c'.format(key, counter, stats[counter]))
+            if stats['count']:
+                lines.append('{0}.latency:{1:.3f}|ms'.format(
+                    key, stats['time'] * 1000.0 / stats['count']))
+        return lines
+
+    def prometheus_text(self, labels=None):
+        """
+        Return all the metrics recorded so far in the Prometheus text exposition format.
+        """
+        extra = ''.join(',{0}="{1}"'.format(k, v) for k, v in sorted((labels or {}).items()))
+        report = self.report()
+        out = []
+        counters = (('requests_total', 'count', 'Elasticsearch requests'),
+                    ('request_errors_total', 'errors', 'Failed Elasticsearch requests'),
+                    ('request_retries_total', 'retries', 'Retried Elasticsearch requests'),
+                    ('request_bytes_total', 'bytes_out', 'Bytes sent to Elasticsearch'),
+                    ('response_bytes_total', 'bytes_in', 'Bytes received from Elasticsearch'))
+        for metric, key, help_text in counters:
+            name = '{0}_{1}'.format(PROMETHEUS_PREFIX, metric)
+            out.append('# HELP {0} {1}.'.format(name, help_text))
+            out.append('# TYPE {0} counter'.format(name))
+            for endpoint, stats in sorted(report['endpoints'].items()):
+                out.append('{0}{{endpoint="{1}"{2}}} {3}'.format(name, endpoint, extra,
+                                                                 stats[key]))
+        name = '{0}_request_duration_seconds'.format(PROMETHEUS_PREFIX)
+        out.append('# HELP {0} Elasticsearch request latency.'.format(name))
+        out.append('# TYPE {0} histogram'.format(name))
+        for endpoint, stats in sorted(report['endpoints'].items()):
+            for bound, count in stats['histogram'].items():
+                out.append('{0}_bucket{{endpoint="{1}",le="{2}"{3}}} {4}'.format(
+                    name, endpoint, bound, extra, count))
+            out.append('{0}_sum{{endpoint="{1}"{2}}} {3}'.format(name, endpoint, extra,
+                                                                stats['time']))
+            out.append('{0}_count{{endpoint="{1}"{2}}} {3}'.format(name, endpoint, extra,
+                                                                  stats['count']))
+        return '\n'.join(out) + '\n'
+
+
+metrics = Metrics(shared=True)
+_local = threading.local()
+
+
+def with_context(fn):
+    """
+    Return `fn` running in a copy of the context of the caller, for thread
+    pools whose requests belong to the metrics and output of the caller.
+    """
+    context = contextvars.copy_context()
+    # A context can't be entered by two threads at once, each call gets its own copy
+    return lambda *args: context.copy().run(fn, *args)
+
+
+class InstrumentedConnection(Urllib3HttpConnection):
+    """
+    Connection recording the latency and size of every request in `metrics`.
+    """
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(),
+                        headers=None):
+        _local.attempts = getattr(_local, 'attempts', 0) + 1
+        endpoint = endpoint_name(method, url)
+        bytes_out = len(body) if body else 0
+        started = time.time()
+        try:
+            status, response_headers, data = super(InstrumentedConnection, self).perform_request(
+                method, url, params=params, body=body, timeout=timeout, ignore=ignore,
+                headers=headers)
+        except TransportError as e:
+            metrics.record(endpoint, time.time() - started, bytes_out=bytes_out,
+                           bytes_in=len(e.info) if isinstance(e.info, str) else 0, error=True)
+            raise
+        metrics.record(endpoint, time.time() - started, bytes_out=bytes_out,
+                       bytes_in=len(data) if data else 0)
+        return status, response_headers, data
+
+
+class InstrumentedTransport(Transport):
+    """
+    Transport counting the attempts beyond the first made for each request as retries.
+    """
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        _local.attempts = 0
+        try:
+            return super(InstrumentedTransport, self).perform_request(
+                method, url, headers=headers, params=params, body=body)
+        finally:
+            if _local.attempts > 1:
+                metrics.record_retries(endpoint_name(method, url), _local.attempts - 1)
+
+
+class StatsdEmitter(object):
+    """
+    Send the metrics recorded since the previous call to a statsd daemon over UDP.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='elasticsearch'):
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._since = metrics.snapshot()
+
+    def emit(self):
+        lines = metrics.statsd_lines(since=self._since, prefix=self.prefix)
+        self._since = metrics.snapshot()
+        try:
+            # Keep datagrams under the usual 512 bytes MTU advice
+            packet = []
+            for line in lines:
+                if packet and sum(len(l) + 1 for l in packet) + len(line) > 512:
+                    self.sock.sendto('\n'.join(packet).encode('utf-8'), self.address)
+                    packet = []
+                packet.append(line)
+            if packet:
+                self.sock.sendto('\n'.join(packet).encode('utf-8'), self.address)
+        except socket.error as e:
+            logger.warning("Failed to send metrics to statsd: %s", e)
+
+
+class PrometheusFileEmitter(object):
+    """
+    Write the metrics to a file in the Prometheus text format, for the node exporter
+    textfile collector.
+    """
+
+    def __init__(self, path, labels=None):
+        self.path = path
+        self.labels = labels
+
+    def emit(self):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics')
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(metrics.prometheus_text(labels=self.labels))
+        os.rename(tmp, self.path)
+
+
+def get_emitter(config, labels=None):
+    """
+    Return the metrics emitter set up by the `metrics_*` options of `config`, if any.
+    """
+    output = config.get('metrics_output', None)
+    if output == 'statsd':
+        return StatsdEmitter(config.get('statsd_host', None) or 'localhost',
+                             config.get('statsd_port', None) or 8125,
+                             prefix=config.get('metrics_prefix', None) or 'elasticsearch')
+    if output == 'prometheus':
+        if not config.get('metrics_file', None):
+            raise ValueError('metrics_file has to be set to publish prometheus metrics')
+        return PrometheusFileEmitter(config['metrics_file'], labels=labels)
+    return None
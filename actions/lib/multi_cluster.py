@@ -0,0 +1,147 @@
+# pylint: disable=no-member
+
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import with_context
+from search_merge import merge_search_results
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Connection settings a cluster entry may set, the others are inherited
+CONNECTION_KEYS = ('host', 'port', 'url_prefix', 'http_auth', 'use_ssl')
+
+
+def select_clusters(configured, names):
+    """
+    Return the entries of the `configured` clusters list called `names`.
+
+    :arg configured: The `clusters` list of the pack config.
+    :arg names: Cluster names, or `all` to select every configured cluster.
+    """
+    configured = configured or []
+    if not names:
+        return []
+    if 'all' in names:
+        return list(configured)
+    by_name = dict((c['name'], c) for c in configured)
+    missing = [n for n in names if n not in by_name]
+    if missing:
+        raise ValueError('Unknown clusters: {0}'.format(', '.join(missing)))
+    return [by_name[n] for n in names]
+
+
+def connection(cluster, defaults):
+    """
+    Return the connection settings of `cluster`, falling back to `defaults`.
+    """
+    return dict((k, cluster[k] if cluster.get(k) is not None else defaults.get(k))
+                for k in CONNECTION_KEYS)
+
+
+def fan_out(clusters, fn):
+    """
+    Call `fn` with every cluster concurrently.
+
+    Returns a list of {name, result, error, took} dicts in the order of
+    `clusters`, so the overall latency is the one of the slowest cluster.
+    Errors, including failed connections, are caught and reported per
+    cluster.
+    """
+    def call(cluster):
+        started = time.time()
+        outcome = {'name': cluster['name'], 'result': None, 'error': None}
+        try:
+            outcome['result'] = fn(cluster)
+        except Exception as e:  # noqa
+            outcome['error'] = str(e) or type(e).__name__
+        if outcome['error']:
+            logger.error("Cluster %s failed: %s", cluster['name'], outcome['error'])
+        outcome['took'] = int((time.time() - started) * 1000)
+        return outcome
+
+    if not clusters:
+        return []
+    with ThreadPoolExecutor(max_workers=len(clusters)) as executor:
+        return list(executor.map(with_context(call), clusters))
+
+
+def breakdown(outcome, total):
+    item = {'total': total, 'took': outcome['took']}
+    if outcome['error']:
+        item['error'] = outcome['error']
+    return item
+
+
+def merge_cluster_searches(outcomes, offset=0, size=10, sort=None):
+    """
+    Merge the search responses of several clusters into a single one.
+
+    Hits are tagged with the `_cluster` they come from and the result gets
+    a `clusters` breakdown of the totals, latencies and errors per cluster.
+    """
+    results = []
+    clusters = {}
+    for outcome in outcomes:
+        result = outcome['result']
+        if result is None:
+            clusters[outcome['name']] = breakdown(outcome, 0)
+            continue
+        for hit in result['hits']['hits']:
+            hit['_cluster'] = outcome['name']
+        results.append(result)
+        clusters[outcome['name']] = breakdown(outcome, result['hits']['total'])
+    merged = merge_search_results(results, offset=offset, size=size, sort=sort)
+    merged['clusters'] = clusters
+    return merged
+
+
+def merge_msearch(outcomes, sample_sizes):
+    """
+    Merge the _msearch responses of several clusters query by query.
+
+    Totals and date histogram buckets are summed, sample hits are tagged
+    with their `_cluster` and capped at the query's `sample_sizes` entry.
+    A query fails when it failed on every cluster, and the breakdown of
+    each query notes the clusters it failed on.
+    """
+    merged = []
+    for i, sample_size in enumerate(sample_sizes):
+        hits = []
+        total = 0
+        buckets = None
+        clusters = {}
+        errors = []
+        for outcome in outcomes:
+            if outcome['result'] is None:
+                errors.append(outcome['error'])
+                clusters[outcome['name']] = breakdown(outcome, 0)
+                continue
+            response = outcome['result']['responses'][i]
+            if 'error' in response:
+                errors.append(response['error'])
+                clusters[outcome['name']] = breakdown(dict(outcome, error=response['error']), 0)
+                continue
+            count = response['hits'].get('total', 0)
+            total += count
+            clusters[outcome['name']] = breakdown(outcome, count)
+            for hit in response['hits'].get('hits', []):
+                hit['_cluster'] = outcome['name']
+                hits.append(hit)
+            if 'aggregations' in response:
+                if buckets is None:
+                    buckets = {}
+                for bucket in response['aggregations']['slices']['buckets']:
+                    buckets[bucket['key']] = buckets.get(bucket['key'], 0) + bucket['doc_count']
+        if len(errors) == len(outcomes):
+            merged.append({'error': errors[0] if errors else 'No cluster configured'})
+            continue
+        response = {'hits': {'total': total, 'hits': hits[:sample_size]},
+                    'clusters': clusters}
+        if buckets is not None:
+            response['aggregations'] = {'slices': {'buckets': [
+                {'key': k, 'doc_count': v} for k, v in sorted(buckets.items())]}}
+        if errors:
+            response['partial'] = True
+        merged.append(response)
+    return merged
@@ -0,0 +1,101 @@
+# pylint: disable=no-member
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from catalog import CachedIndexList
+from chunking import IndexChunker, chunk_index_list
+from instrumentation import with_context
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Curator actions which act on each index independently and can be split up
+PARALLEL_COMMANDS = ('allocation', 'close', 'delete_indices', 'forcemerge',
+                     'index_settings', 'open', 'replicas')
+
+
+def index_nodes(client, indices, chunker=None):
+    """
+    Return a dict mapping each index to the set of nodes holding its shards.
+    """
+    nodes = defaultdict(set)
+    for chunk in (chunker or IndexChunker()).csv_chunks(indices):
+        for shard in client.cat.shards(index=chunk, h='index,node', format='json'):
+            if shard.get('node'):
+                nodes[shard['index']].add(shard['node'])
+    return nodes
+
+
+class ParallelRunner(object):
+    """
+    Run a curator action over groups of indices on a bounded thread pool.
+
+    At most `concurrency` groups run at once, and when `per_node_concurrency`
+    is set at most that many groups touching a given node run at once.
+    """
+
+    def __init__(self, client, chunker=None, concurrency=1, per_node_concurrency=0,
+                 chunk_size=1):
+        self.client = client
+        self.chunker = chunker
+        self.concurrency = max(int(concurrency), 1)
+        self.per_node_concurrency = int(per_node_concurrency or 0)
+        self.chunk_size = max(int(chunk_size or 1), 1)
+        self._node_locks = defaultdict(self._node_semaphore)
+        self._lock = threading.Lock()
+
+    def _node_semaphore(self):
+        return threading.BoundedSemaphore(self.per_node_concurrency)
+
+    def groups(self, indices):
+        """
+        Split `indices` into groups of at most `chunk_size` indices which fit a request URL.
+        """
+        chunker = self.chunker or IndexChunker()
+        return chunk_index_list(indices, max_length=chunker.max_length,
+                                max_count=min(filter(None, [chunker.max_count,
+                                                            self.chunk_size])))
+
+    def run(self, ilo, action_class, action_kwargs):
+        """
+        Run `action_class` on every group of the `ilo` working list.
+
+        Returns a dict mapping each index to its outcome.
+        """
+        indices = ilo.working_list()
+        nodes = {}
+        if self.per_node_concurrency:
+            nodes = index_nodes(self.client, indices, chunker=self.chunker)
+        results = {}
+
+        def run_group(group):
+            group_nodes = sorted(set().union(*[nodes.get(i, set()) for i in group]))
+            with self._lock:
+                # Acquire in a stable order so that groups sharing nodes can't deadlock
+                semaphores = [self._node_locks[n] for n in group_nodes]
+            for semaphore in semaphores:
+                semaphore.acquire()
+            started = time.time()
+            try:
+                # Actions update index_info in place, every group works on its own copy
+                sub = CachedIndexList(ilo.client, {i: ilo.index_info[i] for i in group})
+                action_class(sub, **action_kwargs).do_action()
+                outcome = {'success': True}
+            except Exception as e:  # noqa
+                logger.error("Failed on %s: %s", ','.join(group), e)
+                outcome = {'success': False, 'error': str(e)}
+            finally:
+                for semaphore in reversed(semaphores):
+                    semaphore.release()
+            outcome['duration'] = round(time.time() - started, 3)
+            for index in group:
+                results[index] = dict(outcome)
+
+        groups = self.groups(indices)
+        logger.info("Running %d groups of indices with concurrency %d",
+                    len(groups), self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(with_context(run_group), groups))
+        return results
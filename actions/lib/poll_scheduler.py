@@ -0,0 +1,65 @@
+import time
+
+# Default shortest interval as a fraction of the base interval, never below MIN_INTERVAL_FLOOR
+MIN_INTERVAL_RATIO = 0.25
+MIN_INTERVAL_FLOOR = 5
+# Default longest interval as a multiple of the base interval
+MAX_INTERVAL_FACTOR = 8
+
+
+class PollScheduler(object):
+    """
+    Track per query cooldown deadlines and adapt the poll interval.
+
+    The interval doubles, up to `max_interval`, when the cluster errors out
+    or answers slower than `slow_response` seconds. It drops to
+    `min_interval` while a count gets within `approach_ratio` of its
+    threshold, and otherwise drifts back to the base interval. Without
+    them, `min_interval` is a quarter of the base interval but at least
+    `MIN_INTERVAL_FLOOR` seconds, and `max_interval` eight times it.
+    """
+
+    def __init__(self, interval, min_interval=None, max_interval=None,
+                 slow_response=5, approach_ratio=0.8, clock=time.time):
+        self.base_interval = interval
+        self.interval = interval
+        self.min_interval = min_interval or min(
+            interval, max(interval * MIN_INTERVAL_RATIO, MIN_INTERVAL_FLOOR))
+        self.max_interval = max_interval or interval * MAX_INTERVAL_FACTOR
+        self.slow_response = slow_response
+        self.approach_ratio = approach_ratio
+        self._clock = clock
+        self._cooldowns = {}
+
+    def cooling_down(self, name):
+        """
+        Return True while the query called `name` is in its cooldown period.
+        """
+        return self._cooldowns.get(name, 0) > self._clock()
+
+    def cool_down(self, name, seconds):
+        """
+        Skip evaluating the query called `name` for the next `seconds`.
+        """
+        if seconds > 0:
+            self._cooldowns[name] = self._clock() + seconds
+
+    def record(self, elapsed, failed=False, approaching=False):
+        """
+        Adjust and return the poll interval given the outcome of the last poll.
+        """
+        if failed or elapsed > self.slow_response:
+            self.interval = min(self.interval * 2, self.max_interval)
+        elif approaching:
+            self.interval = self.min_interval
+        elif self.interval > self.base_interval:
+            self.interval = max(self.interval / 2.0, self.base_interval)
+        elif self.interval < self.base_interval:
+            self.interval = min(self.interval * 2, self.base_interval)
+        return self.interval
+
+    def approaching(self, count, threshold):
+        """
+        Return True when `count` is close enough to `threshold` to poll faster.
+        """
+        return count > 0 and count >= threshold * self.approach_ratio
@@ -0,0 +1,154 @@
+# pylint: disable=no-member
+
+import json
+
+# Supported shapes of the search results
+OUTPUT_FORMATS = ('raw', 'hits', 'rows')
+
+
+def source_filtering(body, includes=None, excludes=None, docvalue_fields=None):
+    """
+    Return a copy of the search `body` fetching only the given source and doc value fields.
+
+    Source filters replace any `_source` of the body, doc value fields are
+    added to the ones it asks for. Returns `body` untouched when there is
+    nothing to filter.
+    """
+    if not includes and not excludes and not docvalue_fields:
+        return body
+    body = dict(body or {})
+    if includes or excludes:
+        body['_source'] = {'includes': list(includes or []),
+                           'excludes': list(excludes or [])}
+    if docvalue_fields:
+        fields = list(body.get('docvalue_fields') or [])
+        body['docvalue_fields'] = fields + [f for f in docvalue_fields if f not in fields]
+    return body
+
+
+def flatten(source, prefix='', out=None):
+    """
+    Flatten nested objects of `source` into a single level dict with dotted keys.
+
+    Arrays are kept as they are.
+    """
+    out = {} if out is None else out
+    for key, value in source.items():
+        if isinstance(value, dict) and value:
+            flatten(value, prefix + key + '.', out)
+        else:
+            out[prefix + key] = value
+    return out
+
+
+def hit_row(hit):
+    """
+    Return `hit` as a flat row of its metadata, source and doc value fields.
+
+    Doc value fields holding a single value are unwrapped from their array.
+    """
+    row = {'_index': hit.get('_index'), '_id': hit.get('_id')}
+    for key in ('_score', '_cluster'):
+        if hit.get(key) is not None:
+            row[key] = hit[key]
+    flatten(hit.get('_source') or {}, out=row)
+    for field, values in (hit.get('fields') or {}).items():
+        row[field] = values[0] if isinstance(values, list) and len(values) == 1 else values
+    return row
+
+
+def shape_hit(hit, output_format):
+    return hit_row(hit) if output_format == 'rows' else hit
+
+
+def shape_result(result, output_format='raw'):
+    """
+    Reshape a search `result` into `output_format`.
+
+    `raw` keeps the search response as is. `hits` keeps only the total and
+    the hits, and `rows` turns the hits into flat rows. Keys the pack adds
+    to responses, such as `stream` or `clusters`, are kept in every format.
+    """
+    output_format = output_format or 'raw'
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('Invalid output format: {0}'.format(output_format))
+    if output_format == 'raw':
+        return result
+    shaped = dict((k, v) for k, v in result.items() if k in ('stream', 'clusters'))
+    shaped['total'] = result['hits']['total']
+    if output_format == 'rows':
+        shaped['rows'] = [hit_row(hit) for hit in result['hits']['hits']]
+    else:
+        shaped['hits'] = result['hits']['hits']
+    return shaped
+
+
+def result_total(result):
+    """
+    Return the total number of hits of a result shaped by `shape_result`.
+    """
+    if 'total' in result:
+        return result['total']
+    return result['hits']['total']
+
+
+def _items(result):
+    if 'rows' in result:
+        return result['rows']
+    if isinstance(result['hits'], list):
+        return result['hits']
+    return result['hits']['hits']
+
+
+def _set_items(result, items):
+    if 'rows' in result:
+        result['rows'] = items
+    elif isinstance(result['hits'], list):
+        result['hits'] = items
+    else:
+        result['hits']['hits'] = items
+
+
+def limit_size(result, max_bytes):
+    """
+    Drop hits from the end of `result` until its JSON encoding fits in `max_bytes`.
+
+    A `truncation` object telling whether hits were dropped, how many were
+    returned and omitted and the size of the encoded result is added to the
+    result, its size is accounted for. `max_bytes` of 0 disables the limit.
+    """
+    max_bytes = int(max_bytes or 0)
+    if max_bytes <= 0:
+        return result
+    items = _items(result)
+    truncation = {'truncated': False, 'returned': len(items), 'omitted': 0,
+                  'bytes': 0, 'max_bytes': max_bytes}
+    result['truncation'] = truncation
+    if _encoded_size(result) <= max_bytes:
+        return result
+
+    # Size of everything but the hits, with room for the truncation counters to grow
+    _set_items(result, [])
+    truncation.update(truncated=True, returned=0, omitted=len(items))
+    used = len(json.dumps(result)) + 2 * len(str(len(items))) + len(str(max_bytes))
+    kept = 0
+    for item in items:
+        # Each hit takes its encoding and a separator
+        used += len(json.dumps(item)) + (2 if kept else 0)
+        if used > max_bytes:
+            break
+        kept += 1
+    _set_items(result, items[:kept])
+    truncation.update(returned=kept, omitted=len(items) - kept)
+    _encoded_size(result)
+    return result
+
+
+def _encoded_size(result):
+    # Settle the size reported in `truncation`, which is part of what it measures
+    truncation = result['truncation']
+    size = len(json.dumps(result))
+    while truncation['bytes'] != size:
+        truncation['bytes'] = size
+        size = len(json.dumps(result))
+    return size
@@ -0,0 +1,73 @@
+# pylint: disable=no-member
+
+import functools
+
+
+def sort_directions(sort):
+    """
+    Return a list of booleans telling whether each sort clause is descending.
+
+    :arg sort: A list of sort clauses as accepted by the search API.
+    """
+    directions = []
+    for clause in sort or []:
+        if isinstance(clause, dict):
+            field, spec = list(clause.items())[0]
+            order = spec.get('order') if isinstance(spec, dict) else spec
+        else:
+            field, order = clause, None
+        if order is None:
+            order = 'desc' if field == '_score' else 'asc'
+        directions.append(order == 'desc')
+    return directions
+
+
+def _compare_hits(descending, a, b):
+    if 'sort' not in a or 'sort' not in b:
+        a_score, b_score = a.get('_score') or 0, b.get('_score') or 0
+        return (a_score < b_score) - (a_score > b_score)
+    for i, (x, y) in enumerate(zip(a['sort'], b['sort'])):
+        if x == y:
+            continue
+        if x is None or y is None:
+            # Missing values sort last
+            return 1 if x is None else -1
+        result = -1 if x < y else 1
+        return -result if i < len(descending) and descending[i] else result
+    return 0
+
+
+def merge_search_results(results, offset=0, size=10, sort=None):
+    """
+    Merge several search responses into a single one.
+
+    Each response should have been requested with ``from=0`` and
+    ``size=offset+size``, so that the requested page can be cut out of the
+    merged hits. Hits are ordered by their sort values, or by descending
+    score for unsorted searches.
+
+    :arg results: A list of Elasticsearch search responses.
+    :arg sort: The sort clauses the searches were run with, if any.
+    """
+    hits = []
+    merged = {
+        'took': 0, 'timed_out': False,
+        '_shards': {'total': 0, 'successful': 0, 'skipped': 0, 'failed': 0},
+        'hits': {'total': 0, 'max_score': None, 'hits': hits}
+    }
+    for result in results:
+        merged['took'] = max(merged['took'], result.get('took', 0))
+        merged['timed_out'] = merged['timed_out'] or result.get('timed_out', False)
+        for k, v in result.get('_shards', {}).items():
+            if isinstance(v, int):
+                merged['_shards'][k] = merged['_shards'].get(k, 0) + v
+        merged['hits']['total'] += result['hits']['total']
+        max_score = result['hits'].get('max_score')
+        if max_score is not None:
+            merged['hits']['max_score'] = max(merged['hits']['max_score'] or 0, max_score)
+        hits.extend(result['hits']['hits'])
+
+    hits.sort(key=functools.cmp_to_key(
+        functools.partial(_compare_hits, sort_directions(sort))))
+    merged['hits']['hits'] = hits[offset:offset + size]
+    return merged
@@ -0,0 +1,103 @@
+# pylint: disable=no-member
+
+import copy
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Supported ways of walking the result set
+STREAM_MODES = ('scroll', 'search_after')
+
+
+class HitStream(object):
+    """
+    Walk the whole result set of a search one page at a time.
+
+    Only the current page is kept in memory. The ``search_after`` mode needs
+    a ``sort`` (ending with a unique tiebreaker) in the request body, without
+    one the stream falls back to a scroll. Scroll contexts are cleared on
+    close, so the stream should be used as a context manager.
+    """
+
+    def __init__(self, client, index='_all', body=None, params=None, page_size=1000,
+                 mode='scroll', scroll='1m', search_after=None):
+        if mode not in STREAM_MODES:
+            raise ValueError('invalid stream mode: {0}'.format(mode))
+        self.client = client
+        self.index = index
+        self.body = copy.deepcopy(body) if body else {}
+        self.params = dict(params or {})
+        self.page_size = int(page_size)
+        self.scroll = scroll
+        self.search_after = search_after
+        self.mode = mode
+        if mode == 'search_after' and not self.body.get('sort'):
+            logger.warning("search_after requires a sort, falling back to scroll")
+            self.mode = 'scroll'
+        self.total = 0
+        self.pages = 0
+        self._scroll_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __iter__(self):
+        """
+        Yield lists of hits until the result set is exhausted.
+        """
+        if self.mode == 'scroll':
+            return self._scroll_pages()
+        return self._search_after_pages()
+
+    @property
+    def cursor(self):
+        """
+        Sort values of the last returned hit, usable to resume a search_after stream.
+        """
+        return self.search_after if self.mode == 'search_after' else None
+
+    def _scroll_pages(self):
+        body = dict(self.body, size=self.page_size)
+        result = self.client.search(index=self.index, body=body, scroll=self.scroll,
+                                    **self.params)
+        while True:
+            self._scroll_id = result.get('_scroll_id')
+            hits = result['hits']['hits']
+            self.total = result['hits']['total']
+            if not hits:
+                break
+            self.pages += 1
+            yield hits
+            result = self.client.scroll(scroll_id=self._scroll_id, scroll=self.scroll)
+
+    def _search_after_pages(self):
+        body = dict(self.body, size=self.page_size)
+        while True:
+            if self.search_after is not None:
+                body['search_after'] = self.search_after
+            result = self.client.search(index=self.index, body=body, **self.params)
+            hits = result['hits']['hits']
+            self.total = result['hits']['total']
+            if not hits:
+                break
+            self.search_after = hits[-1]['sort']
+            self.pages += 1
+            yield hits
+            if len(hits) < self.page_size:
+                break
+
+    def close(self):
+        """
+        Release the server side scroll context, if any.
+        """
+        if self._scroll_id is None:
+            return
+        try:
+            self.client.clear_scroll(scroll_id=self._scroll_id, ignore=(404,))
+        except Exception as e:  # noqa
+            logger.warning("Failed to clear scroll context: %s", e)
+        self._scroll_id = None
@@ -0,0 +1,170 @@
+# pylint: disable=no-member
+
+from curator.exceptions import FailedExecution, SnapshotInProgress
+from elasticsearch import NotFoundError, TransportError
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Raised while another snapshot is created or deleted, the supported versions run one at a time
+CONCURRENT_EXCEPTION = 'concurrent_snapshot_execution_exception'
+
+
+def _is_concurrent_error(error):
+    return isinstance(error, SnapshotInProgress) or CONCURRENT_EXCEPTION in str(error)
+
+
+class Checkpoint(object):
+    """
+    JSON file recording the snapshots already handled in each repository.
+
+    It's rewritten atomically after every step, so that a run which failed
+    or timed out resumes where it stopped, and removed once a run succeeds.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path) if path else None
+        self._lock = threading.Lock()
+        self.data = {}
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as fh:
+                self.data = json.load(fh)
+            logger.info("Resuming from checkpoint %s", self.path)
+
+    def done(self, repository):
+        return set(self.data.get(repository, []))
+
+    def add(self, repository, names):
+        with self._lock:
+            self.data.setdefault(repository, []).extend(names)
+            if not self.path:
+                return
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.',
+                                       prefix='.checkpoint')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(self.data, fh)
+            os.rename(tmp, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SnapshotOrchestrator(object):
+    """
+    Delete or create snapshots in several repositories.
+
+    The supported versions run a single snapshot deletion or creation at a
+    time, whatever the repository, so repositories are processed one after
+    the other and their snapshots one at a time, `delay` seconds apart.
+    Finding an operation started by someone else running, a step retries
+    `retry_count` times, `retry_interval` seconds apart.
+    """
+
+    def __init__(self, client, delay=0, retry_interval=120, retry_count=3, checkpoint=None):
+        self.client = client
+        self.delay = float(delay or 0)
+        self.retry_interval = float(retry_interval)
+        self.retry_count = int(retry_count)
+        self.checkpoint = checkpoint or Checkpoint(None)
+
+    def _retrying(self, fn):
+        for attempt in range(self.retry_count + 1):
+            try:
+                return fn()
+            except (TransportError, SnapshotInProgress, FailedExecution) as e:
+                if not _is_concurrent_error(e) or attempt == self.retry_count:
+                    raise
+                logger.info("Another snapshot operation is running, retrying in %ss",
+                            self.retry_interval)
+                time.sleep(self.retry_interval)
+
+    def _run(self, plan, fn):
+        started = time.time()
+        results = dict((repository, fn(repository, plan[repository])) for repository in plan)
+        took = time.time() - started
+        success = all(r['success'] for r in results.values())
+        if success:
+            self.checkpoint.clear()
+        return {'success': success, 'took': round(took, 3), 'repositories': results}
+
+    def delete(self, plan):
+        """
+        Delete the snapshots of `plan`, a dict of snapshot names per repository.
+        """
+        result = self._run(plan, self._delete)
+        deleted = sum(r['deleted'] for r in result['repositories'].values())
+        result['deleted'] = deleted
+        result['missing'] = sum(r['missing'] for r in result['repositories'].values())
+        result['snapshots_per_minute'] = round(deleted * 60.0 / result['took'], 2) \
+            if result['took'] else None
+        return result
+
+    def _delete(self, repository, names):
+        started = time.time()
+        done = self.checkpoint.done(repository)
+        pending = [n for n in names if n not in done]
+        deleted = missing = 0
+        error = None
+        for i, name in enumerate(pending):
+            if i and self.delay:
+                time.sleep(self.delay)
+            try:
+                self._retrying(lambda: self.client.snapshot.delete(
+                    repository=repository, snapshot=name))
+            except NotFoundError:
+                # Deleted by someone else meanwhile, it doesn't count towards the rate
+                missing += 1
+                logger.info("%s was already gone from %s", name, repository)
+            except TransportError as e:
+                error = str(e)
+                logger.error("Failed to delete %s from %s: %s", name, repository, e)
+                break
+            else:
+                deleted += 1
+                logger.info("Deleted %s from %s", name, repository)
+            self.checkpoint.add(repository, [name])
+        took = time.time() - started
+        return {'success': error is None, 'deleted': deleted, 'missing': missing,
+                'skipped': len(names) - len(pending),
+                'remaining': len(pending) - deleted - missing,
+                'took': round(took, 3),
+                'snapshots_per_minute': round(deleted * 60.0 / took, 2) if took else None,
+                'error': error}
+
+    def create(self, plan):
+        """
+        Create the snapshots of `plan`, a dict of curator Snapshot actions per repository.
+        """
+        result = self._run(plan, self._create)
+        size = sum(r.get('bytes') or 0 for r in result['repositories'].values())
+        result['bytes'] = size
+        result['mb_per_second'] = round(size / 1048576.0 / result['took'], 3) \
+            if result['took'] else None
+        return result
+
+    def _create(self, repository, action):
+        if action.name in self.checkpoint.done(repository):
+            return {'success': True, 'snapshot': action.name, 'skipped': True}
+        started = time.time()
+        try:
+            self._retrying(action.do_action)
+        except Exception as e:  # noqa
+            logger.error("Failed to snapshot into %s: %s", repository, e)
+            return {'success': False, 'snapshot': action.name, 'error': str(e)}
+        took = time.time() - started
+        status = self.client.snapshot.status(repository=repository,
+                                             snapshot=action.name)['snapshots'][0]
+        stats = status.get('stats', {})
+        # Bytes copied, reported as incremental from 6.4
+        size = stats.get('incremental', {}).get('size_in_bytes',
+                                                stats.get('total_size_in_bytes'))
+        self.checkpoint.add(repository, [action.name])
+        return {'success': status['state'] == 'SUCCESS', 'snapshot': action.name,
+                'state': status['state'], 'bytes': size, 'took': round(took, 3),
+                'mb_per_second': round(size / 1048576.0 / took, 3) if size and took else None}
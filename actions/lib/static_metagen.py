@@ -60,6 +60,12 @@ class StaticMetagen(object):
                 "description": "Do not perform any changes.",
                 "type": "boolean",
                 "default": False
+            },
+            "include_metrics": {
+                "description": "Add the count, latency and size of the Elasticsearch "
+                               "requests made to the result.",
+                "type": "boolean",
+                "default": False
             }
         },
         "runner_type": "python-script",
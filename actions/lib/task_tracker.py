@@ -0,0 +1,167 @@
+# pylint: disable=no-member
+
+from chunking import chunk_index_list
+from collections import namedtuple
+from elasticsearch import NotFoundError
+import json
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Commands which can be submitted without waiting for their completion, force merges
+# only run in the background from Elasticsearch 8.1
+ASYNC_COMMANDS = ('reindex', 'snapshot', 'restore')
+# Datastore keys of the tracked operations, shared by the actions and the task sensor
+KEY_PREFIX = 'elasticsearch.tasks.'
+SNAPSHOT_DONE_STATES = ('SUCCESS', 'FAILED', 'PARTIAL', 'ABORTED')
+
+Status = namedtuple('Status', 'done success progress details')
+
+
+def new_record(kind, **fields):
+    record = {'id': '{0}-{1}'.format(kind, uuid.uuid4().hex[:12]), 'kind': kind,
+              'submitted': int(time.time()), 'progress': None}
+    record.update(fields)
+    return record
+
+
+def submit(client, command, items, kwargs):
+    """
+    Start `command` on the `items` index or snapshot list without waiting for it.
+
+    Returns the record of the submitted operation, to be tracked with
+    `check` until it's done. Reindexing is tracked through its task ids,
+    snapshots and restores through the snapshot status and recovery APIs.
+    """
+    # Loaded here, tasks.status and the task sensor only check records
+    from curator.cli import CLASS_MAP
+    kwargs = dict(kwargs, wait_for_completion=False)
+    if command == 'reindex':
+        action = CLASS_MAP['reindex'](items, **kwargs)
+        tasks = []
+        for source, dest in action.sources():
+            response = client.reindex(**action._get_reindex_args(source, dest))
+            tasks.append(response['task'])
+            logger.info("Started reindex of %s into %s as task %s", source, dest,
+                        response['task'])
+        return new_record('reindex', tasks=tasks)
+
+    if command == 'snapshot':
+        action = CLASS_MAP['snapshot'](items, **kwargs)
+        action.do_action()
+        return new_record('snapshot', repository=action.repository, snapshot=action.name)
+
+    kwargs.pop('repository', None)
+    action = CLASS_MAP['restore'](items, **kwargs)
+    action.do_action()
+    return new_record('restore', repository=action.repository, snapshot=action.name,
+                      indices=action.expected_output)
+
+
+def _task_progress(status):
+    total = status.get('total') or 0
+    if not total:
+        return None
+    done = sum(status.get(k, 0) for k in ('created', 'updated', 'deleted', 'version_conflicts',
+                                          'noops'))
+    return round(float(done) / total, 4)
+
+
+def _check_tasks(client, record):
+    done = success = True
+    progress = []
+    details = {}
+    for task_id in record.get('tasks', []):
+        try:
+            task = client.tasks.get(task_id=task_id)
+        except NotFoundError:
+            # Finished tasks are only kept when started without waiting for completion
+            details[task_id] = {'completed': True}
+            continue
+        status = task.get('task', {}).get('status') or {}
+        failures = (task.get('response') or {}).get('failures') or []
+        details[task_id] = {'completed': task.get('completed', False), 'status': status}
+        if task.get('error') or failures:
+            details[task_id]['error'] = task.get('error') or failures[:10]
+            success = False
+        done = done and task.get('completed', False)
+        progress.append(_task_progress(status))
+    known = [p for p in progress if p is not None]
+    return Status(done, success if done else None,
+                  1.0 if done else (round(sum(known) / len(known), 4) if known else None),
+                  details)
+
+
+def _check_snapshot(client, record):
+    status = client.snapshot.status(repository=record['repository'],
+                                    snapshot=record['snapshot'])['snapshots'][0]
+    shards = status.get('shards_stats', {})
+    done = status['state'] in SNAPSHOT_DONE_STATES
+    progress = float(shards.get('done', 0)) / shards['total'] if shards.get('total') else None
+    return Status(done, status['state'] == 'SUCCESS' if done else None,
+                  round(progress, 4) if progress is not None else None,
+                  {'state': status['state'], 'shards': shards})
+
+
+def _check_restore(client, record):
+    recovered = total = 0
+    shards = stages_done = 0
+    found = set()
+    for chunk in chunk_index_list(record['indices']):
+        response = client.indices.recovery(index=','.join(chunk), ignore_unavailable=True)
+        for index, recovery in response.items():
+            found.add(index)
+            for shard in recovery.get('shards', []):
+                shards += 1
+                stages_done += shard['stage'] == 'DONE'
+                size = shard.get('index', {}).get('size', {})
+                recovered += size.get('recovered_in_bytes', 0)
+                total += size.get('total_in_bytes', 0)
+    missing = sorted(set(record['indices']) - found)
+    done = not missing and shards == stages_done
+    return Status(done, True if done else None,
+                  1.0 if done else (round(float(recovered) / total, 4) if total else None),
+                  {'shards': shards, 'shards_done': stages_done, 'recovered_bytes': recovered,
+                   'total_bytes': total, 'missing': missing})
+
+
+def check(client, record):
+    """
+    Return the Status of the operation described by `record`.
+
+    `progress` is the completed fraction, when it can be told, and
+    `success` is None until the operation is done.
+    """
+    if record['kind'] == 'reindex':
+        return _check_tasks(client, record)
+    if record['kind'] == 'snapshot':
+        return _check_snapshot(client, record)
+    return _check_restore(client, record)
+
+
+class TaskStore(object):
+    """
+    Records of the submitted operations, kept in the st2 datastore.
+
+    Records are stored in the pack scope rather than the one of each action
+    or sensor, so that the task sensor sees what any action submitted.
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def save(self, record):
+        self.service.set_value(KEY_PREFIX + record['id'], json.dumps(record), local=False)
+
+    def get(self, record_id):
+        value = self.service.get_value(KEY_PREFIX + record_id, local=False)
+        return json.loads(value) if value else None
+
+    def list(self):
+        return [json.loads(item.value)
+                for item in self.service.list_values(local=False, prefix=KEY_PREFIX)]
+
+    def delete(self, record_id):
+        self.service.delete_value(KEY_PREFIX + record_id, local=False)
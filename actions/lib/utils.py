@@ -1,10 +1,10 @@
 # pylint: disable=no-member
-from __future__ import print_function
 
+from chunking import chunk_index_list  # noqa: F401
+import client_pool
+from instrumentation import metrics
 import elasticsearch
-import sys
 import logging
-from curator.utils import get_version, is_master_node
 
 # Elasticsearch versions supported
 version_max = (7, 0, 0)
@@ -12,76 +12,100 @@ version_min = (5, 0, 0)
 logger = logging.getLogger(__name__)
 
 
+class ClientError(elasticsearch.ElasticsearchException):
+    """
+    No usable client could be had for a cluster: it can't be reached, its
+    version isn't supported or, with master_only, the node isn't the
+    elected master. Actions exit with `exit_code`.
+    """
+
+    def __init__(self, message, exit_code=1):
+        super(ClientError, self).__init__(message)
+        self.exit_code = exit_code
+
+
+def get_version(client):
+    """
+    Return the Elasticsearch version of the cluster as a tuple of integers.
+
+    Same as curator.utils.get_version, which isn't imported here so that
+    actions not running curator don't pay for loading it.
+    """
+    version = client.info()['version']['number'].split('-')[0].split('.')
+    return tuple(map(int, version[:3]))
+
+
 def check_version(client):
     """
-    Verify version is within acceptable range.  Exit with error if it is not.
+    Verify version is within acceptable range.  Raise ClientError if it is not.
     :arg client: The Elasticsearch client connection
     """
-    version_number = get_version(client)
+    with metrics.phase('check_version'):
+        version_number = get_version(client)
     logger.debug('Detected Elasticsearch version %s', ".".join(map(str, version_number)))
     if version_number >= version_max or version_number < version_min:
         vmin = ".".join(map(str, version_min))
         vmax = ".".join(map(str, version_max))
         vnum = ".".join(map(str, version_number))
-        print('Expected Elasticsearch version range > {} < {}'.format(vmin, vmax))
-        print('ERROR: Incompatible with version {} of Elasticsearch.  Exiting.'.format(vnum))
-        sys.exit(1)
+        raise ClientError('Incompatible with version {} of Elasticsearch, expected version '
+                          'range > {} < {}'.format(vnum, vmin, vmax))
 
 
 def check_master(client, master_only=False):
     """
-    Check if master node.  If not, exit with error code
+    Check if master node.  If not, raise ClientError with exit code 9
     """
-    if master_only and not is_master_node(client):
+    if not master_only:
+        return
+    from curator.utils import is_master_node
+    with metrics.phase('check_master'):
+        is_master = is_master_node(client)
+    if not is_master:
         logger.info('Master-only flag detected. Connected to non-master node. Aborting.')
-        sys.exit(9)
-
-
-def chunk_index_list(indices):
-    """
-    This utility chunks very large index lists into 3KB chunks
-    It measures the size as a csv string, then converts back into a list
-    for the return value.
-    :arg indices: A list of indices to act on.
-
-    !When version > 3.0.3 of curator is released. Should be removed!
-    """
-    chunks = []
-    chunk = ""
-    for index in indices:
-        if len(chunk) < 3072:
-            if not chunk:
-                chunk = index
-            else:
-                chunk += "," + index
-        else:
-            chunks.append(chunk.split(','))
-            chunk = index
-    chunks.append(chunk.split(','))
-    return chunks
+        raise ClientError('Connected to a non-master node with master_only set', exit_code=9)
 
 
 def get_client(host, port=9200, url_prefix=None, http_auth=None, use_ssl=False,
-               master_only=False, timeout=30):
+               master_only=False, timeout=30, pool_maxsize=None, client_idle_ttl=None,
+               check_ttl=None):
     """
-    Return an Elasticsearch client using the provided parameters
+    Return a pooled Elasticsearch client using the provided parameters.
+
+    Clients are shared process-wide through the client registry, so calling
+    this repeatedly for the same cluster doesn't open new connections nor
+    re-run the version and master checks until `check_ttl` expires. Raises
+    ClientError when the cluster can't be used.
     """
+    pool_maxsize = pool_maxsize or client_pool.DEFAULT_POOL_MAXSIZE
+    idle_ttl = client_idle_ttl or client_pool.DEFAULT_IDLE_TTL
+    check_ttl = client_pool.DEFAULT_CHECK_TTL if check_ttl is None else check_ttl
     kwargs = compact_dict({
-        'hosts': [host], 'port': port, 'http_auth': http_auth,
+        'port': port, 'http_auth': http_auth,
         'url_prefix': url_prefix, 'use_ssl': use_ssl,
         'timeout': timeout
     })
     logger.debug("ES client kwargs = %s", kwargs)
+    key = client_pool.registry.make_key(host, port=port, url_prefix=url_prefix,
+                                        http_auth=http_auth, use_ssl=use_ssl, timeout=timeout)
     try:
-        client = elasticsearch.Elasticsearch(**kwargs)
+        with metrics.phase('client'):
+            client = client_pool.registry.get(
+                key, lambda: client_pool.new_client([host], pool_maxsize=pool_maxsize,
+                                                    **kwargs),
+                idle_ttl=float(idle_ttl))
         # Verify the version is acceptable.
-        check_version(client)
+        client_pool.registry.check(key, 'version', lambda: check_version(client),
+                                   check_ttl=float(check_ttl))
         # Verify "master_only" status, if applicable
-        check_master(client, master_only=master_only)
+        if master_only:
+            client_pool.registry.check(key, 'master',
+                                       lambda: check_master(client, master_only=True),
+                                       check_ttl=float(check_ttl))
         return client
+    except ClientError:
+        raise
     except Exception as e:  # noqa
-        print("ERROR: Connection failure: {0}".format(e.message))
-        sys.exit(1)
+        raise ClientError('Connection failure: {0}'.format(e))
 
 
 def compact_dict(source_dict):
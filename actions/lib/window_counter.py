@@ -0,0 +1,85 @@
+from collections import deque
+import json
+
+
+class WindowCounter(object):
+    """
+    Keep a rolling window count out of per poll slice counts.
+
+    Every poll only counts the documents between the high water mark of the
+    previous poll and now, and the window total is the sum of the slices
+    still overlapping the window. All timestamps are epoch milliseconds.
+    A slice straddling the window start is counted in full until it ends
+    before the window, so the total may overshoot by at most one slice.
+
+    Slices end `delay` seconds before now, so that documents indexed up to
+    `delay` seconds after their timestamp are still counted. The window
+    trails the current time by as much.
+    """
+
+    def __init__(self, window, slice_length, high_water=None, slices=None, delay=0):
+        self.window = int(window) * 1000
+        self.slice_length = max(int(slice_length), 1) * 1000
+        self.delay = max(int(delay), 0) * 1000
+        self.high_water = high_water
+        self.slices = deque(tuple(s) for s in slices or [])
+
+    def next_range(self, now):
+        """
+        Return the (start, end, reseed) range which has to be counted next.
+
+        `reseed` is True when there's no usable high water mark, either on the
+        first poll or after a gap longer than the window. The whole window then
+        has to be counted in `slice_length` buckets and passed to `seed`.
+        """
+        now -= self.delay
+        window_start = now - self.window
+        if self.high_water is None or self.high_water < window_start or self.high_water > now:
+            return window_start, now, True
+        return self.high_water, now, False
+
+    def seed(self, end, buckets):
+        """
+        Replace the slices with date histogram `buckets` and return the window total.
+
+        :arg buckets: (bucket start, doc count) pairs, `slice_length` wide.
+        """
+        self.slices.clear()
+        for key, count in sorted(buckets):
+            self.slices.append((min(key + self.slice_length, end), count))
+        self.high_water = end
+        return self._expire(end)
+
+    def add(self, end, count):
+        """
+        Record the count of the slice ending at `end` and return the window total.
+        """
+        self.slices.append((end, count))
+        self.high_water = end
+        return self._expire(end)
+
+    def _expire(self, now):
+        window_start = now - self.window
+        while self.slices and self.slices[0][0] <= window_start:
+            self.slices.popleft()
+        return self.total
+
+    @property
+    def total(self):
+        return sum(count for _, count in self.slices)
+
+    def dumps(self):
+        return json.dumps({'high_water': self.high_water, 'slices': list(self.slices),
+                           'window': self.window // 1000})
+
+    @classmethod
+    def loads(cls, window, slice_length, data, delay=0):
+        """
+        Restore a counter from `dumps` output, ignoring state saved for another window.
+        """
+        state = json.loads(data) if data else {}
+        if state.get('window') != int(window):
+            return cls(window, slice_length, delay=delay)
+        # A high water mark past a longer delay makes the next poll reseed
+        return cls(window, slice_length, high_water=state.get('high_water'),
+                   slices=state.get('slices'), delay=delay)
@@ -0,0 +1,376 @@
+# pylint: disable=no-member
+"""
+Long-lived worker running the pack actions on a local Unix socket.
+
+Start it with the Python of the pack virtualenv:
+
+    python actions/lib/worker.py --socket /var/run/st2-elasticsearch.sock
+"""
+from __future__ import print_function
+
+from instrumentation import metrics
+import argparse
+import contextvars
+import hashlib
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bumped on incompatible changes of the messages, a worker refuses other versions
+PROTOCOL_VERSION = 2
+# Seconds a shim waits to connect before running the action itself
+CONNECT_TIMEOUT = 1.0
+# Entry point module and runner class of each runner a worker serves
+RUNNERS = {
+    'search': ('search', 'SearchRunner'),
+    'curator': ('curator_runner', 'CuratorRunner'),
+}
+
+
+class WorkerUnavailable(Exception):
+    """
+    No worker accepted the request, the action should run in the calling process.
+    """
+
+
+class WorkerError(Exception):
+    """
+    The worker failed to run the action.
+    """
+
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _receive(stream):
+    line = stream.readline()
+    return json.loads(line.decode('utf-8')) if line else None
+
+
+def call(path, runner, config, params):
+    """
+    Run `runner` with the pack `config` and action `params` in the worker listening on `path`.
+
+    Returns the response of the worker, with the `outcome` returned by the
+    runner, what it printed as `stdout`, what it logged at its log_level as
+    `stderr` and its `exit_code` when it exited.
+    Raises WorkerUnavailable when no worker speaking this protocol version
+    listens on `path`.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(path)
+        except (IOError, OSError, socket.error) as e:
+            raise WorkerUnavailable('No worker on {0}: {1}'.format(path, e))
+        # The action timeout of st2 applies from here on
+        sock.settimeout(None)
+        _send(sock, {'version': PROTOCOL_VERSION, 'op': 'run', 'runner': runner,
+                     'config': config, 'params': params})
+        response = _receive(sock.makefile('rb'))
+    finally:
+        sock.close()
+    if response is None:
+        raise WorkerError('The worker on {0} closed the connection'.format(path))
+    if response.get('version') != PROTOCOL_VERSION:
+        raise WorkerUnavailable('The worker on {0} speaks protocol version {1}'.format(
+            path, response.get('version')))
+    if response.get('error'):
+        raise WorkerError(response['error'])
+    return response
+
+
+class MemoryDatastore(object):
+    """
+    In-memory stand-in for the st2 datastore of the actions, with expiring values.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get_value(self, name, local=True, decrypt=False):
+        with self._lock:
+            value, expires = self._values.get(name, (None, None))
+            if expires is not None and expires < time.time():
+                del self._values[name]
+                return None
+            return value
+
+    def set_value(self, name, value, ttl=None, local=True, encrypt=False):
+        with self._lock:
+            self._values[name] = (value, time.time() + ttl if ttl else None)
+        return True
+
+    def delete_value(self, name, local=True):
+        with self._lock:
+            return self._values.pop(name, None) is not None
+
+
+class _Request(object):
+    """
+    Output and log level of the request being run.
+    """
+
+    def __init__(self):
+        self.stdout = io.StringIO()
+        self.stderr = io.StringIO()
+        self.log_level = logging.WARNING
+
+
+# Request of the current context, thread pools of the actions carry it with with_context()
+_request = contextvars.ContextVar('worker_request', default=None)
+
+
+def set_request_log_level(level):
+    """
+    Set the log level of the request being run, returns False outside of a worker request.
+    """
+    request = _request.get()
+    if request is None:
+        return False
+    request.log_level = level
+    return True
+
+
+class RequestOutput(object):
+    """
+    sys.stdout of the worker, writing to the output of the request being run.
+    """
+
+    def __init__(self, default):
+        self.default = default
+
+    def _stream(self):
+        request = _request.get()
+        return self.default if request is None else request.stdout
+
+    def write(self, data):
+        self._stream().write(data)
+
+    def flush(self):
+        self._stream().flush()
+
+
+class RequestLogHandler(logging.Handler):
+    """
+    Write the records of the request being run at its log level to its stderr.
+    """
+
+    def emit(self, record):
+        request = _request.get()
+        if request is not None and record.levelno >= request.log_level:
+            try:
+                request.stderr.write(self.format(record) + '\n')
+            except Exception:  # noqa
+                self.handleError(record)
+
+
+def _outside_requests(record):
+    # The worker logs what actions log only when it runs them itself
+    return _request.get() is None or record.name == __name__
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+
+class Worker(object):
+    """
+    Run the requests of the shims in this process, keeping pooled clients
+    and cached index lists from one request to the next.
+
+    Identical requests of read-only actions arriving while one of them runs
+    share its response instead of running again.
+    """
+
+    def __init__(self):
+        self.datastore = MemoryDatastore()
+        self.output = RequestOutput(sys.stdout)
+        self.counters = {'requests': 0, 'coalesced': 0, 'errors': 0}
+        self.started = time.time()
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def coalesced(message):
+        # Only actions which change nothing can share a response
+        return message['runner'] == 'search' or \
+            str(message['params'].get('action', '')).endswith('.show')
+
+    def handle(self, message):
+        if message.get('version') != PROTOCOL_VERSION:
+            return {'error': 'Unsupported protocol version {0}'.format(message.get('version'))}
+        if message.get('op') == 'stats':
+            return dict(self.counters, uptime=round(time.time() - self.started, 1))
+        if message.get('runner') not in RUNNERS:
+            return {'error': 'Unknown runner {0}'.format(message.get('runner'))}
+        with self._lock:
+            self.counters['requests'] += 1
+        if not self.coalesced(message):
+            return self.execute(message)
+
+        key = hashlib.sha1(json.dumps([message['runner'], message['config'],
+                                       message['params']], sort_keys=True).encode('utf-8'))
+        with self._lock:
+            call = self._calls.get(key.hexdigest())
+            leader = call is None
+            if leader:
+                call = self._calls[key.hexdigest()] = _Call()
+            else:
+                self.counters['coalesced'] += 1
+        if not leader:
+            call.done.wait()
+            return dict(call.response, coalesced=True)
+        try:
+            call.response = self.execute(message)
+        finally:
+            with self._lock:
+                del self._calls[key.hexdigest()]
+            call.done.set()
+        return call.response
+
+    def execute(self, message):
+        module, name = RUNNERS[message['runner']]
+        # The worker runs the actions itself rather than forwarding them again
+        config = dict(message['config'], worker_socket=None)
+        request = _Request()
+        token = _request.set(request)
+        response = {'outcome': None, 'exit_code': None}
+        try:
+            # Requests running at the same time report their own metrics
+            with metrics.collecting():
+                runner = getattr(__import__(module), name)(config=config)
+                # Task records are saved to the st2 datastore by the shim
+                runner.action_service = self.datastore if message['runner'] == 'search' else None
+                outcome = runner.run(**message['params'])
+            response['outcome'] = list(outcome) if outcome is not None else None
+        except SystemExit as e:
+            response['exit_code'] = e.code or 0
+        except Exception as e:  # noqa
+            logger.exception("Request failed")
+            with self._lock:
+                self.counters['errors'] += 1
+            response['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        finally:
+            _request.reset(token)
+        response['stdout'] = request.stdout.getvalue()
+        response['stderr'] = request.stderr.getvalue()
+        return response
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            message = _receive(self.rfile)
+        except ValueError:
+            message = {}
+        if message is None:
+            return
+        response = self.server.worker.handle(message)
+        response['version'] = PROTOCOL_VERSION
+        _send(self.connection, response)
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, worker):
+        self.worker = worker
+        socketserver.UnixStreamServer.__init__(self, path, _Handler)
+
+
+def _remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (IOError, OSError, socket.error):
+        os.remove(path)
+        return
+    finally:
+        sock.close()
+    raise SystemExit('A worker is already listening on {0}'.format(path))
+
+
+def serve(path):
+    """
+    Serve requests on the Unix socket `path` until SIGTERM or SIGINT.
+    """
+    # Actions import from the actions directory, and their lib modules from lib
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:0] = [p for p in (os.path.dirname(here), here) if p not in sys.path]
+
+    worker = Worker()
+    sys.stdout = worker.output
+    # Records of the requests reach their handler whatever the level of the worker
+    root = logging.getLogger()
+    for handler in root.handlers:
+        handler.setLevel(root.level)
+        handler.addFilter(_outside_requests)
+    root.addHandler(RequestLogHandler())
+    root.setLevel(logging.DEBUG)
+    _remove_stale_socket(path)
+    # Requests carry the pack config, credentials included
+    umask = os.umask(0o077)
+    try:
+        server = WorkerServer(path, worker)
+    finally:
+        os.umask(umask)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Worker listening on %s", path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+        logger.info("Worker stopped, %s", worker.counters)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the Elasticsearch pack actions in a '
+                                                 'long-lived process.')
+    parser.add_argument('--socket', required=True, help='Path of the Unix socket to listen on')
+    parser.add_argument('--log-level', default='INFO', help='Log level of the worker')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print the counters of the running worker and exit')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()),
+                        format='%(asctime)s %(threadName)s %(name)s %(levelname)s %(message)s')
+
+    if args.stats:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(args.socket)
+        _send(sock, {'version': PROTOCOL_VERSION, 'op': 'stats'})
+        print(json.dumps(_receive(sock.makefile('rb'))))
+        sock.close()
+        return 0
+    serve(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    # Run the module the actions import, rather than a copy of it named __main__
+    import worker
+    sys.exit(worker.main())
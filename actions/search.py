@@ -2,8 +2,16 @@
 from __future__ import print_function
 
 from easydict import EasyDict
+from lib.aggregation import COMPOSITE_VERSION, Aggregation, group_by, parse_metrics
 from lib.esbase_action import ESBaseAction
-import curator
+from lib.multi_cluster import connection, fan_out, merge_cluster_searches, select_clusters
+from lib.result_shaping import limit_size, result_total, shape_hit, shape_result, \
+    source_filtering
+from lib.search_merge import merge_search_results
+from lib.search_stream import HitStream
+from lib.utils import ClientError, get_version
+import copy
+import hashlib
 import logging
 import sys
 import elasticsearch
@@ -19,6 +27,11 @@ class SearchRunner(ESBaseAction):
         self._return_object = False
 
     def run(self, action=None, log_level='WARNING', operation_timeout=600, **kwargs):
+        forwarded, outcome = self.run_in_worker('search', dict(
+            kwargs, action=action, log_level=log_level, operation_timeout=operation_timeout))
+        if forwarded:
+            return outcome
+
         kwargs.update({
             'timeout': int(operation_timeout),
             'log_level': log_level
@@ -27,57 +40,253 @@ class SearchRunner(ESBaseAction):
         config = EasyDict(self.config)
         self.config = EasyDict(kwargs)
 
-        if config.get('host') is not None:
-            self.config.update({'host': config.get('host')})
-        if config.get('port') is not None:
-            self.config.update({'port': config.get('port')})
+        self.apply_pack_config(config)
 
         self.set_up_logging()
 
         self._return_object = kwargs.get('return_object', False)
 
         if action.endswith('.q'):
-            return self.simple_search()
+            return self.exit_on_client_error(self.simple_search)
+        elif action.endswith('.aggregate'):
+            return self.exit_on_client_error(lambda: self.respond('aggregate_search'))
         else:
-            return self.full_search()
+            return self.exit_on_client_error(self.full_search)
 
     def simple_search(self):
         """Perform URI-based request search.
         """
-        accepted_params = ('q', 'df', 'default_operator', 'from', 'size')
-        kwargs = {k: self.config[k] for k in accepted_params if self.config[k]}
-        wl = curator.IndexList(self.client)
-        indices = ','.join(wl.working_list())
+        return self.respond('query_string_search')
+
+    def full_search(self):
+        """Perform search using Query DSL.
+        """
+        return self.respond('query_dsl_search')
 
+    def respond(self, search):
+        """Run the `search` method on the cluster or clusters selected and output its result.
+        """
         try:
-            result = self.client.search(index=indices, **kwargs)
+            if self.config.get('clusters'):
+                result = self.multi_cluster_search(search)
+            else:
+                result = getattr(self, search)()
+        except ClientError:
+            raise
         except elasticsearch.ElasticsearchException as e:
-            logger.error(e.message)
+            logger.error(e)
+            sys.exit(2)
+        except ValueError as e:
+            logger.error(e)
             sys.exit(2)
 
+        result = shape_result(result, self.config.get('output_format'))
+        result = self.with_metrics(result)
+        result = limit_size(result, self.config.get('max_result_bytes'))
         if self._return_object:
             return True, result
         else:
             self._pp_exit(result)
             return None
 
-    def full_search(self):
-        """Perform search using Query DSL.
-        """
+    def query_string_search(self):
+        accepted_params = ('q', 'df', 'default_operator', 'from', 'size')
+        kwargs = {k: self.config[k] for k in accepted_params if self.config[k]}
+
+        indices = self.resolve_indices()
+        if self.config.get('stream'):
+            body = {'sort': json.loads(self.config.sort)} if self.config.get('sort') else None
+            return self.stream_search(indices, body=self.filter_source(body), params=kwargs)
+        body = self.filter_source(None)
+        if len(indices) == 1:
+            return self.client.search(index=indices[0], body=body, **kwargs)
+        else:
+            return self.chunked_search(indices, params=kwargs, body=body)
+
+    def query_dsl_search(self):
         accepted_params = ('from', 'size')
         kwargs = {k: self.config[k] for k in accepted_params if self.config[k]}
-        try:
-            result = self.client.search(index=self.config.index,
-                                        body=self.config.body, **kwargs)
-        except elasticsearch.ElasticsearchException as e:
-            logger.error(e.message)
-            sys.exit(2)
+        body = self.filter_source(json.loads(self.config.body))
+        if self.config.get('stream'):
+            return self.stream_search([self.config.index], body=body)
+        return self.client.search(index=self.config.index, body=body, **kwargs)
 
-        if self._return_object:
-            return True, result
+    def aggregate_search(self):
+        """Aggregate the matching documents on the cluster and return a flat table of buckets.
+        """
+        o = self.config
+        if o.get('q'):
+            query = {'query_string': {'query': o.q}}
         else:
-            self._pp_exit(result)
-            return None
+            query = json.loads(o.query) if o.get('query') else None
+        aggregation = Aggregation(
+            self.client, index=o.get('index') or '_all', query=query,
+            sources=group_by(date_field=o.get('date_field'), interval=o.get('interval'),
+                             time_zone=o.get('time_zone'), terms=o.get('terms')),
+            metrics=parse_metrics(o.get('metrics')),
+            page_size=o.get('page_size') or 1000, max_buckets=o.get('max_buckets') or 10000,
+            after=json.loads(o.after) if o.get('after') else None,
+            composite=get_version(self.client) >= COMPOSITE_VERSION)
+        return aggregation.run()
+
+    def filter_source(self, body):
+        """Add the source filtering and doc value fields asked for to the search `body`.
+        """
+        return source_filtering(body, includes=self.config.get('source_includes'),
+                                excludes=self.config.get('source_excludes'),
+                                docvalue_fields=self.config.get('docvalue_fields'))
+
+    def multi_cluster_search(self, search):
+        """Run the `search` method on every selected cluster concurrently and merge the results.
+
+        Each cluster is asked for the first `from + size` hits, the merged
+        hits are ordered by score or by the sort of the query body.
+        """
+        if self.config.get('stream'):
+            raise ValueError('Streaming can only search a single cluster')
+        clusters = select_clusters(self.pack_config.get('clusters'), self.config.clusters)
+        offset = int(self.config.get('from') or 0)
+        size = int(self.config.get('size') or 10)
+        sort = None
+        if self.config.get('body'):
+            sort = json.loads(self.config.body).get('sort')
+
+        def search_cluster(cluster):
+            runner = copy.copy(self)
+            runner._client = None
+            runner.config = EasyDict(dict(self.config, size=offset + size,
+                                          **connection(cluster, self.config)))
+            runner.config['from'] = 0
+            return getattr(runner, search)()
+
+        outcomes = fan_out(clusters, search_cluster)
+        if all(o['error'] for o in outcomes):
+            raise ValueError('Search failed on every cluster')
+        return merge_cluster_searches(outcomes, offset=offset, size=size, sort=sort)
+
+    def resolve_indices(self):
+        """Return the list of comma-separated index expressions to search.
+
+        Index names, patterns and aliases given in `index` are passed through
+        untouched. Curator filters given in `filters` are resolved into index
+        names, which are cached in the datastore for `index_cache_ttl` seconds
+        and split into chunks to keep request URLs short.
+        """
+        if not self.config.get('filters'):
+            return [','.join(self.config.get('index') or ['_all'])]
+
+        indices = self._filtered_indices(self.config.filters)
+        if not indices:
+            # An empty index expression would search every index
+            return []
+        return self.chunker.csv_chunks(indices)
+
+    def _filtered_indices(self, filters):
+        """Resolve curator filters into index names, going through the datastore cache.
+        """
+        o = self.config
+        digest = hashlib.sha1(json.dumps(
+            [o.host, o.port, o.get('url_prefix'), filters]).encode('utf-8')).hexdigest()
+        cache_key = 'search.q.indices.{0}'.format(digest)
+        ttl = int(o.get('index_cache_ttl') or 0)
+
+        if ttl > 0 and self.action_service is not None:
+            cached = self.action_service.get_value(cache_key, local=True)
+            if cached is not None:
+                logger.debug("Using cached index list %s", cache_key)
+                return json.loads(cached)
+
+        # Curator is only needed to filter, search.body and plain indices don't load it
+        from lib.catalog import get_catalog
+        import curator
+        catalog = get_catalog(self.client, self.config, chunker=self.chunker)
+        il = catalog.index_list() if catalog else curator.IndexList(self.client)
+        il.iterate_filters({'filters': json.loads('[' + filters + ']')})
+        indices = il.working_list()
+
+        if ttl > 0 and self.action_service is not None:
+            self.action_service.set_value(cache_key, json.dumps(indices), ttl=ttl, local=True)
+        return indices
+
+    def chunked_search(self, indices, params, body=None):
+        """Search each chunk of indices and merge the responses into one.
+        """
+        offset = int(params.get('from') or 0)
+        size = int(params.get('size') or 10)
+        params = dict(params, size=offset + size)
+        params.pop('from', None)
+        results = [self.client.search(index=chunk, body=body, **params) for chunk in indices]
+        return merge_search_results(results, offset=offset, size=size)
+
+    def stream_search(self, indices, body=None, params=None):
+        """Walk the whole result set page by page.
+
+        Hits are written as JSON lines, shaped as `output_format` asks, to
+        `output_file` when it's given, otherwise at most `max_hits` of them
+        are collected into the result.
+
+        Each chunk of indices is walked with its own sort values, so a
+        search_after stream resumes from `search_after` in the
+        `search_after_chunk` chunk it stopped in and walks the chunks after
+        it from their start.
+        """
+        params = {k: v for k, v in (params or {}).items() if k not in ('from', 'size')}
+        search_after = self.config.get('search_after')
+        first = int(self.config.get('search_after_chunk') or 0) if search_after else 0
+        output_file = self.config.get('output_file')
+        max_hits = int(self.config.get('max_hits') or 10000)
+        output_format = self.config.get('output_format')
+        collected = []
+        streamed = total = pages = 0
+        truncated = False
+        mode = cursor = chunk = None
+
+        fh = open(output_file, 'w') if output_file else None
+        try:
+            for position, index in enumerate(indices[first:], first):
+                stream = HitStream(self.client, index=index, body=body, params=params,
+                                   page_size=self.config.get('page_size') or 1000,
+                                   mode=self.config.get('stream_mode') or 'scroll',
+                                   scroll=self.config.get('scroll') or '1m',
+                                   search_after=json.loads(search_after)
+                                   if search_after and position == first else None)
+                with stream:
+                    for hits in stream:
+                        if fh:
+                            for hit in hits:
+                                fh.write(json.dumps(shape_hit(hit, output_format)) + '\n')
+                            streamed += len(hits)
+                            continue
+                        room = max_hits - len(collected)
+                        collected.extend(hits[:room])
+                        streamed += min(len(hits), room)
+                        if len(hits) >= room:
+                            truncated = True
+                            break
+                total += stream.total
+                pages += stream.pages
+                mode, cursor, chunk = stream.mode, stream.cursor, position
+                if truncated:
+                    truncated = streamed < total or position != len(indices) - 1
+                    break
+        finally:
+            if fh:
+                fh.close()
+
+        if truncated and cursor is not None and collected:
+            # Resume right after the last hit handed out, not the last one fetched
+            cursor = collected[-1]['sort']
+
+        logger.info("Streamed %d hits in %d pages", streamed, pages)
+        return {
+            'hits': {'total': total, 'hits': collected},
+            'stream': {
+                'mode': mode, 'pages': pages, 'streamed': streamed,
+                'truncated': truncated, 'output_file': output_file,
+                'search_after': cursor,
+                'search_after_chunk': chunk if cursor is not None else None
+            }
+        }
 
     def _pp_exit(self, data):
         """Print Elastcsearch JSON response and exit.
@@ -87,7 +296,7 @@ class SearchRunner(ESBaseAction):
             kwargs = {'indent': 4}
         print(json.dumps(data, **kwargs))
 
-        if data['hits']['total'] > 0:
+        if result_total(data) > 0:
             sys.exit(0)
         else:
             sys.exit(1)
@@ -0,0 +1,69 @@
+# pylint: disable=no-member
+
+from easydict import EasyDict
+from lib.esbase_action import ESBaseAction
+from lib.multi_cluster import connection
+from lib.task_tracker import TaskStore, check
+import copy
+import elasticsearch
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TasksRunner(ESBaseAction):
+
+    def run(self, action=None, log_level='WARNING', operation_timeout=600, **kwargs):
+        kwargs.update({
+            'timeout': int(operation_timeout),
+            'log_level': log_level
+        })
+
+        config = EasyDict(self.config)
+        self.config = EasyDict(kwargs)
+
+        self.apply_pack_config(config)
+
+        self.set_up_logging()
+        return self.status()
+
+    def status(self):
+        """Report the progress of the operations submitted with `submit_only`.
+        """
+        store = TaskStore(self.action_service)
+        if self.config.get('task_id'):
+            record = store.get(self.config.task_id)
+            if record is None:
+                raise ValueError('Unknown task: {0}'.format(self.config.task_id))
+            records = [record]
+        else:
+            records = store.list()
+
+        tasks = []
+        for record in sorted(records, key=lambda r: r['submitted']):
+            task = dict(record)
+            try:
+                status = check(self.record_client(record), record)
+                task.update(status._asdict())
+            except elasticsearch.ElasticsearchException as e:
+                logger.error("Failed to check task %s: %s", record['id'], e)
+                task.update(done=False, success=None, error=str(e))
+            if task['done'] and self.config.get('forget_completed'):
+                store.delete(record['id'])
+            tasks.append(task)
+
+        failed = [t['id'] for t in tasks if t['success'] is False or t.get('error')]
+        return not failed, self.with_metrics({
+            'tasks': tasks,
+            'running': len([t for t in tasks if not t['done']]),
+            'failed': failed
+        })
+
+    def record_client(self, record):
+        """Return a client of the cluster the operation of `record` was submitted to.
+        """
+        runner = copy.copy(self)
+        runner._client = None
+        runner.config = EasyDict(dict(self.config,
+                                      **connection(record.get('connection') or {}, self.config)))
+        return runner.client
@@ -1,98 +1,305 @@
 #!/usr/bin/env python
 # flake8: noqa
 # encoding: utf-8
+"""
+Generate log events at a target rate to load the Logstash/Elasticsearch pipeline.
+
+Events are JSON documents holding a sentence generated from a Markov chain
+built out of seed.txt. They're either sent as UDP datagrams to the Logstash
+input in etc/conf.d or written straight to Elasticsearch with the _bulk API.
+The achieved rate and send latency percentiles are reported periodically
+and once the run ends.
+
+    logsfeed.py --rate 5000 --duration 60
+    logsfeed.py --mode bulk --url http://localhost:9200 --rate 20000 --workers 4
+"""
 from __future__ import print_function
 
-import os
+import argparse
 import datetime
-import time
+import json
+import os
 import random
 import socket
-from random import choice
-from jinja2 import Template
+import sys
+import threading
+import time
+from array import array
+
+try:
+    from http.client import HTTPConnection, HTTPSConnection
+    from queue import Queue
+    from urllib.parse import urlparse
+except ImportError:
+    from httplib import HTTPConnection, HTTPSConnection
+    from Queue import Queue
+    from urlparse import urlparse
 
 DEST = 'elk_1'
 PORT = 10987
-JSON = '{"@timestamp":"{{timestamp}},"message":"{{message}}"'
-EOS  = ['.', '?', '!']
-NUM  = 10.0
-INT  = 60.0
+# Latencies kept to compute the percentiles from, a uniform sample of them all
+LATENCY_SAMPLES = 10000
+EOS = ['.', '?', '!']
+# Longest sentence generated, the seed text has cycles without an end of sentence
+MAX_WORDS = 64
+
 
-def build_dict(words):
+class MarkovChain(object):
     """
-    Build a dictionary from the words.
+    Second order Markov chain over the words of a text, held in flat arrays.
 
-    (word1, word2) => [w1, w2, ...]  # key: tuple; value: list
+    Each (word1, word2) state gets a number. The successors of state `s` are
+    `words[offsets[s]:offsets[s + 1]]`, and `states` holds the number of the
+    state reached through each successor, or -1 when it's a dead end.
     """
-    d = {}
-    for i, _ in enumerate(words):
-        try:
-            first, second, third = words[i], words[i+1], words[i+2]
-        except IndexError:
-            break
-        key = (first, second)
-        if key not in d:
-            d[key] = []
-        #
-        d[key].append(third)
-
-    return d
-
-
-def generate_sentence(d):
-    li = [key for key in d.keys() if key[0][0].isupper()]
-    key = choice(li)
-
-    li = []
-    first, second = key
-    li.append(first)
-    li.append(second)
-    while True:
-        try:
-            third = choice(d[key])
-        except KeyError:
-            break
-        li.append(third)
-        if third[-1] in EOS:
-            break
-        # else
-        key = (second, third)
-        first, second = key
-
-    return ' '.join(li)
-
-# #############
-
-if __name__ == "__main__":
-    pathname = os.path.realpath(__file__)
-    fname = os.path.dirname(pathname) + "/seed.txt"
-    with open(fname, "r") as f:
-        text = f.read().decode("utf-8")
-
-    words = text.split()
-    d = build_dict(words)
-    template = Template(JSON)
-    sock = socket.socket(socket.AF_INET,    # Internet
-                         socket.SOCK_DGRAM) # UDP
-
-    while True:
-        slept = 0
-        fed = 0
-        beg = datetime.datetime.now()
-        rate = INT/NUM
-        while fed < NUM and slept < INT:
-            print(slept)
-            now = datetime.datetime.now()
-            wait = random.uniform(rate*0.7, rate*1.5)
-
-            sent = generate_sentence(d)
-            json = template.render({"message": sent})
-            sock.sendto(sent.encode('utf-8'), (DEST, PORT))
-            time.sleep(wait)
-            fed = fed + 1
-            slept = slept + wait
-
-        spent = (now - beg).total_seconds()
-        wait = INT - spent
-        if wait > 0:
-            time.sleep(INT - spent)
+
+    def __init__(self, text_words):
+        vocabulary = {}
+        self.vocabulary = []
+        for word in text_words:
+            if word not in vocabulary:
+                vocabulary[word] = len(self.vocabulary)
+                self.vocabulary.append(word)
+        ids = [vocabulary[w] for w in text_words]
+        self.eos = array('b', [w[-1] in EOS for w in self.vocabulary])
+
+        successors = {}
+        for i in range(len(ids) - 2):
+            successors.setdefault((ids[i], ids[i + 1]), []).append(ids[i + 2])
+
+        keys = list(successors)
+        numbers = dict((key, n) for n, key in enumerate(keys))
+        self.keys = array('l', [w for key in keys for w in key])
+        self.offsets = array('l', [0])
+        self.words = array('l')
+        self.states = array('l')
+        for first, second in keys:
+            for third in successors[(first, second)]:
+                self.words.append(third)
+                self.states.append(numbers.get((second, third), -1))
+            self.offsets.append(len(self.words))
+        self.starters = array('l', [n for n, (first, _) in enumerate(keys)
+                                    if self.vocabulary[first][0].isupper()])
+
+    def sentence(self, rand=random.random):
+        state = self.starters[int(rand() * len(self.starters))]
+        out = [self.keys[2 * state], self.keys[2 * state + 1]]
+        while len(out) < MAX_WORDS and state >= 0:
+            lo, hi = self.offsets[state], self.offsets[state + 1]
+            k = lo + int(rand() * (hi - lo))
+            word = self.words[k]
+            out.append(word)
+            if self.eos[word]:
+                break
+            state = self.states[k]
+        vocabulary = self.vocabulary
+        return ' '.join([vocabulary[w] for w in out])
+
+
+def event(chain, seq, host):
+    now = datetime.datetime.utcnow()
+    return json.dumps({
+        '@timestamp': now.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (now.microsecond // 1000),
+        'message': chain.sentence(),
+        'host': host,
+        'seq': seq
+    })
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100.0), len(values) - 1)]
+
+
+class Stats(object):
+    """
+    Counters of the run, with a reservoir sample of the send latencies so
+    that long runs report their percentiles in bounded memory.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.sent = 0
+        self.errors = 0
+        self.requests = 0
+        self.latencies = []
+        self.max_latency = 0.0
+        self.lock = threading.Lock()
+        # Sampling doesn't draw from the generator of the events
+        self.sampler = random.Random()
+
+    def record(self, count, latency, errors=0):
+        with self.lock:
+            self.sent += count
+            self.errors += errors
+            self.requests += 1
+            if len(self.latencies) < LATENCY_SAMPLES:
+                self.latencies.append(latency)
+            else:
+                slot = self.sampler.randrange(self.requests)
+                if slot < LATENCY_SAMPLES:
+                    self.latencies[slot] = latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def report(self, final=False):
+        with self.lock:
+            elapsed = max(time.time() - self.started, 0.001)
+            latencies = self.latencies[:]
+            sent, errors, requests = self.sent, self.errors, self.requests
+            max_latency = self.max_latency
+        ms = [l * 1000 for l in latencies]
+        return {
+            'final': final,
+            'elapsed': round(elapsed, 3),
+            'sent': sent,
+            'errors': errors,
+            'rate': round(sent / elapsed, 1),
+            'requests': requests,
+            'latency_ms': {
+                'p50': round(percentile(ms, 50), 3),
+                'p90': round(percentile(ms, 90), 3),
+                'p99': round(percentile(ms, 99), 3),
+                'max': round(max_latency * 1000, 3)
+            }
+        }
+
+
+class UdpSender(object):
+
+    def __init__(self, args, stats):
+        self.address = (args.dest, args.port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.stats = stats
+
+    def send(self, events):
+        for doc in events:
+            started = time.time()
+            try:
+                self.sock.sendto(doc.encode('utf-8'), self.address)
+                self.stats.record(1, time.time() - started)
+            except socket.error:
+                self.stats.record(0, time.time() - started, errors=1)
+
+    def close(self):
+        self.sock.close()
+
+
+class BulkSender(object):
+    """
+    Send batches of events to the _bulk API from `workers` threads, each
+    holding its own keep-alive connection.
+    """
+
+    def __init__(self, args, stats):
+        url = urlparse(args.url)
+        self.connection = (HTTPSConnection if url.scheme == 'https' else HTTPConnection,
+                           url.hostname, url.port or 9200)
+        self.path = url.path.rstrip('/') + '/_bulk'
+        self.index = args.index
+        self.doc_type = args.doc_type
+        self.stats = stats
+        self.queue = Queue(maxsize=args.workers * 2)
+        self.threads = [threading.Thread(target=self.work) for _ in range(args.workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def send(self, events):
+        self.queue.put(events)
+
+    def work(self):
+        cls, host, port = self.connection
+        conn = cls(host, port, timeout=60)
+        while True:
+            events = self.queue.get()
+            if events is None:
+                break
+            index = datetime.datetime.utcnow().strftime(self.index)
+            meta = json.dumps({'index': {'_index': index, '_type': self.doc_type}})
+            body = ''.join(meta + '\n' + doc + '\n' for doc in events).encode('utf-8')
+            started = time.time()
+            errors = 0
+            try:
+                conn.request('POST', self.path, body,
+                              {'Content-Type': 'application/x-ndjson'})
+                response = conn.getresponse()
+                result = json.loads(response.read().decode('utf-8'))
+                if response.status >= 300:
+                    errors = len(events)
+                elif result.get('errors'):
+                    errors = sum(1 for item in result['items']
+                                 if item['index'].get('status', 500) >= 300)
+            except Exception as e:
+                print('Bulk request failed: %s' % e, file=sys.stderr)
+                errors = len(events)
+                conn.close()
+                conn = cls(host, port, timeout=60)
+            self.stats.record(len(events) - errors, time.time() - started, errors=errors)
+        conn.close()
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate log events at a target rate.')
+    parser.add_argument('--mode', choices=['udp', 'bulk'], default='udp')
+    parser.add_argument('--dest', default=DEST, help='Logstash host for udp mode')
+    parser.add_argument('--port', type=int, default=PORT, help='Logstash port for udp mode')
+    parser.add_argument('--url', default='http://localhost:9200',
+                        help='Elasticsearch URL for bulk mode')
+    parser.add_argument('--index', default='logstash-%Y.%m.%d',
+                        help='strftime pattern of the index written in bulk mode')
+    parser.add_argument('--doc-type', default='doc')
+    parser.add_argument('--rate', type=float, default=1000, help='Target events per second')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='Seconds to run for, 0 runs until interrupted')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='Events per bulk request')
+    parser.add_argument('--workers', type=int, default=2, help='Bulk sending threads')
+    parser.add_argument('--report-interval', type=float, default=5)
+    parser.add_argument('--seed', default=os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), 'seed.txt'))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.seed, 'rb') as f:
+        chain = MarkovChain(f.read().decode('utf-8').split())
+
+    stats = Stats()
+    sender = BulkSender(args, stats) if args.mode == 'bulk' else UdpSender(args, stats)
+    batch = args.batch_size if args.mode == 'bulk' else max(int(args.rate / 100), 1)
+    host = socket.gethostname()
+    seq = 0
+    next_report = stats.started + args.report_interval
+
+    try:
+        while not args.duration or time.time() - stats.started < args.duration:
+            # Send whatever is due to keep up with the target rate, then nap
+            due = int((time.time() - stats.started) * args.rate) - seq
+            if due < batch:
+                time.sleep(min(float(batch - due) / args.rate, 0.05))
+            else:
+                events = [event(chain, seq + n, host) for n in range(batch)]
+                seq += batch
+                sender.send(events)
+            if time.time() >= next_report:
+                print(json.dumps(stats.report()), file=sys.stderr)
+                next_report += args.report_interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sender.close()
+
+    print(json.dumps(stats.report(final=True)))
+
+
+if __name__ == '__main__':
+    main()
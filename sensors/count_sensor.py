@@ -1,61 +1,243 @@
 from st2reactor.sensor.base import PollingSensor
-from elasticsearch import Elasticsearch
+import elasticsearch
 import json
-import eventlet
+import os
+import sys
+import time
+
+# Share the client plumbing with the pack actions
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'actions', 'lib'))
+from utils import get_client  # noqa: E402
+from poll_scheduler import PollScheduler  # noqa: E402
+from window_counter import WindowCounter  # noqa: E402
+from instrumentation import get_emitter  # noqa: E402
+from multi_cluster import connection, fan_out, merge_msearch  # noqa: E402
+import client_pool  # noqa: E402
 
 
 class ElasticsearchCountSensor(PollingSensor):
 
     def setup(self):
         self.host = self.config.get('host', None)
-        self.port = self.config.get('port', None)
-        self.http_auth = self.config.get('http_auth', None)
-        self.use_ssl = self.config.get('use_ssl', False)
+        self.port = self.config.get('port', None)
+        self.http_auth = self.config.get('http_auth', None)
+        self.use_ssl = self.config.get('use_ssl', False)
         self.query_window = self.config.get('query_window', 60)
         self.query_string = self.config.get('query_string', '{}')
         self.cooldown_multiplier = self.config.get('cooldown_multiplier', 0)
         self.count_threshold = self.config.get('count_threshold', 0)
         self.index = self.config.get('index', '_all')
+        self.count_only = self.config.get('count_only', False)
+        self.sample_size = self.config.get('sample_size', 10)
+        self.sample_fields = self.config.get('sample_fields', None)
+        self.incremental = self.config.get('incremental', False)
+        self.ingest_delay = self.config.get('ingest_delay', 10)
+        self.clusters = self.config.get('clusters', None) or []
         self._trigger_ref = "elasticsearch.count_event"
         self.LOG = self.sensor_service.get_logger(__name__)
-        self.query = json.loads(self.query_string)
+        self.queries = self._load_queries()
+        self.scheduler = PollScheduler(
+            self.get_poll_interval(),
+            min_interval=self.config.get('min_poll_interval', None),
+            max_interval=self.config.get('max_poll_interval', None),
+            slow_response=self.config.get('slow_response', 5),
+            approach_ratio=self.config.get('approach_ratio', 0.8))
+        self.counters = {}
+        for query in self.queries:
+            if query['incremental']:
+                state = self.sensor_service.get_value(self._state_key(query), local=True)
+                self.counters[query['name']] = WindowCounter.loads(
+                    query['query_window'], self.get_poll_interval(), state,
+                    delay=query['ingest_delay'])
+        # Clients are looked up on each poll, a cluster which is down doesn't
+        # prevent the sensor from starting and failed lookups back off
         self.es = None
+        self.emitter = get_emitter(self.config, labels={'sensor': 'count_sensor'})
 
-        try:
-            self.es = Elasticsearch([{'host': self.host, 'port': self.port,
-                                    'http_auth': self.http_auth,
-                                    'use_ssl': self.use_ssl}])
-        except Exception:
-            raise
+    def _load_queries(self):
+        """
+        Return the list of named queries to evaluate on each poll.
+
+        Each entry of the `queries` config option may override the index,
+        query_window, count_threshold, cooldown_multiplier, count_only,
+        sample_size, sample_fields, incremental and ingest_delay options. Without
+        `queries` the top level query_string is the only query evaluated.
+        """
+        queries = []
+        configured = self.config.get('queries', None)
+        for i, q in enumerate(configured or [{}]):
+            queries.append({
+                'name': q.get('name', 'query%d' % i if configured else 'default'),
+                'index': q.get('index', self.index),
+                'query': json.loads(q.get('query_string', self.query_string)),
+                'query_window': q.get('query_window', self.query_window),
+                'count_threshold': q.get('count_threshold', self.count_threshold),
+                'cooldown_multiplier': q.get('cooldown_multiplier', self.cooldown_multiplier),
+                'count_only': q.get('count_only', self.count_only),
+                'sample_size': q.get('sample_size', self.sample_size),
+                'sample_fields': q.get('sample_fields', self.sample_fields),
+                'incremental': q.get('incremental', self.incremental),
+                'ingest_delay': q.get('ingest_delay', self.ingest_delay)
+            })
+        return queries
+
+    def _get_client(self, cluster=None):
+        # Registry lookups are cheap and keep the pooled client from being evicted
+        conn = connection(cluster or {}, {'host': self.host, 'port': self.port,
+                                          'http_auth': self.http_auth, 'use_ssl': self.use_ssl,
+                                          'url_prefix': self.config.get('url_prefix', None)})
+        return get_client(conn['host'], port=conn['port'], url_prefix=conn['url_prefix'],
+                          http_auth=conn['http_auth'] or None, use_ssl=conn['use_ssl'],
+                          pool_maxsize=self.config.get('pool_maxsize', None),
+                          client_idle_ttl=self.config.get('client_idle_ttl', None),
+                          check_ttl=self.config.get('check_ttl', None))
+
+    @staticmethod
+    def _state_key(query):
+        return 'count_sensor.%s.window' % query['name']
+
+    def _query_payload(self, query, time_range=None):
+        if time_range is None:
+            timestamp_range = {"gte": "now-%ss" % query['query_window']}
+        else:
+            # Incremental counting only looks at the slice since the last poll
+            timestamp_range = {"gte": time_range[0], "lt": time_range[1],
+                               "format": "epoch_millis"}
+        payload = {"query": {
+                   "bool": {
+                       "must": [query['query']],
+                       "filter": {
+                           "range": {
+                               "@timestamp": timestamp_range}}}}}
+        # Only the total is needed to compare with the threshold, documents
+        # are fetched solely as samples for the trigger payload
+        payload['size'] = 0 if query['count_only'] else query['sample_size']
+        if payload['size'] and query['sample_fields']:
+            payload['_source'] = query['sample_fields']
+        if time_range is not None and time_range[2]:
+            # Reseeding the whole window, count it in slices
+            payload['aggs'] = {"slices": {"date_histogram": {
+                "field": "@timestamp",
+                "interval": "%ds" % (self.counters[query['name']].slice_length // 1000)}}}
+        return payload
+
+    def _window_total(self, query, time_range, data):
+        """
+        Fold the response of an incremental query into its window and return the total.
+        """
+        counter = self.counters[query['name']]
+        if time_range[2]:
+            buckets = [(b['key'], b['doc_count'])
+                       for b in data['aggregations']['slices']['buckets']]
+            total = counter.seed(time_range[1], buckets)
+        else:
+            total = counter.add(time_range[1], data['hits'].get('total', 0))
+        self.sensor_service.set_value(self._state_key(query), counter.dumps(), local=True)
+        return total
 
     def poll(self):
-        query_payload = {"query": {
-                         "bool": {
-                             "must": [self.query],
-                             "filter": {
-                                 "range": {
-                                     "@timestamp": {
-                                         "gte": "now-%ss" %
-                                         self.query_window}}}}}}
-        data = self.es.search(index=self.index, body=query_payload)
-
-        hits = data.get('hits', None)
-        if hits.get('total', 0) > self.count_threshold:
-            payload = dict()
-            payload['results'] = hits
-            payload['results']['query'] = query_payload
-            self.LOG.info("Dispatching trigger")
-            self.sensor_service.dispatch(trigger=self._trigger_ref,
-                                         payload=payload)
-            cooldown = (self.query_window * self.cooldown_multiplier)
-            self.LOG.info("Cooling down for %i seconds" % cooldown)
-            eventlet.sleep(cooldown)
+        try:
+            self._poll()
+        finally:
+            self._emit_metrics()
+
+    def _emit_metrics(self):
+        if self.emitter is None:
+            return
+        try:
+            self.emitter.emit()
+        except Exception as e:  # noqa
+            self.LOG.warning("Failed to emit metrics: %s" % e)
+
+    def _poll(self):
+        # Evaluate every query which isn't cooling down in a single _msearch round trip
+        queries = [q for q in self.queries if not self.scheduler.cooling_down(q['name'])]
+        if not queries:
+            self.LOG.debug("All queries are cooling down, skipping poll")
+            return
+
+        body = []
+        payloads = []
+        ranges = []
+        now = int(time.time() * 1000)
+        for query in queries:
+            time_range = None
+            if query['incremental']:
+                time_range = self.counters[query['name']].next_range(now)
+            query_payload = self._query_payload(query, time_range)
+            body.extend([{'index': query['index']}, query_payload])
+            payloads.append(query_payload)
+            ranges.append(time_range)
+
+        started = time.time()
+        try:
+            responses = self._msearch(body, queries)
+        except elasticsearch.ElasticsearchException as e:
+            self.LOG.error("Count queries failed: %s" % e)
+            self._reschedule(time.time() - started, failed=True)
+            return
+        elapsed = time.time() - started
+
+        failed = approaching = False
+        for query, query_payload, time_range, data in zip(queries, payloads, ranges, responses):
+            if 'error' in data:
+                self.LOG.error("Query %s failed: %s" % (query['name'], data['error']))
+                failed = True
+                continue
+            if data.get('partial') and time_range is not None:
+                # Counting the slice from some clusters only would lose documents for good
+                self.LOG.error("Query %s failed on some clusters: %s" % (query['name'],
+                                                                        data['clusters']))
+                failed = True
+                continue
+            hits = data.get('hits', None)
+            if time_range is not None:
+                hits['total'] = self._window_total(query, time_range, data)
+            total = hits.get('total', 0)
+            approaching = approaching or self.scheduler.approaching(
+                total, query['count_threshold'])
+            if total > query['count_threshold']:
+                payload = dict()
+                payload['name'] = query['name']
+                payload['results'] = hits
+                payload['results']['query'] = query_payload
+                if 'clusters' in data:
+                    payload['clusters'] = data['clusters']
+                self.LOG.info("Dispatching trigger for query %s" % query['name'])
+                self.sensor_service.dispatch(trigger=self._trigger_ref,
+                                             payload=payload)
+                cooldown = query['query_window'] * query['cooldown_multiplier']
+                self.LOG.info("Query %s cooling down for %i seconds" % (query['name'], cooldown))
+                self.scheduler.cool_down(query['name'], cooldown)
+
+        self._reschedule(elapsed, failed=failed, approaching=approaching)
+
+    def _msearch(self, body, queries):
+        """
+        Return the _msearch responses of `queries`, summed over all clusters when several are
+        configured.
+        """
+        if not self.clusters:
+            self.es = self._get_client()
+            return self.es.msearch(body=body)['responses']
+
+        outcomes = fan_out(self.clusters,
+                           lambda cluster: self._get_client(cluster).msearch(body=body))
+        if all(o['error'] for o in outcomes):
+            raise elasticsearch.ElasticsearchException(
+                "Failed on every cluster: %s" % '; '.join(o['error'] for o in outcomes))
+        return merge_msearch(outcomes, [0 if q['count_only'] else q['sample_size']
+                                        for q in queries])
+
+    def _reschedule(self, elapsed, failed=False, approaching=False):
+        interval = self.scheduler.record(elapsed, failed=failed, approaching=approaching)
+        if interval != self.get_poll_interval():
+            self.LOG.info("Adjusting poll interval to %s seconds" % interval)
+            self.set_poll_interval(interval)
 
     def cleanup(self):
         # This is called when the st2 system goes down.
-        # You can perform cleanup operations like
-        # closing the connections to external system here.
-        pass
+        client_pool.registry.clear()
 
     def add_trigger(self, trigger):
         # This method is called when trigger is created
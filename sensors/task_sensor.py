@@ -0,0 +1,79 @@
+from st2reactor.sensor.base import PollingSensor
+import elasticsearch
+import os
+import sys
+import time
+
+# Share the client plumbing with the pack actions
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'actions', 'lib'))
+from utils import get_client  # noqa: E402
+from multi_cluster import connection  # noqa: E402
+from task_tracker import TaskStore, check  # noqa: E402
+import client_pool  # noqa: E402
+
+
+class ElasticsearchTaskSensor(PollingSensor):
+    """
+    Follow the operations started with `submit_only` and report their progress.
+
+    A task_progress trigger is dispatched whenever the completed fraction of
+    an operation changes, and a task_completed trigger once it's done, after
+    which the operation isn't tracked anymore.
+    """
+
+    def setup(self):
+        self.LOG = self.sensor_service.get_logger(__name__)
+        self.store = TaskStore(self.sensor_service)
+        self.defaults = {'host': self.config.get('host', None),
+                         'port': self.config.get('port', None),
+                         'url_prefix': self.config.get('url_prefix', None),
+                         'http_auth': self.config.get('http_auth', None),
+                         'use_ssl': self.config.get('use_ssl', False)}
+
+    def _get_client(self, record):
+        # Operations are checked on the cluster they were submitted to
+        conn = connection(record.get('connection') or {}, self.defaults)
+        return get_client(conn['host'], port=conn['port'], url_prefix=conn['url_prefix'],
+                          http_auth=conn['http_auth'] or None, use_ssl=conn['use_ssl'],
+                          pool_maxsize=self.config.get('pool_maxsize', None),
+                          client_idle_ttl=self.config.get('client_idle_ttl', None),
+                          check_ttl=self.config.get('check_ttl', None))
+
+    def poll(self):
+        for record in self.store.list():
+            try:
+                status = check(self._get_client(record), record)
+            except elasticsearch.ElasticsearchException as e:
+                self.LOG.error("Failed to check task %s: %s" % (record['id'], e))
+                continue
+
+            payload = {'id': record['id'], 'kind': record['kind'],
+                       'progress': status.progress, 'details': status.details}
+            if status.done:
+                payload['success'] = status.success
+                payload['elapsed'] = int(time.time()) - record['submitted']
+                self.LOG.info("Task %s is done, success: %s" % (record['id'], status.success))
+                self.sensor_service.dispatch(trigger="elasticsearch.task_completed",
+                                             payload=payload)
+                self.store.delete(record['id'])
+            elif status.progress != record['progress']:
+                self.sensor_service.dispatch(trigger="elasticsearch.task_progress",
+                                             payload=payload)
+                record['progress'] = status.progress
+                self.store.save(record)
+
+    def cleanup(self):
+        # This is called when the st2 system goes down.
+        client_pool.registry.clear()
+
+    def add_trigger(self, trigger):
+        # This method is called when trigger is created
+        pass
+
+    def update_trigger(self, trigger):
+        # This method is called when trigger is updated
+        pass
+
+    def remove_trigger(self, trigger):
+        # This method is called when trigger is deleted
+        pass
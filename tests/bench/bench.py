@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+"""
+Benchmark the pack actions and the count sensor against a fake Elasticsearch.
+
+Every scenario runs an action entry point in-process, the same way st2
+would, against the stand-in from fake_es.py. Wall time, requests, bytes
+sent and received, and peak Python memory, which includes the allocations
+of the in-process fake server, are reported per scenario. The first run
+of each scenario starts without a pooled client and is reported as
+`cold`. The remaining runs are averaged as `warm`.
+
+Run it with the Python of the pack virtualenv so st2common is importable:
+
+    python tests/bench/bench.py --indices 2000 --latency 0.002
+    python tests/bench/bench.py --save baseline.json
+    python tests/bench/bench.py --baseline baseline.json --tolerance 25
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path[:0] = [os.path.dirname(os.path.abspath(__file__)),
+                os.path.join(ROOT, 'actions'), os.path.join(ROOT, 'actions', 'lib'),
+                os.path.join(ROOT, 'sensors')]
+
+from fake_es import FakeElasticsearch  # noqa: E402
+
+CONNECTION = {'url_prefix': None, 'http_auth': None, 'use_ssl': False, 'master_only': False}
+CURATOR = dict(CONNECTION, curator_json=None, dry_run=False, ignore_empty_list=False,
+               continue_if_exception=False, disable_action=False, timeout_override=None,
+               allow_ilm_indices=None)
+PATTERN = '{"filtertype": "pattern", "kind": "prefix", "value": "logstash-"}'
+# The first ten indices, for scenarios whose cost grows with every index acted on
+FEW = '{"filtertype": "pattern", "kind": "prefix", "value": "logstash-0000"}'
+REINDEX_BODY = '{"source": {"index": "REINDEX_SELECTION"}, "dest": {"index": "logstash-00010"}}'
+JOB = '''
+actions:
+  1:
+    action: close
+    options: {}
+    filters: [{filtertype: pattern, kind: prefix, value: logstash-0000}]
+  2:
+    action: open
+    options: {}
+    filters: [{filtertype: pattern, kind: prefix, value: logstash-0000}]
+  3:
+    action: replicas
+    options: {count: 2}
+    filters: [{filtertype: pattern, kind: prefix, value: logstash-}]
+'''
+
+
+KeyValuePair = collections.namedtuple('KeyValuePair', 'name value')
+
+
+class DatastoreService(object):
+    """
+    In-memory key-value store standing in for the st2 action and sensor services.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.dispatched = 0
+
+    def get_logger(self, name):
+        import logging
+        return logging.getLogger(name)
+
+    def get_value(self, name, local=True, **kwargs):
+        return self.values.get(name)
+
+    def set_value(self, name, value, ttl=None, local=True, **kwargs):
+        self.values[name] = value
+        return True
+
+    def delete_value(self, name, local=True, **kwargs):
+        return self.values.pop(name, None) is not None
+
+    def list_values(self, local=True, prefix=None):
+        return [KeyValuePair(name, value) for name, value in sorted(self.values.items())
+                if name.startswith(prefix or '')]
+
+    def dispatch(self, trigger, payload=None, trace_tag=None):
+        self.dispatched += 1
+
+
+def pack_config(es, **extra):
+    return dict({'host': '127.0.0.1', 'port': es.port}, **extra)
+
+
+def curator_action(action, **params):
+    def run(es, opts):
+        from curator_runner import CuratorRunner
+        runner = CuratorRunner(config=pack_config(es, **opts.get('pack_config', {})))
+        try:
+            runner.run(action=action, **dict(CURATOR, **params))
+        except SystemExit as e:
+            if e.code:
+                raise
+    return run
+
+
+def snapshot_deletion(**params):
+    delete = curator_action('snapshots.delete_snapshots', **params)
+
+    def run(es, opts):
+        # Every run deletes the same snapshots
+        es.deleted_snapshots.clear()
+        delete(es, opts)
+    return run
+
+
+def submit_and_track(**params):
+    def run(es, opts):
+        from curator_runner import CuratorRunner
+        from tasks import TasksRunner
+        for runner in (CuratorRunner, TasksRunner):
+            runner = runner(config=pack_config(es))
+            runner.action_service = opts['datastore']
+            if isinstance(runner, CuratorRunner):
+                runner.run(action='indices.reindex', **dict(CURATOR, **params))
+            else:
+                runner.run(action='tasks.status', **CONNECTION)
+    return run
+
+
+def job_action(job):
+    def run(es, opts):
+        from jobs import JobRunner
+        runner = JobRunner(config=pack_config(es))
+        runner.run(action='jobs.run', job=job, include_metrics=False, **CONNECTION)
+    return run
+
+
+def search_action(action, **params):
+    def run(es, opts):
+        from search import SearchRunner
+        runner = SearchRunner(config=pack_config(es, **opts.get('pack_config', {})))
+        runner.action_service = opts['datastore']
+        defaults = {'q': '*', 'df': None, 'default_operator': None, 'from': 0, 'size': 10,
+                    'pretty': False, 'index': None, 'filters': None, 'return_object': True,
+                    'body': '{"query": {"match_all": {}}}', 'interval': None, 'terms': None,
+                    'metrics': None}
+        runner.run(action=action, **dict(CONNECTION, **dict(defaults, **params)))
+    return run
+
+
+def count_sensor(polls, queries):
+    def run(es, opts):
+        from count_sensor import ElasticsearchCountSensor
+        config = pack_config(es, queries=[
+            {'name': 'q%d' % i, 'index': 'logstash-*', 'query_string': '{"match_all": {}}',
+             'count_threshold': 10 ** 9} for i in range(queries)])
+        sensor = ElasticsearchCountSensor(sensor_service=opts['datastore'], config=config,
+                                          poll_interval=30)
+        sensor.setup()
+        for _ in range(polls):
+            sensor.poll()
+    return run
+
+
+def client_lookups(count):
+    def run(es, opts):
+        from utils import get_client
+        for _ in range(count):
+            get_client('127.0.0.1', port=es.port)
+    return run
+
+
+def bulk_action(docs):
+    def run(es, opts):
+        from bulk import BulkRunner
+        path = os.path.join(opts['tmpdir'], 'docs.jsonl')
+        if not os.path.exists(path):
+            with open(path, 'w') as fh:
+                for n in range(docs):
+                    fh.write(json.dumps({'seq': n, 'message': 'x' * 200}) + '\n')
+        runner = BulkRunner(config=pack_config(es))
+        runner.run(action='index.bulk', input_file=path, index='bench', doc_type='doc',
+                   op_type='index', id_field=None, pipeline=None, batch_size=1000,
+                   batch_bytes=5242880, concurrency=4, max_retries=3, initial_backoff=1,
+                   refresh=False, **CONNECTION)
+    return run
+
+
+def scenarios(args):
+    catalog = {'pack_config': {'catalog_dir': None}}
+    return [
+        ('client.get_client', client_lookups(200), {}),
+        ('indices.show', curator_action('indices.show', filters=None), {}),
+        ('indices.show.catalog', curator_action('indices.show', filters=None), catalog),
+        ('indices.replicas', curator_action('indices.replicas', filters=PATTERN, count=2,
+                                            wait_for_completion=False), {}),
+        ('indices.replicas.parallel', curator_action(
+            'indices.replicas', filters=PATTERN, count=2, wait_for_completion=False,
+            concurrency=8, per_node_concurrency=0, chunk_size=50), {}),
+        ('indices.replicas.admission', curator_action(
+            'indices.replicas', filters=PATTERN, count=2, wait_for_completion=False,
+            admission_policy='wait'), {}),
+        ('indices.forcemerge.estimate', curator_action(
+            'indices.forcemerge', filters=PATTERN, max_num_segments=1, estimate_cost=True),
+         {}),
+        ('indices.reindex.adaptive', curator_action(
+            'indices.reindex', filters=FEW, request_body=REINDEX_BODY, adaptive=True,
+            adjust_interval=0, requests_per_second=-1), {}),
+        ('tasks.status', submit_and_track(
+            filters=FEW, request_body=REINDEX_BODY, submit_only=True), {}),
+        ('snapshots.delete_snapshots', snapshot_deletion(
+            filters='{"filtertype": "none"}', repositories=['repo1', 'repo2'],
+            delete_delay=0, retry_interval=0, retry_count=3), {}),
+        ('jobs.run', job_action(JOB), {}),
+        ('search.q.index', search_action('search.q', index='logstash-*'), {}),
+        ('search.q.filters', search_action('search.q', filters=PATTERN,
+                                           index_cache_ttl=0), {}),
+        ('search.body', search_action('search.body', index='logstash-*'), {}),
+        ('search.body.scroll', search_action(
+            'search.body', index='logstash-*', stream=True, stream_mode='scroll',
+            page_size=1000, scroll='1m', max_hits=args.hits), {}),
+        ('search.body.search_after', search_action(
+            'search.body', index='logstash-*', stream=True, stream_mode='search_after',
+            page_size=1000, max_hits=args.hits,
+            body='{"query": {"match_all": {}}, "sort": [{"seq": "asc"}]}'), {}),
+        ('search.aggregate', search_action(
+            'search.aggregate', index='logstash-*', interval='1h', terms=['host'],
+            metrics=['avg:bytes'], page_size=500), {}),
+        ('count_sensor.poll', count_sensor(polls=20, queries=5), {}),
+        ('index.bulk', bulk_action(args.hits), {}),
+    ]
+
+
+def measure(es, fn, opts):
+    es.reset()
+    tracemalloc.start()
+    started = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn(es, opts)
+    elapsed = time.time() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'wall': elapsed, 'requests': es.requests, 'bytes_in': es.bytes_in,
+            'bytes_out': es.bytes_out, 'peak_memory': peak,
+            'endpoints': dict(es.endpoints)}
+
+
+def run_scenario(es, name, fn, opts, repeat):
+    import client_pool
+    client_pool.registry.clear()
+    tmpdir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        opts = dict(opts, tmpdir=tmpdir, datastore=DatastoreService())
+        if 'pack_config' in opts and 'catalog_dir' in opts['pack_config']:
+            opts['pack_config'] = dict(opts['pack_config'], catalog_dir=tmpdir)
+        runs = [measure(es, fn, opts) for _ in range(max(repeat, 1))]
+    finally:
+        shutil.rmtree(tmpdir)
+    warm = runs[1:] or runs
+    return {
+        'name': name,
+        'cold': round(runs[0]['wall'], 4),
+        'warm': round(sum(r['wall'] for r in warm) / len(warm), 4),
+        'requests': runs[0]['requests'],
+        'warm_requests': warm[-1]['requests'],
+        'bytes_in': runs[0]['bytes_in'],
+        'bytes_out': runs[0]['bytes_out'],
+        'peak_memory': max(r['peak_memory'] for r in runs),
+        'endpoints': runs[0]['endpoints']
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the list of regressions of `results` against `baseline`.
+    """
+    previous = dict((r['name'], r) for r in baseline)
+    regressions = []
+    for result in results:
+        before = previous.get(result['name'])
+        if not before:
+            continue
+        for key in ('warm', 'requests', 'warm_requests', 'bytes_in', 'bytes_out',
+                    'peak_memory'):
+            # Ignore noise on tiny values, a request more is always a regression
+            floor = 0 if 'requests' in key else (0.005 if key == 'warm' else 65536)
+            if result[key] > max(before[key] * (1 + tolerance / 100.0), before[key] + floor):
+                regressions.append('{0} {1}: {2} -> {3}'.format(
+                    result['name'], key, before[key], result[key]))
+    return regressions
+
+
+def print_table(results):
+    header = '{0:<28} {1:>9} {2:>9} {3:>6} {4:>6} {5:>10} {6:>10} {7:>10}'
+    print(header.format('scenario', 'cold s', 'warm s', 'reqs', 'warm', 'kb sent',
+                        'kb recv', 'peak kb'))
+    for r in results:
+        print(header.format(r['name'], '%.4f' % r['cold'], '%.4f' % r['warm'],
+                            r['requests'], r['warm_requests'], r['bytes_in'] // 1024,
+                            r['bytes_out'] // 1024, r['peak_memory'] // 1024))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--indices', type=int, default=500, help='Number of simulated indices')
+    parser.add_argument('--docs', type=int, default=1000, help='Documents per index')
+    parser.add_argument('--doc-size', type=int, default=200, help='Bytes of text per document')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every response')
+    parser.add_argument('--hits', type=int, default=10000,
+                        help='Hits streamed and documents bulk indexed')
+    parser.add_argument('--snapshots', type=int, default=50,
+                        help='Snapshots of every simulated repository')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per scenario')
+    parser.add_argument('--only', action='append', help='Run scenarios starting with this')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with results saved by --save')
+    parser.add_argument('--tolerance', type=float, default=20,
+                        help='Percentage above the baseline reported as a regression')
+    args = parser.parse_args(argv)
+
+    # Import everything up front so that import costs don't land on the first scenario
+    for module in ('bulk', 'count_sensor', 'curator_runner', 'jobs', 'search', 'tasks',
+                   'utils'):
+        __import__(module)
+
+    es = FakeElasticsearch(indices=args.indices, docs_per_index=args.docs,
+                           doc_size=args.doc_size, latency=args.latency,
+                           snapshots=args.snapshots).start()
+    results = []
+    try:
+        for name, fn, opts in scenarios(args):
+            if args.only and not any(name.startswith(o) for o in args.only):
+                continue
+            results.append(run_scenario(es, name, fn, opts, args.repeat))
+    finally:
+        es.stop()
+
+    print_table(results)
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,394 @@
+"""
+In-process stand-in for an Elasticsearch 6.x HTTP endpoint.
+
+It simulates a cluster of `indices` indices holding `docs_per_index`
+documents of about `doc_size` bytes each, answers every request after
+`latency` seconds and counts the requests and bytes it sees. Only the
+parts of the APIs used by the pack are implemented.
+"""
+from collections import Counter
+import json
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+
+CREATION_DATE = 1500000000000
+NODES = ('node-1', 'node-2', 'node-3')
+# Distinct keys of every composite aggregation source
+HISTOGRAM_KEYS = 24
+TERMS_KEYS = 100
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, don't let Nagle delay the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, response = self.server.fake.handle(self.command, self.path, body)
+        data = json.dumps(response).encode('utf-8') if response is not None else b''
+        self.server.fake.record(self.command, self.path, len(body) + len(self.path), len(data))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+
+class FakeElasticsearch(object):
+
+    def __init__(self, indices=100, prefix='logstash-', docs_per_index=1000, doc_size=200,
+                 latency=0.0, snapshots=0, version='6.8.0'):
+        self.names = ['{0}{1:05d}'.format(prefix, i) for i in range(indices)]
+        self.closed = set()
+        self.docs_per_index = docs_per_index
+        self.doc_size = doc_size
+        self.latency = latency
+        self.snapshots = snapshots
+        self.version = version
+        self.state_version = 1
+        self._scrolls = {}
+        # Reindex tasks, completed once they've been looked up `task_polls` times
+        self.tasks = {}
+        self.task_polls = 2
+        # Write thread pool rejections reported by every node
+        self.rejected = 0
+        # Cluster health and load reported to the admission checks
+        self.health = 'green'
+        self.pending_tasks = 0
+        self.write_queue = 0
+        self.disk_used = 0.5
+        # Deleted snapshots per repository, and deletions to fail as concurrent ones
+        self.deleted_snapshots = {}
+        self.snapshot_conflicts = 0
+        self._lock = threading.Lock()
+        self.reset()
+        self._server = None
+
+    # Lifecycle
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.fake = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    # Accounting
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.endpoints = Counter()
+
+    def record(self, method, path, bytes_in, bytes_out):
+        endpoint = '/'.join(p for p in urlparse(path).path.split('/') if p.startswith('_'))
+        with self._lock:
+            self.requests += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.endpoints['{0} /{1}'.format(method, endpoint)] += 1
+
+    # Routing
+
+    def handle(self, method, path, body):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(path)
+        parts = [unquote(p) for p in url.path.strip('/').split('/') if p]
+        params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        body = json.loads(body.decode('utf-8')) if body and parts[-1:] not in (
+            ['_bulk'], ['_msearch']) else body
+
+        if not parts:
+            return 200, {'name': 'fake', 'version': {'number': self.version}}
+        if method == 'HEAD':
+            return (200 if len(parts) == 1 and parts[0] in self.names else 404), None
+        if method == 'DELETE' and len(parts) == 1 and not parts[0].startswith('_'):
+            return 200, self.delete_indices(parts[0])
+        if parts[0] == '_aliases':
+            return 200, {'acknowledged': True}
+        if parts[0] == '_cluster' and parts[1:2] == ['health']:
+            return 200, {'cluster_name': 'fake', 'status': self.health,
+                         'number_of_nodes': len(NODES),
+                         'number_of_pending_tasks': self.pending_tasks}
+        if parts[0] == '_cluster' and parts[1:2] == ['state']:
+            return 200, self.cluster_state(parts[2:])
+        if parts[0] == '_cat':
+            return 200, self.cat(parts[1], parts[2] if len(parts) > 2 else None)
+        if parts[0] == '_snapshot' and method == 'DELETE':
+            return self.delete_snapshots(parts[1], parts[2].split(','))
+        if parts[0] == '_snapshot' and parts[1:] == ['_status']:
+            return 200, {'snapshots': []}
+        if parts[0] == '_snapshot' and len(parts) == 2:
+            return 200, {parts[1]: {'type': 'fs', 'settings': {}}}
+        if parts[0] == '_snapshot' and parts[2:] == ['_verify']:
+            return 200, {'nodes': dict((node, {'name': node}) for node in NODES)}
+        if parts[0] == '_snapshot' and method == 'PUT':
+            return 200, {'accepted': True}
+        if parts[0] == '_snapshot' and parts[2] != '_all':
+            return 200, {'snapshots': [{
+                'snapshot': parts[2], 'state': 'SUCCESS',
+                'stats': {'total_size_in_bytes': len(self.names) * self.docs_per_index *
+                          self.doc_size}}]}
+        if parts[0] == '_snapshot':
+            return 200, self.snapshot_list(parts[1])
+        if parts[0] == '_reindex' and parts[-1] == '_rethrottle':
+            return 200, {'nodes': {}}
+        if parts[0] == '_reindex':
+            return 200, self.reindex(body)
+        if parts[0] == '_nodes' and parts[1:2] == ['stats']:
+            return 200, {'nodes': dict((node, {
+                'thread_pool': {
+                    'write': {'threads': 4, 'queue': self.write_queue, 'active': 1,
+                              'rejected': self.rejected},
+                    'search': {'threads': 7, 'queue': 0, 'active': 0, 'rejected': 0}},
+                'fs': {'total': {'total_in_bytes': 1 << 40, 'free_in_bytes': int(
+                    (1 << 40) * (1 - self.disk_used)), 'available_in_bytes': int(
+                        (1 << 40) * (1 - self.disk_used))}}})
+                for node in NODES)}
+        if parts[0] == '_tasks':
+            return self.task(parts[1]) if len(parts) > 1 else (200, {'nodes': {}})
+        if parts[0] == '_msearch':
+            return 200, self.msearch(body)
+        if parts[0] == '_bulk' or parts[-1] == '_bulk':
+            return 200, self.bulk(body)
+        if parts[:2] == ['_search', 'scroll']:
+            if method == 'DELETE':
+                return 200, {'succeeded': True, 'num_freed': 1}
+            return 200, self.scroll(body.get('scroll_id') if body else params['scroll_id'])
+        if parts[-1] == '_search':
+            return 200, self.search(parts[0] if len(parts) > 1 else '_all', body or {},
+                                    params)
+        if len(parts) > 1 and parts[1] == '_settings' and method == 'GET':
+            return 200, self.settings(parts[0])
+        if parts[-1] == '_settings' and method == 'PUT':
+            return 200, {'acknowledged': True}
+        if parts[-1] == '_segments':
+            return 200, {'indices': dict(
+                (n, {'shards': dict((str(s), [{'num_search_segments': 5}]) for s in range(2))})
+                for n in self.expand(parts[0] if len(parts) > 1 else None))}
+        if len(parts) > 1 and parts[1] == '_stats':
+            return 200, self.stats(parts[0])
+        if parts[-1] in ('_refresh', '_flush', '_forcemerge', '_open', '_close') or \
+                parts[-2:] == ['_flush', 'synced']:
+            return 200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+        return 404, {'error': 'unsupported by the fake: {0} {1}'.format(method, path)}
+
+    def expand(self, expression):
+        if not expression or expression == '_all':
+            return list(self.names)
+        names = []
+        for pattern in expression.split(','):
+            if pattern.endswith('*'):
+                names.extend(n for n in self.names if n.startswith(pattern[:-1]))
+            elif pattern in self.names:
+                names.append(pattern)
+        return names
+
+    # APIs
+
+    def _index_settings(self, name):
+        return {'index': {'creation_date': str(CREATION_DATE), 'number_of_shards': '2',
+                          'number_of_replicas': '1', 'uuid': 'uuid-' + name}}
+
+    def settings(self, expression):
+        return dict((n, {'settings': self._index_settings(n)}) for n in self.expand(expression))
+
+    def delete_indices(self, expression):
+        with self._lock:
+            deleted = set(self.expand(expression))
+            self.names = [n for n in self.names if n not in deleted]
+            self.state_version += 1
+        return {'acknowledged': True}
+
+    def cluster_state(self, parts):
+        state = {'cluster_name': 'fake', 'version': self.state_version,
+                 'state_uuid': 'state-uuid'}
+        if parts and 'metadata' in parts[0]:
+            state['metadata'] = {'indices': dict(
+                (n, {'state': 'close' if n in self.closed else 'open',
+                     'settings': self._index_settings(n), 'aliases': []})
+                for n in self.expand(parts[1] if len(parts) > 1 else None))}
+        return state
+
+    def stats(self, expression):
+        size = self.docs_per_index * self.doc_size
+        indices = {}
+        for n in self.expand(expression):
+            indices[n] = dict((k, {'docs': {'count': self.docs_per_index, 'deleted': 0},
+                                   'store': {'size_in_bytes': size * m},
+                                   'segments': {'count': 5 * m}})
+                              for k, m in (('primaries', 1), ('total', 2)))
+        return {'indices': indices}
+
+    def cat(self, what, expression):
+        names = self.expand(expression)
+        if what == 'indices':
+            size = self.docs_per_index * self.doc_size
+            return [{'index': n, 'uuid': 'uuid-' + n, 'status': 'close', 'pri': '2',
+                     'rep': '1', 'docs.count': None, 'store.size': None,
+                     'pri.store.size': None, 'segments.count': None}
+                    if n in self.closed else
+                    {'index': n, 'uuid': 'uuid-' + n, 'status': 'open', 'pri': '2',
+                     'rep': '1', 'docs.count': str(self.docs_per_index),
+                     'store.size': str(size * 2), 'pri.store.size': str(size),
+                     'segments.count': '20'} for n in names]
+        if what == 'shards':
+            return [{'index': n, 'node': NODES[(i + s) % len(NODES)]}
+                    for i, n in enumerate(names) for s in range(4)]
+        return []
+
+    def snapshot_list(self, repository):
+        deleted = self.deleted_snapshots.get(repository, set())
+        return {'snapshots': [{'snapshot': 'snapshot-{0:05d}'.format(i), 'state': 'SUCCESS',
+                               'indices': self.names[:10],
+                               'start_time_in_millis': CREATION_DATE + i * 86400000}
+                              for i in range(self.snapshots)
+                              if 'snapshot-{0:05d}'.format(i) not in deleted]}
+
+    def delete_snapshots(self, repository, names):
+        with self._lock:
+            if self.snapshot_conflicts:
+                self.snapshot_conflicts -= 1
+                return 503, {'error': {'type': 'concurrent_snapshot_execution_exception'},
+                             'status': 503}
+            self.deleted_snapshots.setdefault(repository, set()).update(names)
+        return 200, {'acknowledged': True}
+
+    def _hit(self, index, n):
+        return {'_index': index, '_type': 'doc', '_id': '{0}-{1}'.format(index, n),
+                '_score': 1.0, 'sort': [n],
+                '_source': {'@timestamp': CREATION_DATE + n, 'seq': n,
+                            'message': 'x' * self.doc_size}}
+
+    def _page(self, names, start, size):
+        total = len(names) * self.docs_per_index
+        hits = []
+        for n in range(start, min(start + size, total)):
+            hits.append(self._hit(names[n // self.docs_per_index], n))
+        return total, hits
+
+    def search(self, expression, body, params):
+        names = self.expand(expression)
+        size = int(params.get('size', body.get('size', 10)))
+        start = int(params.get('from', body.get('from', 0)))
+        if body.get('search_after'):
+            start = body['search_after'][0] + 1
+        total, hits = self._page(names, start, size)
+        response = {'took': 1, 'timed_out': False,
+                    '_shards': {'total': 2 * len(names), 'successful': 2 * len(names),
+                                'failed': 0},
+                    'hits': {'total': total, 'max_score': 1.0, 'hits': hits}}
+        if 'scroll' in params:
+            with self._lock:
+                scroll_id = 'scroll-{0}'.format(len(self._scrolls))
+                self._scrolls[scroll_id] = (names, start + size, size)
+            response['_scroll_id'] = scroll_id
+        if body.get('aggs'):
+            response['aggregations'] = dict(
+                (name, self.composite(agg)) for name, agg in body['aggs'].items()
+                if 'composite' in agg)
+        return response
+
+    def composite(self, agg):
+        sources = [list(source.items())[0] for source in agg['composite']['sources']]
+        keys = [()]
+        for name, source in sources:
+            if 'date_histogram' in source:
+                values = [CREATION_DATE + n * 3600000 for n in range(HISTOGRAM_KEYS)]
+            else:
+                values = ['value-{0:03d}'.format(n) for n in range(TERMS_KEYS)]
+            keys = [key + (value,) for key in keys for value in values]
+        after = agg['composite'].get('after')
+        if after:
+            after = tuple(after[name] for name, _ in sources)
+            keys = [key for key in keys if key > after]
+        buckets = []
+        for key in keys[:agg['composite'].get('size', 10)]:
+            bucket = {'key': dict(zip([name for name, _ in sources], key)),
+                      'doc_count': self.docs_per_index}
+            for name in agg.get('aggs', {}):
+                bucket[name] = {'value': 1.0}
+            buckets.append(bucket)
+        result = {'buckets': buckets}
+        if buckets:
+            result['after_key'] = buckets[-1]['key']
+        return result
+
+    def scroll(self, scroll_id):
+        names, start, size = self._scrolls[scroll_id]
+        total, hits = self._page(names, start, size)
+        self._scrolls[scroll_id] = (names, start + size, size)
+        return {'_scroll_id': scroll_id, 'took': 1,
+                'hits': {'total': total, 'max_score': 1.0, 'hits': hits}}
+
+    def msearch(self, body):
+        lines = [json.loads(l) for l in body.decode('utf-8').splitlines() if l.strip()]
+        responses = []
+        for header, query in zip(lines[::2], lines[1::2]):
+            responses.append(self.search(header.get('index'), query, {}))
+        return {'responses': responses}
+
+    def reindex(self, body):
+        with self._lock:
+            task_id = '{0}:{1}'.format(NODES[0], len(self.tasks) + 1)
+            self.tasks[task_id] = {'polls': 0, 'total': len(self.expand(
+                ','.join(body['source']['index']) if isinstance(body['source']['index'], list)
+                else body['source']['index'])) * self.docs_per_index}
+        return {'task': task_id}
+
+    def task(self, task_id):
+        task = self.tasks.get(task_id)
+        if task is None:
+            return 404, {'error': {'type': 'resource_not_found_exception'}, 'status': 404}
+        with self._lock:
+            task['polls'] += 1
+            done = task['polls'] >= self.task_polls
+        created = task['total'] if done else task['total'] * task['polls'] // self.task_polls
+        status = {'total': task['total'], 'created': created, 'updated': 0, 'deleted': 0,
+                  'batches': 1, 'version_conflicts': 0, 'noops': 0}
+        response = {'completed': done, 'task': {'node': NODES[0], 'id': task_id,
+                                                'action': 'indices:data/write/reindex',
+                                                'status': status}}
+        if done:
+            response['response'] = dict(status, failures=[])
+        return 200, response
+
+    def bulk(self, body):
+        lines = [l for l in body.decode('utf-8').splitlines() if l.strip()]
+        items = [{list(json.loads(meta))[0]: {'status': 201, 'result': 'created'}}
+                 for meta in lines[::2]]
+        return {'took': 1, 'errors': False, 'items': items}
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Check the import time of the action and sensor entry points against a budget.
+
+st2 starts a fresh interpreter for every python-script action run, so the
+modules an entry point imports are paid for on each execution. Each entry
+point is imported `--repeat` times in a new interpreter with `-X importtime`
+and the median time is compared with its budget. Modules listed as
+forbidden for an entry point, such as curator for the search actions, must
+not be imported at all. The heaviest direct imports are reported to show
+where the time goes.
+
+Run it with the Python of the pack virtualenv so st2common is importable:
+
+    python tests/bench/import_budget.py
+    python tests/bench/import_budget.py --scale 2 --save imports.json
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+ACTIONS = os.path.join(ROOT, 'actions')
+SENSORS = os.path.join(ROOT, 'sensors')
+
+# Entry point, directory it runs from, import budget in milliseconds, modules it mustn't load
+ENTRY_POINTS = [
+    ('search', ACTIONS, 120, ('curator',)),
+    ('bulk', ACTIONS, 100, ('curator',)),
+    ('tasks', ACTIONS, 100, ('curator',)),
+    ('curator_runner', ACTIONS, 200, ()),
+    ('count_sensor', SENSORS, 100, ('curator',)),
+    ('task_sensor', SENSORS, 100, ('curator',)),
+]
+
+
+def parse_importtime(output):
+    """
+    Return the (name, depth, self us, cumulative us) rows of a `-X importtime` report.
+    """
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        rows.append((name.strip(), depth, int(own), int(cumulative)))
+    return rows
+
+
+def profile(module, cwd):
+    # st2 puts the pack actions/lib directory on the path of actions and sensors
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.join(ACTIONS, 'lib')] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                               cwd=cwd, env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, universal_newlines=True)
+    _, stderr = process.communicate()
+    if process.returncode:
+        raise RuntimeError('Importing {0} failed:\n{1}'.format(module, stderr))
+    # Modules are reported after those they import, the entry point closes its own block
+    block = []
+    for row in parse_importtime(stderr):
+        block.append(row)
+        if row[1] == 0:
+            if row[0] == module:
+                return row[3], block
+            block = []
+    raise RuntimeError('No import time reported for {0}'.format(module))
+
+
+def check_entry_point(module, cwd, budget, forbidden, repeat, scale, top):
+    runs = [profile(module, cwd) for _ in range(repeat)]
+    runs.sort(key=lambda run: run[0])
+    total, rows = runs[len(runs) // 2]
+    loaded = set(name for name, _, _, _ in rows)
+    # Direct imports of the entry point, the ones to make lazy when they're heavy
+    heaviest = sorted(((name, cumulative) for name, depth, _, cumulative in rows
+                       if depth == 1), key=lambda row: -row[1])[:top]
+    return {
+        'name': module,
+        'ms': round(total / 1000.0, 1),
+        'budget_ms': budget * scale,
+        'forbidden': sorted(m for m in forbidden
+                            if m in loaded or any(n.startswith(m + '.') for n in loaded)),
+        'heaviest': [{'module': name, 'ms': round(us / 1000.0, 1)} for name, us in heaviest],
+    }
+
+
+def print_report(results):
+    header = '{0:<16} {1:>9} {2:>9}  {3}'
+    print(header.format('entry point', 'ms', 'budget', 'heaviest imports'))
+    for r in results:
+        print(header.format(r['name'], '%.1f' % r['ms'], '%.0f' % r['budget_ms'],
+                            ', '.join('{module} {ms}'.format(**h) for h in r['heaviest'])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Imports per entry point')
+    parser.add_argument('--only', action='append', help='Check entry points starting with this')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiply the budgets, for slower machines')
+    parser.add_argument('--top', type=int, default=3, help='Heaviest imports to report')
+    parser.add_argument('--save', help='Write the report to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for module, cwd, budget, forbidden in ENTRY_POINTS:
+        if args.only and not any(module.startswith(o) for o in args.only):
+            continue
+        results.append(check_entry_point(module, cwd, budget, forbidden, args.repeat,
+                                         args.scale, args.top))
+
+    print_report(results)
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    failures = []
+    for r in results:
+        if r['ms'] > r['budget_ms']:
+            failures.append('{0} imports in {1} ms, over its {2:.0f} ms budget'.format(
+                r['name'], r['ms'], r['budget_ms']))
+        for module in r['forbidden']:
+            failures.append('{0} imports {1}'.format(r['name'], module))
+    for failure in failures:
+        print('OVER BUDGET ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The pack modules import each other from actions/lib, as they do under st2
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'actions', 'lib')]
@@ -0,0 +1,88 @@
+import json
+
+from elasticsearch import TransportError
+
+from bulk_loader import BulkLoader, is_rejected
+
+
+class FakeClient(object):
+    """
+    Answers bulk requests with the statuses queued in `responses`, all 201 once they run out.
+    """
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.bodies = []
+
+    def bulk(self, body, **params):
+        self.bodies.append(body)
+        lines = [l for l in body.decode('utf-8').splitlines() if l]
+        if self.responses:
+            statuses = self.responses.pop(0)
+            if isinstance(statuses, Exception):
+                raise statuses
+        else:
+            statuses = [201] * (len(lines) // 2)
+        items = []
+        for status in statuses:
+            item = {'status': status}
+            if status == 429:
+                item['error'] = {'type': 'es_rejected_execution_exception'}
+            elif status >= 300:
+                item['error'] = {'type': 'mapper_parsing_exception', 'reason': 'bad'}
+            items.append({'index': item})
+        return {'errors': any(s >= 300 for s in statuses), 'items': items}
+
+
+def lines(count):
+    return [json.dumps({'n': n}).encode('utf-8') + b'\n' for n in range(count)]
+
+
+def test_is_rejected():
+    assert is_rejected({'status': 429})
+    assert is_rejected({'status': 503, 'error': {'type': 'es_rejected_execution_exception'}})
+    assert not is_rejected({'status': 400, 'error': {'type': 'mapper_parsing_exception'}})
+
+
+def test_batches_by_count():
+    loader = BulkLoader(FakeClient(), 'idx', batch_size=3)
+    batches = list(loader.batches(lines(7)))
+    assert [len(b) for b in batches] == [3, 3, 1]
+    assert [item[0] for item in batches[1]] == [4, 5, 6]
+
+
+def test_batches_by_bytes():
+    loader = BulkLoader(FakeClient(), 'idx', batch_size=100, batch_bytes=100)
+    batches = list(loader.batches(lines(5)))
+    assert len(batches) > 1
+    for batch in batches:
+        assert len(batch) == 1 or sum(len(m) + len(s) for _, m, s in batch) <= 100
+
+
+def test_batches_skip_blank_and_invalid_lines():
+    loader = BulkLoader(FakeClient(), 'idx', id_field='id')
+    batches = list(loader.batches([b'{"id": "a"}\n', b'\n', b'not json\n']))
+    assert len(batches) == 1 and len(batches[0]) == 1
+    assert json.loads(batches[0][0][1]) == {'index': {'_index': 'idx', '_type': 'doc',
+                                                      '_id': 'a'}}
+    assert loader.errors['parse_exception'] == 1
+    assert loader.error_samples[0]['line'] == 3
+
+
+def test_send_retries_only_rejected_items():
+    client = FakeClient([[201, 429, 400]])
+    loader = BulkLoader(client, 'idx', initial_backoff=0)
+    batch = next(loader.batches(lines(3)))
+    assert loader.send(batch) == 2
+    assert len(client.bodies) == 2
+    assert client.bodies[1] == batch[1][1] + batch[1][2]
+    assert loader.errors['mapper_parsing_exception'] == 1
+
+
+def test_send_retries_rejected_requests():
+    client = FakeClient([TransportError(429, 'rejected', {})])
+    loader = BulkLoader(client, 'idx', initial_backoff=0)
+    batch = next(loader.batches(lines(2)))
+    assert loader.send(batch) == 2
+    assert loader.stats['retried'] == 2
+    assert loader.stats['requests'] == 2
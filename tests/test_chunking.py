@@ -0,0 +1,45 @@
+from chunking import DEFAULT_MAX_URL_LENGTH, URL_RESERVE, IndexChunker, chunk_index_list, \
+    encoded_length
+
+
+def test_encoded_length_keeps_commas_and_wildcards():
+    assert encoded_length('logs-*') == 6
+    assert encoded_length('a b') == 3
+    assert encoded_length('<logs-{now/d}>') > len('<logs-{now/d}>')
+
+
+def test_chunks_fit_max_length():
+    indices = ['index-%04d' % i for i in range(100)]
+    chunks = chunk_index_list(indices, max_length=50)
+    assert [i for chunk in chunks for i in chunk] == indices
+    for chunk in chunks:
+        assert len(','.join(chunk)) <= 50
+    # 10 characters per name and a comma between them
+    assert len(chunks[0]) == 4
+
+
+def test_chunks_respect_max_count():
+    chunks = chunk_index_list(['a', 'b', 'c', 'd', 'e'], max_count=2)
+    assert chunks == [['a', 'b'], ['c', 'd'], ['e']]
+
+
+def test_name_longer_than_the_budget_gets_its_own_chunk():
+    chunks = chunk_index_list(['a', 'x' * 20, 'b'], max_length=10)
+    assert chunks == [['a'], ['x' * 20], ['b']]
+
+
+def test_empty_list_has_no_chunks():
+    assert chunk_index_list([]) == []
+
+
+def test_chunker_budget_accounts_for_the_connection():
+    chunker = IndexChunker(host='es.example.com', port=9200, url_prefix='/proxy/',
+                           use_ssl=True)
+    base = len('https://es.example.com:9200/proxy')
+    assert chunker.max_length == DEFAULT_MAX_URL_LENGTH - base - URL_RESERVE
+    assert chunker.max_count is None
+
+
+def test_chunker_csv_chunks():
+    chunker = IndexChunker(max_indices=2)
+    assert chunker.csv_chunks(['a', 'b', 'c']) == ['a,b', 'c']
@@ -0,0 +1,47 @@
+"""
+Import budget of the action and sensor entry points, see bench/import_budget.py.
+
+Set IMPORT_BUDGET_SCALE to multiply the budgets on slower machines.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
+
+import import_budget  # noqa: E402
+
+SCALE = float(os.environ.get('IMPORT_BUDGET_SCALE') or 1)
+REPEAT = 3
+
+
+def loaded(module, cwd, names):
+    """
+    Return which of `names` are in sys.modules once `module` is imported in a new interpreter.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.join(import_budget.ACTIONS, 'lib')] +
+        [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    code = 'import sys, {0}; print(",".join(n for n in {1!r} if n in sys.modules))'.format(
+        module, tuple(names))
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=cwd, env=env,
+                                     universal_newlines=True)
+    return [name for name in output.strip().split(',') if name]
+
+
+@pytest.mark.parametrize('module,cwd,budget,forbidden', import_budget.ENTRY_POINTS,
+                         ids=[e[0] for e in import_budget.ENTRY_POINTS])
+def test_import_time_within_budget(module, cwd, budget, forbidden):
+    result = import_budget.check_entry_point(module, cwd, budget, forbidden, REPEAT, SCALE, 3)
+    assert result['ms'] <= result['budget_ms'], \
+        '{0} imports in {1} ms, over its {2:.0f} ms budget, heaviest {3}'.format(
+            module, result['ms'], result['budget_ms'], result['heaviest'])
+
+
+@pytest.mark.parametrize('module,cwd,forbidden',
+                         [(m, c, f) for m, c, _, f in import_budget.ENTRY_POINTS if f],
+                         ids=[e[0] for e in import_budget.ENTRY_POINTS if e[3]])
+def test_forbidden_modules_not_imported(module, cwd, forbidden):
+    assert loaded(module, cwd, forbidden) == []
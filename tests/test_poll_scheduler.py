@@ -0,0 +1,53 @@
+from poll_scheduler import PollScheduler
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_default_bounds():
+    scheduler = PollScheduler(30)
+    assert scheduler.min_interval == 7.5
+    assert scheduler.max_interval == 240
+    # Never below the floor, nor above the base interval
+    assert PollScheduler(8).min_interval == 5
+    assert PollScheduler(2).min_interval == 2
+
+
+def test_backs_off_on_failures_and_slow_responses():
+    scheduler = PollScheduler(30, max_interval=100)
+    assert scheduler.record(0.1, failed=True) == 60
+    assert scheduler.record(10) == 100
+    assert scheduler.record(0.1) == 50
+    assert scheduler.record(0.1) == 30
+
+
+def test_speeds_up_while_approaching():
+    scheduler = PollScheduler(30, min_interval=5)
+    assert scheduler.record(0.1, approaching=True) == 5
+    assert scheduler.record(0.1) == 10
+    assert scheduler.record(0.1) == 20
+    assert scheduler.record(0.1) == 30
+
+
+def test_approaching():
+    scheduler = PollScheduler(30, approach_ratio=0.8)
+    assert scheduler.approaching(80, 100)
+    assert not scheduler.approaching(79, 100)
+    assert not scheduler.approaching(0, 0)
+
+
+def test_cooldown():
+    clock = Clock()
+    scheduler = PollScheduler(30, clock=clock)
+    scheduler.cool_down('q', 60)
+    scheduler.cool_down('other', 0)
+    assert scheduler.cooling_down('q')
+    assert not scheduler.cooling_down('other')
+    clock.now += 61
+    assert not scheduler.cooling_down('q')
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from result_shaping import flatten, hit_row, limit_size, result_total, shape_result, \
+    source_filtering
+
+HIT = {'_index': 'logs', '_id': '1', '_score': 1.0,
+       '_source': {'host': {'name': 'a'}, 'tags': ['x']},
+       'fields': {'bytes': [10], 'ips': ['1.1.1.1', '2.2.2.2']}}
+
+
+def result(hits):
+    return {'took': 1, 'hits': {'total': len(hits), 'hits': hits}}
+
+
+def test_source_filtering():
+    assert source_filtering({'size': 1}) == {'size': 1}
+    body = source_filtering({'docvalue_fields': ['a']}, includes=['x'], docvalue_fields=['a', 'b'])
+    assert body == {'_source': {'includes': ['x'], 'excludes': []},
+                    'docvalue_fields': ['a', 'b']}
+
+
+def test_flatten_keeps_arrays():
+    assert flatten({'a': {'b': 1, 'c': {}}, 'd': [1, 2]}) == {'a.b': 1, 'a.c': {}, 'd': [1, 2]}
+
+
+def test_hit_row():
+    assert hit_row(HIT) == {'_index': 'logs', '_id': '1', '_score': 1.0, 'host.name': 'a',
+                            'tags': ['x'], 'bytes': 10, 'ips': ['1.1.1.1', '2.2.2.2']}
+
+
+def test_shape_result_formats():
+    data = dict(result([HIT]), stream={'pages': 1})
+    assert shape_result(data, 'raw') is data
+    assert shape_result(data, 'hits') == {'stream': {'pages': 1}, 'total': 1, 'hits': [HIT]}
+    rows = shape_result(data, 'rows')
+    assert rows['total'] == 1 and rows['rows'][0]['host.name'] == 'a'
+    assert result_total(rows) == 1
+    assert result_total(data) == 1
+    with pytest.raises(ValueError):
+        shape_result(data, 'csv')
+
+
+def test_limit_size_drops_hits_from_the_end():
+    hits = [{'_id': str(i), '_source': {'message': 'x' * 100}} for i in range(20)]
+    limited = limit_size(result(hits), 800)
+    truncation = limited['truncation']
+    assert truncation['truncated']
+    assert truncation['returned'] + truncation['omitted'] == 20
+    assert [h['_id'] for h in limited['hits']['hits']] == \
+        [str(i) for i in range(truncation['returned'])]
+    encoded = len(json.dumps(limited))
+    assert encoded <= 800
+    assert truncation['bytes'] == encoded
+
+
+def test_limit_size_keeps_results_that_fit():
+    limited = limit_size(result([HIT]), 10000)
+    assert not limited['truncation']['truncated']
+    assert limit_size(result([HIT]), 0) == result([HIT])
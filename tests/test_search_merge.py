@@ -0,0 +1,53 @@
+from search_merge import merge_search_results, sort_directions
+
+
+def response(hits, total=None, took=1, max_score=None):
+    return {'took': took, 'timed_out': False,
+            '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0},
+            'hits': {'total': len(hits) if total is None else total, 'max_score': max_score,
+                     'hits': hits}}
+
+
+def hit(name, sort=None, score=None):
+    h = {'_id': name, '_score': score}
+    if sort is not None:
+        h['sort'] = sort
+    return h
+
+
+def test_sort_directions():
+    assert sort_directions([{'a': 'desc'}, {'b': {'order': 'asc'}}, 'c', '_score']) == \
+        [True, False, False, True]
+    assert sort_directions(None) == []
+
+
+def test_merges_by_sort_values():
+    merged = merge_search_results(
+        [response([hit('a', [1]), hit('c', [3])]), response([hit('b', [2])])],
+        size=10, sort=[{'n': 'asc'}])
+    assert [h['_id'] for h in merged['hits']['hits']] == ['a', 'b', 'c']
+    assert merged['hits']['total'] == 3
+    assert merged['_shards']['total'] == 2
+
+
+def test_descending_sort_and_missing_values_last():
+    merged = merge_search_results(
+        [response([hit('a', [1]), hit('none', [None])]), response([hit('b', [2])])],
+        size=10, sort=[{'n': 'desc'}])
+    assert [h['_id'] for h in merged['hits']['hits']] == ['b', 'a', 'none']
+
+
+def test_unsorted_hits_merge_by_score():
+    merged = merge_search_results(
+        [response([hit('low', score=0.5)], max_score=0.5),
+         response([hit('high', score=2.0)], max_score=2.0)], size=10)
+    assert [h['_id'] for h in merged['hits']['hits']] == ['high', 'low']
+    assert merged['hits']['max_score'] == 2.0
+
+
+def test_page_is_cut_after_merging():
+    merged = merge_search_results(
+        [response([hit('a', [1]), hit('c', [3])]), response([hit('b', [2]), hit('d', [4])])],
+        offset=1, size=2, sort=['n'])
+    assert [h['_id'] for h in merged['hits']['hits']] == ['b', 'c']
+    assert merged['hits']['total'] == 4
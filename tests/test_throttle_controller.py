@@ -0,0 +1,33 @@
+from adaptive_reindex import MAX_RATE_FACTOR, ThrottleController
+
+
+def test_speeds_up_with_headroom():
+    controller = ThrottleController(100, maximum=200)
+    assert controller.update(0, 0) == (150, 'headroom')
+    assert controller.update(0, 0) == (200, 'headroom')
+    assert controller.update(0, 0) == (None, 'headroom')
+
+
+def test_default_maximum_is_a_multiple_of_the_initial_rate():
+    controller = ThrottleController(100)
+    for _ in range(50):
+        controller.update(0, 0)
+    assert controller.rate == 100 * MAX_RATE_FACTOR
+
+
+def test_holds_while_queues_are_long():
+    controller = ThrottleController(100, queue_limit=50)
+    assert controller.update(0, 51) == (None, 'queue')
+    assert controller.rate == 100
+
+
+def test_slows_down_on_rejections_down_to_the_minimum():
+    controller = ThrottleController(100, minimum=40)
+    assert controller.update(3, 0) == (50, 'rejections')
+    assert controller.update(1, 0) == (40, 'rejections')
+    assert controller.update(1, 0) == (None, 'rejections')
+
+
+def test_negative_rejections_are_not_rejections():
+    controller = ThrottleController(100, maximum=1000)
+    assert controller.update(-5, 0) == (150, 'headroom')
@@ -0,0 +1,50 @@
+from window_counter import WindowCounter
+
+
+def test_first_poll_reseeds_the_whole_window():
+    counter = WindowCounter(60, 10)
+    assert counter.next_range(100000) == (40000, 100000, True)
+
+
+def test_seed_and_add_keep_the_window_total():
+    counter = WindowCounter(60, 10)
+    assert counter.seed(100000, [(40000, 1), (50000, 2), (90000, 3)]) == 6
+    assert counter.next_range(110000) == (100000, 110000, False)
+    # The slice ending at 50000 falls out of the window starting at 50000
+    assert counter.add(110000, 4) == 9
+
+
+def test_gap_longer_than_the_window_reseeds():
+    counter = WindowCounter(60, 10)
+    counter.seed(100000, [])
+    assert counter.next_range(200000)[2] is True
+
+
+def test_ingest_delay_lags_the_range():
+    counter = WindowCounter(60, 10, delay=10)
+    assert counter.next_range(100000) == (30000, 90000, True)
+    counter.seed(90000, [])
+    assert counter.next_range(110000) == (90000, 100000, False)
+
+
+def test_round_trip_through_dumps():
+    counter = WindowCounter(60, 10)
+    counter.seed(100000, [(50000, 2)])
+    restored = WindowCounter.loads(60, 10, counter.dumps())
+    assert restored.high_water == 100000
+    assert restored.total == 2
+
+
+def test_state_of_another_window_is_ignored():
+    counter = WindowCounter(60, 10)
+    counter.seed(100000, [(50000, 2)])
+    restored = WindowCounter.loads(120, 10, counter.dumps())
+    assert restored.high_water is None
+    assert restored.total == 0
+
+
+def test_longer_delay_reseeds_restored_state():
+    counter = WindowCounter(60, 10)
+    counter.seed(100000, [])
+    restored = WindowCounter.loads(60, 10, counter.dumps(), delay=30)
+    assert restored.next_range(110000)[2] is True